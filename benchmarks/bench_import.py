@@ -0,0 +1,87 @@
+"""
+mer 启动耗时基准：在全新解释器中反复执行 `import mer`，统计导入耗时中位数，
+并列出导入后已加载的重量级依赖
+
+用法：
+    python benchmarks/bench_import.py                 # 测当前 mer.py
+    git show HEAD~1:mer.py > /tmp/mer_old.py
+    python benchmarks/bench_import.py --baseline /tmp/mer_old.py
+"""
+import argparse
+import ast
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Any
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 检查导入后是否已被加载的重量级依赖
+HEAVY_MODULES = ['extract_msg', 'bs4', 'whois', 'PyPDF2', 'docx', 'openpyxl', 'pptx', 'lxml']
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import mer
+elapsed = time.perf_counter() - start
+print(repr((elapsed, [m for m in %r if m in sys.modules])))
+""" % (HEAVY_MODULES,)
+
+
+def measure(module_dir: str, runs: int) -> Dict[str, Any]:
+    """
+    在 module_dir 下用全新解释器导入 mer 共 runs 次
+
+    Returns:
+        {'median_ms', 'min_ms', 'max_ms', 'loaded'}
+    """
+    samples = []
+    loaded = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=module_dir,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        # mer 在导入时可能打印提示，结果在最后一行
+        elapsed, loaded = ast.literal_eval(out.strip().splitlines()[-1])
+        samples.append(elapsed * 1000)
+    return {
+        'median_ms': round(statistics.median(samples), 1),
+        'min_ms': round(min(samples), 1),
+        'max_ms': round(max(samples), 1),
+        'loaded': loaded,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='mer 导入耗时基准')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='每个版本的导入次数（默认 10）')
+    parser.add_argument('--baseline', metavar='PATH', help='用于对比的旧版 mer.py')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args()
+
+    results = {'current': measure(REPO_ROOT, args.runs)}
+    if args.baseline:
+        with tempfile.TemporaryDirectory(prefix='mer-bench-') as tmp:
+            shutil.copy(args.baseline, os.path.join(tmp, 'mer.py'))
+            results['baseline'] = measure(tmp, args.runs)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    for name, result in results.items():
+        print(f"{name:<9} 中位数 {result['median_ms']:7.1f} ms"
+              f"（最小 {result['min_ms']:.1f} / 最大 {result['max_ms']:.1f}）"
+              f"  已加载: {', '.join(result['loaded']) or '无'}")
+    if 'baseline' in results:
+        saved = results['baseline']['median_ms'] - results['current']['median_ms']
+        print(f"节省 {saved:.1f} ms（{saved / results['baseline']['median_ms']:.0%}）")
+
+
+if __name__ == '__main__':
+    main()
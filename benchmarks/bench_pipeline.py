@@ -0,0 +1,250 @@
+"""
+分析流水线基准：对一个 .eml 语料目录逐封执行 parse_email() 与全部检测器，
+统计每个检测器和端到端的吞吐量、延迟分位数以及峰值内存
+
+WHOIS 查询被替换为本地桩函数（按域名哈希给出固定的注册日期，可选模拟延迟），
+所有本地缓存均关闭，保证每次运行测到的是同样的工作量。
+
+用法：
+    python benchmarks/gen_corpus.py -o /tmp/corpus -n 500
+    python benchmarks/bench_pipeline.py /tmp/corpus -o before.json
+    # 修改代码后
+    python benchmarks/bench_pipeline.py /tmp/corpus -o after.json --compare before.json
+"""
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import mer  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+
+
+def stub_whois(latency: float):
+    """返回替代 mer._whois_lookup 的桩函数：注册时间由域名哈希决定（0-3649 天前）"""
+    def lookup(domain: str) -> Dict[str, Any]:
+        if latency:
+            time.sleep(latency)
+        age = int(hashlib.sha256(domain.encode('utf-8')).hexdigest()[:8], 16) % 3650
+        created = datetime.now(timezone.utc) - timedelta(days=age)
+        return {'creation_date': created, 'expiration_date': created + timedelta(days=3650),
+                'last_updated': None, 'warnings': []}
+    return lookup
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法分位数（输入须已排序）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    """把一组耗时（秒）汇总为毫秒级统计"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    stats = {
+        'count': len(ordered),
+        'total_s': round(total, 4),
+        'mean_ms': round(total / len(ordered) * 1000, 3) if ordered else 0.0,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        'per_sec': round(len(ordered) / total, 1) if total else 0.0,
+    }
+    for pct in PERCENTILES:
+        stats[f'p{pct}_ms'] = round(percentile(ordered, pct) * 1000, 3)
+    return stats
+
+
+def peak_rss_mb() -> float:
+    """进程峰值常驻内存（ru_maxrss 在 Linux 上以 KB 计，macOS 上以字节计）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def analyze_timed(path: str, timings: Dict[str, List[float]], early_exit: bool = False) -> None:
+    """解析并分析一封邮件，把各阶段耗时追加到 timings（提前结束时跳过的维度不计样本）"""
+    start = time.perf_counter()
+    email_data = mer.parse_email(path)
+    parsed = time.perf_counter()
+    timings['parse'].append(parsed - start)
+    try:
+        if early_exit:
+            results = mer.run_detectors(email_data, early_exit=True)
+            for key, record in email_data['timings']['detectors'].items():
+                timings[key].append(record['wall_ms'] / 1000)
+        else:
+            results = {}
+            for key, detector in mer.DETECTORS:
+                t0 = time.perf_counter()
+                results[key] = detector(email_data)
+                timings[key].append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        mer.summarize_message(email_data)
+        mer.score_results(mer.fill_skipped(results))
+        timings['score'].append(time.perf_counter() - t0)
+    finally:
+        mer.release_email_data(email_data)
+    timings['total'].append(time.perf_counter() - start)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run(files: List[str], args) -> Dict[str, Any]:
+    stages = ['parse'] + [key for key, _ in mer.DETECTORS] + ['score', 'total']
+    timings = {stage: [] for stage in stages}
+    errors = 0
+    devnull = open(os.devnull, 'w')
+
+    # 预热：导入延迟加载的依赖、编译正则、构建关键词自动机等，不计入统计
+    with contextlib.redirect_stdout(devnull):
+        for path in files[:args.warmup]:
+            analyze_timed(path, {stage: [] for stage in stages}, args.early_exit)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(devnull):
+        for _ in range(args.repeat):
+            for path in files:
+                try:
+                    analyze_timed(path, timings, args.early_exit)
+                except Exception as e:
+                    errors += 1
+                    print(f"分析失败 {path}: {type(e).__name__}: {e}", file=sys.stderr)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    devnull.close()
+
+    corpus_bytes = sum(os.path.getsize(p) for p in files) * args.repeat
+    messages = len(timings['total'])
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'ruleset': mer.ruleset_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'html_parser': mer.HTML_PARSER,
+            'corpus': os.path.abspath(args.corpus),
+            'files': len(files),
+            'repeat': args.repeat,
+            'whois_latency_ms': args.whois_latency,
+            'early_exit': args.early_exit,
+        },
+        'end_to_end': {
+            'messages': messages,
+            'errors': errors,
+            'wall_s': round(wall, 3),
+            'cpu_s': round(cpu, 3),
+            'messages_per_sec': round(messages / wall, 1) if wall else 0.0,
+            'mb_per_sec': round(corpus_bytes / wall / 1e6, 2) if wall else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_traced_mb': round(traced_peak / 1e6, 1) if traced_peak is not None else None,
+        },
+        'stages': {stage: summarize(samples) for stage, samples in timings.items() if samples},
+    }
+    manifest = os.path.join(args.corpus, 'manifest.json')
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf-8') as f:
+            report['meta']['corpus_params'] = json.load(f).get('params')
+    return report
+
+
+def print_report(report: Dict[str, Any], baseline: Dict[str, Any] = None) -> None:
+    e2e = report['end_to_end']
+    print(f"邮件 {e2e['messages']} 封（失败 {e2e['errors']}），耗时 {e2e['wall_s']} 秒，"
+          f"{e2e['messages_per_sec']} 封/秒，{e2e['mb_per_sec']} MB/秒，峰值内存 {e2e['peak_rss_mb']} MB"
+          + (f"（Python 分配峰值 {e2e['peak_traced_mb']} MB）" if e2e['peak_traced_mb'] is not None else ''))
+    header = f"{'阶段':<8}{'平均ms':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'最大':>10}{'次/秒':>11}"
+    if baseline:
+        header += f"{'p50变化':>10}"
+    print(header)
+    for stage, stats in report['stages'].items():
+        line = (f"{stage:<10}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}"
+                f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['per_sec']:>12.1f}")
+        base = (baseline or {}).get('stages', {}).get(stage)
+        if base and base['p50_ms']:
+            line += f"{(stats['p50_ms'] - base['p50_ms']) / base['p50_ms']:>+11.1%}"
+        print(line)
+    if baseline:
+        before = baseline['end_to_end']['messages_per_sec']
+        after = e2e['messages_per_sec']
+        if before:
+            print(f"端到端吞吐量: {before} -> {after} 封/秒（{(after - before) / before:+.1%}）")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='mer 分析流水线基准')
+    parser.add_argument('corpus', help='语料目录（gen_corpus.py 的输出或任意 .eml/.msg 目录）')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='整个语料重复分析的轮数（默认 1）')
+    parser.add_argument('--warmup', type=int, default=5, help='预热邮件数，不计入统计（默认 5）')
+    parser.add_argument('--whois-latency', type=float, default=0.0, metavar='MS',
+                        help='WHOIS 桩函数的模拟延迟（毫秒，默认 0）')
+    parser.add_argument('--early-exit', action='store_true',
+                        help='按开销由低到高调度检测器，结论确定后跳过其余检测器（同 mer 默认行为）')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='同时用 tracemalloc 统计 Python 分配峰值（会拖慢运行）')
+    parser.add_argument('-o', '--output', metavar='PATH', help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', metavar='PATH', help='与之前保存的 JSON 结果对比')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出到标准输出')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.corpus, '*.eml')) + glob.glob(os.path.join(args.corpus, '*.msg')))
+    if not files:
+        parser.error(f"目录中没有邮件文件: {args.corpus}")
+
+    with tempfile.TemporaryDirectory(prefix='mer-bench-') as cache_dir:
+        mer.CONFIG.update({
+            'cache_dir': cache_dir,
+            'whois_cache': False,
+            'attachment_cache': False,
+            'result_cache': False,
+            'offline': False,
+            'nrd_index': '',
+            # 桩函数不访问网络，取消按顶级域限速
+            'whois_rate': 1e9,
+            'whois_burst': 1e9,
+        })
+        mer._whois_lookup = stub_whois(args.whois_latency / 1000)
+        report = run(files, args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+SMTP 过滤代理吞吐量基准：启动一个本地替身 SMTP 收信端（sink）和 `mer.py smtp` 代理，
+用多个并发连接把语料中的邮件发给代理，统计吞吐量、延迟分位数以及收信端看到的判定头
+
+代理子进程默认以 MER_OFFLINE=1、MER_RESULT_CACHE=0 运行：不发起 WHOIS 查询，
+重复邮件也会完整分析。
+
+用法：
+    python benchmarks/gen_corpus.py -o /tmp/corpus -n 500
+    python benchmarks/bench_smtp.py /tmp/corpus -c 16 -j 4
+    python benchmarks/bench_smtp.py /tmp/corpus --proxy 127.0.0.1:10025   # 测已运行的代理
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import smtplib
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import mer  # noqa: E402
+from bench_pipeline import summarize  # noqa: E402
+
+
+class Sink(mer.SmtpServer):
+    """替身收信端：只记录收到的邮件数和 X-MER-Verdict 头"""
+
+    def __init__(self):
+        super().__init__(hostname='sink')
+        self.verdicts = Counter()
+
+    async def deliver(self, mail_from: str, rcpts: List[str], data: bytes) -> str:
+        head = data[:data.find(b'\r\n\r\n')]
+        verdict = 'none'
+        for line in head.split(b'\r\n'):
+            if line.lower().startswith(b'x-mer-verdict:'):
+                verdict = line.split(b':', 1)[1].strip().decode('ascii', 'replace')
+                break
+        self.verdicts[verdict] += 1
+        return '250 2.0.0 OK'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_sink(port: int) -> Sink:
+    """在后台线程的事件循环中运行替身收信端"""
+    sink = Sink()
+    ready = threading.Event()
+
+    def run():
+        async def main():
+            server = await asyncio.start_server(sink.handle, '127.0.0.1', port, limit=mer.SMTP_LINE_LIMIT)
+            ready.set()
+            async with server:
+                await server.serve_forever()
+        asyncio.run(main())
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return sink
+
+
+def wait_port(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def send_all(host: str, port: int, messages: List[bytes], connections: int, per_connection: int):
+    """
+    用 connections 个并发连接发送全部邮件，每个连接发送 per_connection 封后重连
+
+    Returns:
+        (每封邮件的延迟列表, 应答码计数)
+    """
+    latencies = []
+    codes = Counter()
+    lock = threading.Lock()
+
+    def worker(batch: List[bytes]) -> None:
+        client = None
+        for i, data in enumerate(batch):
+            if client is None or i % per_connection == 0:
+                if client is not None:
+                    client.quit()
+                client = smtplib.SMTP(host, port, timeout=60)
+            start = time.perf_counter()
+            try:
+                client.sendmail('bench@example.org', ['user@example.org'], data)
+                code = 250
+            except smtplib.SMTPDataError as e:
+                code = e.smtp_code
+            except smtplib.SMTPRecipientsRefused:
+                code = 550
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                codes[code] += 1
+        if client is not None:
+            client.quit()
+
+    batches = [messages[i::connections] for i in range(connections)]
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        list(pool.map(worker, batches))
+    return latencies, codes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='mer SMTP 过滤代理吞吐量基准')
+    parser.add_argument('corpus', help='语料目录（.eml）')
+    parser.add_argument('-c', '--connections', type=int, default=8, help='并发连接数（默认 8）')
+    parser.add_argument('-j', '--workers', type=int, default=0, help='代理工作进程数（默认 CPU 核数）')
+    parser.add_argument('-n', '--count', type=int, default=0, help='发送邮件总数（默认语料全部，不足时循环）')
+    parser.add_argument('--per-connection', type=int, default=20, help='每个连接发送多少封后重连（默认 20）')
+    parser.add_argument('--budget', type=float, default=5.0, help='代理检测预算（秒，默认 5）')
+    parser.add_argument('--reject', action='store_true', help='代理拒收恶意邮件')
+    parser.add_argument('--proxy', metavar='HOST:PORT', help='测试已在运行的代理（不启动 sink 和代理）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.corpus, '*.eml')))
+    if not files:
+        parser.error(f"目录中没有 .eml 文件: {args.corpus}")
+    corpus = []
+    for path in files:
+        with open(path, 'rb') as f:
+            corpus.append(f.read())
+    count = args.count or len(corpus)
+    messages = [corpus[i % len(corpus)] for i in range(count)]
+
+    sink = None
+    proxy_process = None
+    if args.proxy:
+        host, _, port = args.proxy.rpartition(':')
+        port = int(port)
+    else:
+        sink_port, port, host = free_port(), free_port(), '127.0.0.1'
+        sink = start_sink(sink_port)
+        command = [sys.executable, os.path.join(REPO_ROOT, 'mer.py'), 'smtp',
+                   '--port', str(port), '--relay', f'127.0.0.1:{sink_port}',
+                   '--budget', str(args.budget)]
+        if args.workers:
+            command += ['-j', str(args.workers)]
+        if args.reject:
+            command.append('--reject')
+        env = dict(os.environ, MER_OFFLINE='1', MER_RESULT_CACHE='0')
+        proxy_process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+        wait_port(host, port, 60)
+
+    try:
+        start = time.perf_counter()
+        latencies, codes = send_all(host, port, messages, args.connections, args.per_connection)
+        wall = time.perf_counter() - start
+    finally:
+        if proxy_process is not None:
+            proxy_process.terminate()
+            proxy_process.wait()
+
+    report = {
+        'messages': len(latencies),
+        'connections': args.connections,
+        'wall_s': round(wall, 3),
+        'messages_per_sec': round(len(latencies) / wall, 1) if wall else 0.0,
+        'latency': summarize(latencies),
+        'responses': {str(code): n for code, n in sorted(codes.items())},
+        'sink_verdicts': dict(sink.verdicts) if sink else None,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    lat = report['latency']
+    print(f"{report['messages']} 封 / {args.connections} 个并发连接，耗时 {report['wall_s']} 秒，"
+          f"{report['messages_per_sec']} 封/秒")
+    print(f"延迟 ms: 平均 {lat['mean_ms']:.1f}  p50 {lat['p50_ms']:.1f}  p90 {lat['p90_ms']:.1f}  "
+          f"p99 {lat['p99_ms']:.1f}  最大 {lat['max_ms']:.1f}")
+    print(f"应答码: {report['responses']}")
+    if sink:
+        print(f"收信端判定头: {report['sink_verdicts']}")
+
+
+if __name__ == '__main__':
+    main()
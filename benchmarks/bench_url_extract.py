@@ -0,0 +1,158 @@
+"""
+URL 提取基准：用构造的病态输入对比 mer.find_urls() 与原先的 URL 正则，
+按输入长度逐级放大，检查耗时是否随长度线性增长
+
+原正则带嵌套量词，遇到长串点号、括号时会大量回溯；每次调用设有超时（默认 2 秒），
+超时后不再测更大的输入。指定语料目录时，还会核对两者在真实邮件正文上的提取结果。
+
+用法：
+    python benchmarks/bench_url_extract.py
+    python benchmarks/bench_url_extract.py --sizes 1000,10000,100000 --corpus /tmp/corpus
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import signal
+import sys
+import time
+from email import policy
+from email.parser import BytesParser
+from typing import Dict, Any, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import mer  # noqa: E402
+
+# 被 find_urls() 取代的原 URL 正则，仅用于对比
+LEGACY_URL_PATTERN = re.compile(r'(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:\'".,<>?«»""'']))')
+
+# 病态输入：名称 -> (说明, 按重复次数 n 生成文本)
+CASES = {
+    'dots':      ('长串“字母.”，没有可识别的结尾', lambda n: 'a.' * n + 'com'),
+    'domain':    ('超长域名后接路径', lambda n: 'a' * n + '.com/x'),
+    'slashes':   ('大量“域名/”片段连在一起', lambda n: 'a.bc/' * n),
+    'parens':    ('URL 后接大量成对括号和一个不成对的左括号', lambda n: 'http://a' + '(a)' * n + '('),
+    'nested':    ('大量不闭合的左括号', lambda n: 'http://x' + '((a)' * n + ' '),
+    'schemes':   ('协议前缀首尾相连', lambda n: 'http://' * n),
+    'www':       ('大量不在单词边界上的 www. 前缀', lambda n: 'xwww.' * n),
+    'www_digits': ('大量带数字的 www1. 前缀', lambda n: 'xwww1.' * n),
+    'www_slash': ('大量 www. 前缀后接“/”', lambda n: 'xwww.' * n + '/'),
+    'prose':     ('普通文本夹杂链接', lambda n: 'see https://example.com/a?b=1 and www.test.org, ok. ' * n),
+}
+
+
+class Timeout(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise Timeout()
+
+
+def legacy_urls(text: str) -> List[str]:
+    return list(dict.fromkeys(m[0] for m in LEGACY_URL_PATTERN.findall(text)))
+
+
+def timed(func, text: str, repeat: int, timeout: float) -> Optional[float]:
+    """func(text) 的最短耗时（秒）；单次超过 timeout 时返回 None"""
+    best = None
+    for _ in range(repeat):
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            start = time.perf_counter()
+            func(text)
+            elapsed = time.perf_counter() - start
+        except Timeout:
+            return None
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_cases(sizes: List[int], repeat: int, timeout: float) -> Dict[str, Any]:
+    report = {}
+    for name, (_, make) in CASES.items():
+        rows = []
+        legacy_alive = True
+        for n in sizes:
+            text = make(n)
+            current = timed(mer.find_urls, text, repeat, timeout)
+            legacy = timed(legacy_urls, text, repeat, timeout) if legacy_alive else None
+            legacy_alive = legacy is not None
+            rows.append({
+                'n': n,
+                'chars': len(text),
+                'find_urls_ms': round(current * 1000, 3) if current is not None else None,
+                'legacy_ms': round(legacy * 1000, 3) if legacy is not None else None,
+            })
+        report[name] = rows
+    return report
+
+
+def check_corpus(corpus: str) -> Dict[str, Any]:
+    """在语料的纯文本正文与 HTML 文本上对比两种实现的提取结果"""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(corpus, '*.eml'))):
+        with open(path, 'rb') as f:
+            msg = BytesParser(policy=policy.default).parse(f)
+        for part in msg.walk():
+            if part.get_content_maintype() == 'text':
+                texts.append(part.get_content())
+    mismatches = sum(mer.find_urls(t) != legacy_urls(t) for t in texts)
+    start = time.perf_counter()
+    for t in texts:
+        mer.find_urls(t)
+    current = time.perf_counter() - start
+    start = time.perf_counter()
+    for t in texts:
+        legacy_urls(t)
+    legacy = time.perf_counter() - start
+    return {
+        'texts': len(texts),
+        'chars': sum(len(t) for t in texts),
+        'mismatches': mismatches,
+        'find_urls_ms': round(current * 1000, 2),
+        'legacy_ms': round(legacy * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='mer URL 提取基准（病态输入）')
+    parser.add_argument('--sizes', default='100,1000,10000,100000',
+                        help='每种输入的重复次数，逗号分隔（默认 100,1000,10000,100000）')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='每项测量取最短耗时的次数（默认 3）')
+    parser.add_argument('--timeout', type=float, default=2.0, help='单次调用超时（秒，默认 2）')
+    parser.add_argument('--corpus', metavar='DIR', help='同时在 .eml 语料上核对提取结果')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(',') if x.strip()]
+    signal.signal(signal.SIGALRM, _alarm)
+    report = {'cases': run_cases(sizes, args.repeat, args.timeout)}
+    if args.corpus:
+        report['corpus'] = check_corpus(args.corpus)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    def fmt(ms):
+        return f"{ms:>12.2f}" if ms is not None else f"{'超时':>10}"
+
+    print(f"{'输入':<10}{'重复次数':>10}{'字符数':>11}{'find_urls ms':>14}{'原正则 ms':>12}")
+    for name, rows in report['cases'].items():
+        for row in rows:
+            print(f"{name:<10}{row['n']:>12}{row['chars']:>12}{fmt(row['find_urls_ms'])}{fmt(row['legacy_ms'])}")
+        print(f"  └ {CASES[name][0]}")
+    if 'corpus' in report:
+        c = report['corpus']
+        print(f"\n语料 {c['texts']} 段正文（{c['chars']:,} 字符）：结果不一致 {c['mismatches']} 段，"
+              f"find_urls {c['find_urls_ms']} ms，原正则 {c['legacy_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+合成钓鱼邮件语料生成器：按固定随机种子生成可复现的 .eml 语料，供 bench_pipeline.py 使用
+
+可调参数：HTML 正文大小、链接数、附件组合（zip/pdf/docx/exe）、Received 链深度、
+同形字发件地址比例、钓鱼邮件比例。同一组参数和种子总是生成完全相同的文件。
+
+用法：
+    python benchmarks/gen_corpus.py -o /tmp/corpus -n 500
+    python benchmarks/gen_corpus.py -o /tmp/corpus -n 200 --html-kb 64 --links 40 \\
+        --attachments zip=2,pdf,docx,exe=0.5 --max-attachments 2 --received 8
+"""
+import argparse
+import io
+import json
+import os
+import random
+import zipfile
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import Dict, Any, List, Tuple
+
+# 正常发件域与其仿冒写法
+BRANDS = ['paypal.com', 'microsoft.com', 'apple.com', 'amazon.com', 'sinopec.com', 'icbc.com.cn']
+LOOKALIKES = {
+    'paypal.com': ['paypa1.com', 'paypal-secure.com', 'pay-pal.net'],
+    'microsoft.com': ['micros0ft.com', 'microsoft-login.com', 'rnicrosoft.com'],
+    'apple.com': ['app1e.com', 'apple-id-verify.com'],
+    'amazon.com': ['amaz0n.com', 'amazon-billing.net'],
+    'sinopec.com': ['siuopec.com', 'sinopec-mail.com'],
+    'icbc.com.cn': ['icbc-com.cn', 'lcbc.com.cn'],
+}
+# 拉丁字母 -> 外形相同的西里尔字母
+HOMOGLYPHS = {'a': 'а', 'e': 'е', 'o': 'о', 'p': 'р', 'c': 'с', 'x': 'х'}
+
+CLEAN_SUBJECTS = ['项目周报', 'Meeting notes', '季度预算复核', 'Lunch on Friday?', '合同扫描件', 'Release checklist']
+PHISH_SUBJECTS = ['紧急：账户已被冻结', 'Verify your account immediately', '密码即将过期，请立即更新',
+                  'Unusual sign-in activity', '发票待支付 - 最后通知', 'Your mailbox is full']
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua 账户 通知 付款 安全 验证').split()
+
+ATTACHMENT_TYPES = ('zip', 'pdf', 'docx', 'exe')
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    """解析附件组合，如 'zip=2,pdf,exe=0.5' -> [('zip', 2.0), ('pdf', 1.0), ('exe', 0.5)]"""
+    mix = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        kind, _, weight = item.partition('=')
+        if kind not in ATTACHMENT_TYPES:
+            raise argparse.ArgumentTypeError(f"未知附件类型: {kind}（可选 {', '.join(ATTACHMENT_TYPES)}）")
+        mix.append((kind, float(weight or 1)))
+    return mix
+
+
+def homograph(domain: str, rng: random.Random) -> str:
+    """把域名主体中的一个可替换字母换成西里尔同形字"""
+    label, _, rest = domain.partition('.')
+    spots = [i for i, ch in enumerate(label) if ch in HOMOGLYPHS]
+    if not spots:
+        return domain
+    i = rng.choice(spots)
+    return f"{label[:i]}{HOMOGLYPHS[label[i]]}{label[i + 1:]}.{rest}"
+
+
+def random_bytes(rng: random.Random, size: int) -> bytes:
+    # random.randbytes 需要 Python 3.9+
+    return rng.getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def text_block(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_html(rng: random.Random, size_kb: int, links: int, link_domain: str, phish: bool) -> str:
+    """生成约 size_kb KB 的 HTML 正文，包含 links 个链接；钓鱼样本加入隐藏元素和文字/链接不符的锚点"""
+    parts = ['<html><body>']
+    for i in range(links):
+        href = f"https://{link_domain}/{text_block(rng, 1)}/{i}?id={rng.randrange(10 ** 6)}"
+        shown = f"https://www.{rng.choice(BRANDS)}/account" if phish and i % 3 == 0 else '点击这里'
+        parts.append(f'<p>{text_block(rng, 12)} <a href="{href}">{shown}</a></p>')
+    if phish:
+        parts.append('<div style="display:none">' + text_block(rng, 30) + '</div>')
+        parts.append(f'<img src="https://{link_domain}/t.gif" width="1" height="1" style="width:1px">')
+    filler = size_kb * 1024 - sum(len(p) for p in parts)
+    while filler > 0:
+        para = f'<p>{text_block(rng, 40)}</p>'
+        parts.append(para)
+        filler -= len(para.encode('utf-8'))
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def _zip_bytes(members: Dict[str, Any]) -> bytes:
+    """打包 zip；成员时间戳固定，保证输出可复现"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0)), data,
+                        compress_type=zipfile.ZIP_DEFLATED)
+    return buf.getvalue()
+
+
+def make_attachment(kind: str, rng: random.Random, index: int) -> Tuple[str, str, bytes]:
+    """返回 (文件名, MIME 类型, 内容)"""
+    if kind == 'zip':
+        data = _zip_bytes({'invoice.pdf.exe': b'MZ' + random_bytes(rng, 4096),
+                           'readme.txt': text_block(rng, 200)})
+        return f'invoice_{index}.zip', 'application/zip', data
+    if kind == 'pdf':
+        body = text_block(rng, 60)
+        pdf = (b'%PDF-1.4\n1 0 obj << /Type /Catalog >> endobj\n'
+               + f'% {body} https://{rng.choice(BRANDS)}/doc\n'.encode('utf-8')
+               + b'trailer << /Root 1 0 R >>\n%%EOF\n')
+        return f'statement_{index}.pdf', 'application/pdf', pdf
+    if kind == 'docx':
+        data = _zip_bytes({'[Content_Types].xml': '<?xml version="1.0"?><Types/>',
+                           'word/document.xml': f'<w:document><w:t>{text_block(rng, 120)}</w:t></w:document>'})
+        return f'report_{index}.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', data
+    return f'update_{index}.exe', 'application/octet-stream', b'MZ\x90\x00' + random_bytes(rng, 16 * 1024)
+
+
+def make_message(index: int, args, mix: List[Tuple[str, float]]) -> Tuple[EmailMessage, Dict[str, Any]]:
+    """生成第 index 封邮件；每封邮件用 (seed, index) 派生独立的随机数，插入新参数不会影响已有样本"""
+    rng = random.Random(f"{args.seed}:{index}")
+    phish = rng.random() < args.phish_ratio
+    brand = rng.choice(BRANDS)
+    sender_domain = rng.choice(LOOKALIKES[brand]) if phish else brand
+    if rng.random() < args.homograph_ratio:
+        sender_domain = homograph(brand, rng)
+    link_domain = rng.choice(LOOKALIKES[brand]) if phish else brand
+
+    sent = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(365 * 86400))
+    msg = EmailMessage()
+    # Received 链从最靠近收件方的一跳开始，时间依次往前推
+    for hop in range(args.received):
+        stamp = sent + timedelta(seconds=(args.received - hop) * 2)
+        msg['Received'] = (f"from mx{hop}.{sender_domain} (mx{hop}.{sender_domain} [203.0.113.{hop % 250 + 1}]) "
+                           f"by mx.example.org with ESMTPS; {format_datetime(stamp)}")
+    auth = 'pass' if not phish else rng.choice(['fail', 'softfail', 'none'])
+    msg['Authentication-Results'] = f"mx.example.org; spf={auth} smtp.mailfrom={sender_domain}; dkim={auth}; dmarc={auth}"
+    msg['From'] = f"{'Service' if phish else 'Colleague'} <noreply@{sender_domain}>"
+    msg['To'] = 'user@example.org'
+    if phish and rng.random() < 0.5:
+        msg['Reply-To'] = f"support@{rng.choice(LOOKALIKES[brand])}"
+    msg['Subject'] = rng.choice(PHISH_SUBJECTS if phish else CLEAN_SUBJECTS)
+    msg['Date'] = format_datetime(sent)
+    msg['Message-ID'] = f"<bench-{args.seed}-{index}@example.org>"
+
+    msg.set_content(text_block(rng, 80))
+    msg.add_alternative(make_html(rng, args.html_kb, args.links, link_domain, phish), subtype='html')
+
+    attachments = []
+    if mix:
+        kinds, weights = zip(*mix)
+        for i in range(rng.randint(0, args.max_attachments)):
+            kind = rng.choices(kinds, weights)[0]
+            filename, mime, data = make_attachment(kind, rng, i)
+            maintype, subtype = mime.split('/', 1)
+            msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+            attachments.append(kind)
+
+    # email 库默认生成随机分隔符，这里改为固定值
+    for n, part in enumerate(p for p in msg.walk() if p.is_multipart()):
+        part.set_boundary(f"mer-bench-{args.seed}-{index}-{n}")
+
+    meta = {'file': f"{index:06d}.eml", 'phish': phish, 'sender_domain': sender_domain, 'attachments': attachments}
+    return msg, meta
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='生成可复现的合成钓鱼邮件语料')
+    parser.add_argument('-o', '--out', required=True, help='输出目录')
+    parser.add_argument('-n', '--count', type=int, default=200, help='邮件数量（默认 200）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（默认 1）')
+    parser.add_argument('--html-kb', type=int, default=16, help='HTML 正文大小（KB，默认 16）')
+    parser.add_argument('--links', type=int, default=20, help='每封邮件的链接数（默认 20）')
+    parser.add_argument('--attachments', type=parse_mix, default=parse_mix('zip,pdf,docx,exe'),
+                        help="附件类型及权重，如 'zip=2,pdf,exe=0.5'；空串表示不带附件")
+    parser.add_argument('--max-attachments', type=int, default=2, help='每封邮件最多附件数（默认 2）')
+    parser.add_argument('--received', type=int, default=4, help='Received 链深度（默认 4）')
+    parser.add_argument('--homograph-ratio', type=float, default=0.1, help='同形字发件域比例（默认 0.1）')
+    parser.add_argument('--phish-ratio', type=float, default=0.5, help='钓鱼邮件比例（默认 0.5）')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest = {
+        'params': {k: v for k, v in vars(args).items() if k != 'out'},
+        'messages': [],
+    }
+    for index in range(args.count):
+        msg, meta = make_message(index, args, args.attachments)
+        with open(os.path.join(args.out, meta['file']), 'wb') as f:
+            f.write(msg.as_bytes())
+        manifest['messages'].append(meta)
+
+    with open(os.path.join(args.out, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"已生成 {args.count} 封邮件 -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
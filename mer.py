@@ -1,37 +1,205 @@
 from email import policy
-from email.parser import BytesParser
-import extract_msg
+from email.parser import BytesParser, BytesHeaderParser
 import os
-from typing import Dict, Any, List
-from bs4 import BeautifulSoup
+from typing import Dict, Any, List, Optional
 import re
 import io
+import sys
+import glob
 import time
-try:
-    import PyPDF2  # 用于解析PDF文件
-    from docx import Document  # 用于解析Word文档
-    import openpyxl  # 用于解析Excel文件
-    import pptx  # 用于解析PPT文件
-    EXTRA_FORMATS_SUPPORTED = True
-except ImportError:
-    EXTRA_FORMATS_SUPPORTED = False
-    print("提示: 要支持更多文档格式预览，请安装以下包:")
-    print("pip install python-docx PyPDF2 openpyxl python-pptx")
-
-import whois
-from datetime import datetime, timezone
-
-def parse_email(file_path: str) -> Dict[str, Any]:
+import json
+import argparse
+import contextlib
+import copy
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socket
+import socketserver
+import ipaddress
+import signal
+from urllib.parse import urlparse, parse_qs
+import sqlite3
+import threading
+import hashlib
+import unicodedata
+import mmap
+import struct
+import binascii
+import bisect
+import tempfile
+import weakref
+import zipfile
+import tarfile
+import gzip
+import bz2
+import zlib
+from datetime import datetime, timedelta, timezone
+
+
+# ========== 运行配置 ==========
+
+def _env_float(name: str, default: float) -> float:
+    """读取浮点型环境变量，格式错误时使用默认值"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+# 全局运行配置：默认值可由环境变量覆盖；批量模式会把它原样传给工作进程
+CONFIG = {
+    # 本地缓存目录（WHOIS 缓存等 SQLite 数据库存放位置）
+    'cache_dir': os.environ.get('MER_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'mer'),
+    # 是否启用 WHOIS 本地缓存
+    'whois_cache': os.environ.get('MER_WHOIS_CACHE', '1') != '0',
+    # WHOIS 查询成功结果的缓存时间（秒），默认 7 天
+    'whois_ttl': _env_float('MER_WHOIS_TTL', 7 * 86400),
+    # WHOIS 查询失败结果的缓存时间（秒），默认 1 小时
+    'whois_negative_ttl': _env_float('MER_WHOIS_NEGATIVE_TTL', 3600),
+    # 单次 WHOIS 查询的超时时间（秒）
+    'whois_timeout': _env_float('MER_WHOIS_TIMEOUT', 5.0),
+    # 每封邮件全部 WHOIS 查询的总预算（秒），超出后域名年龄按未知处理
+    'whois_deadline': _env_float('MER_WHOIS_DEADLINE', 8.0),
+    # WHOIS 查询线程数
+    'whois_workers': int(_env_float('MER_WHOIS_WORKERS', 8)),
+    # 每个顶级域每秒允许的 WHOIS 查询次数及突发上限（令牌桶）
+    'whois_rate': _env_float('MER_WHOIS_RATE', 1.0),
+    'whois_burst': _env_float('MER_WHOIS_BURST', 3),
+    # 离线新注册域名索引文件（由 `mer.py nrd-build` 生成），查询 WHOIS 前优先使用
+    'nrd_index': os.environ.get('MER_NRD_INDEX', ''),
+    # 离线模式：完全不发起 WHOIS 查询，仅使用本地索引和缓存
+    'offline': os.environ.get('MER_OFFLINE', '0') == '1',
+    # 受保护品牌/合作方域名仿冒索引文件（由 `mer.py brand-build` 生成）
+    'brand_index': os.environ.get('MER_BRAND_INDEX', ''),
+    # Unicode confusables.txt（UTS #39 数据文件），配置后与内置同形字表合并
+    'confusables_file': os.environ.get('MER_CONFUSABLES', ''),
+    # 关键词配置文件（JSON：{"短语": 权重}），未配置时使用内置词表
+    'keyword_file': os.environ.get('MER_KEYWORDS', ''),
+    # 正文 / HTML 文本中命中关键词的权重系数（主题命中为 1）
+    'body_keyword_factor': _env_float('MER_BODY_KEYWORD_FACTOR', 0.25),
+    # 解码后超过该字节数的附件写入临时文件，只在内存中保留句柄
+    'spool_threshold': int(_env_float('MER_SPOOL_THRESHOLD', 2 * 1024 * 1024)),
+    # 附件临时文件目录（默认系统临时目录）
+    'spool_dir': os.environ.get('MER_SPOOL_DIR') or None,
+    # 附件预览上限：超过该字节数的文档不解析；PDF 页 / PPT 幻灯片数
+    'preview_max_bytes': int(_env_float('MER_PREVIEW_MAX_BYTES', 10 * 1024 * 1024)),
+    'preview_max_pages': int(_env_float('MER_PREVIEW_MAX_PAGES', 3)),
+    # 分诊模式：跳过附件内容预览等昂贵步骤，只做快速判定
+    'triage': os.environ.get('MER_TRIAGE', '0') == '1',
+    # 是否启用附件分析缓存（按内容 SHA-256 复用压缩包列表、预览 URL）
+    'attachment_cache': os.environ.get('MER_ATTACHMENT_CACHE', '1') != '0',
+    # 附件分析缓存的保留时间（秒），默认 30 天
+    'attachment_ttl': _env_float('MER_ATTACHMENT_TTL', 30 * 86400),
+    # 压缩包递归检查的限制：嵌套层数、成员总数、解压总字节数、单个成员压缩比
+    'archive_max_depth': int(_env_float('MER_ARCHIVE_MAX_DEPTH', 3)),
+    'archive_max_members': int(_env_float('MER_ARCHIVE_MAX_MEMBERS', 1000)),
+    'archive_max_bytes': int(_env_float('MER_ARCHIVE_MAX_BYTES', 100 * 1024 * 1024)),
+    'archive_max_ratio': _env_float('MER_ARCHIVE_MAX_RATIO', 100),
+    # 是否启用整封邮件结果缓存（按原始字节哈希 + 规则版本复用判定）
+    'result_cache': os.environ.get('MER_RESULT_CACHE', '1') != '0',
+    # 结果缓存保留时间（秒），默认 1 天（域名年龄等信息会随时间变化）
+    'result_ttl': _env_float('MER_RESULT_TTL', 86400),
+    # 守护进程：单次提交的最大字节数、单封邮件的分析超时（秒）
+    'serve_max_bytes': int(_env_float('MER_SERVE_MAX_BYTES', 50 * 1024 * 1024)),
+    'serve_timeout': _env_float('MER_SERVE_TIMEOUT', 30.0),
+    # SMTP 过滤代理：单封邮件的检测时间预算（秒），超时按 --fail-closed 决定放行或临时拒收
+    'smtp_budget': _env_float('MER_SMTP_BUDGET', 5.0),
+    # 头部分诊：先只解析邮件头并评分，头部评分落在 [triage_low, triage_high) 区间内
+    # 且尚未判定为恶意时才做完整的正文与附件分析
+    'header_triage': os.environ.get('MER_HEADER_TRIAGE', '0') == '1',
+    'triage_low': _env_float('MER_TRIAGE_LOW', 10.0),
+    'triage_high': _env_float('MER_TRIAGE_HIGH', 100.0),
+    # 提前结束：检测器由快到慢执行，恶意判定已不可能改变时跳过剩余检测器；
+    # 交互模式与 --complete 运行全部检测器，保留完整证据供分析人员查看
+    'early_exit': os.environ.get('MER_EARLY_EXIT', '1') == '1',
+    # 报告末尾是否显示各阶段耗时（解析 / 附件 / 各检测器）；耗时本身始终记录在判定结果中
+    'show_timings': os.environ.get('MER_TIMINGS', '0') == '1',
+}
+
+
+# ========== 可选依赖按需加载 ==========
+
+# 文档预览格式 -> (模块名, pip 包名)；只在第一次真正预览该格式时才导入
+PREVIEW_LIBRARIES = {
+    '.pdf': ('PyPDF2', 'PyPDF2'),
+    '.docx': ('docx', 'python-docx'),
+    '.xlsx': ('openpyxl', 'openpyxl'),
+    '.pptx': ('pptx', 'python-pptx'),
+}
+
+_optional_modules: Dict[str, Any] = {}
+
+
+def optional_import(module: str, package: str = '') -> Optional[Any]:
     """
-    解析邮件文件，提取关键信息
-    
+    首次使用时导入可选依赖，结果按模块名记忆
+
+    未安装时返回 None，并且每个模块只提示一次安装命令
+
     Args:
-        file_path: 邮件文件路径
-        
+        module: 模块名（如 'PyPDF2'）
+        package: 对应的 pip 包名，用于安装提示（默认同模块名）
+
     Returns:
-        包含邮件信息的字典
+        模块对象；未安装时为 None
+    """
+    if module not in _optional_modules:
+        try:
+            _optional_modules[module] = importlib.import_module(module)
+        except ImportError:
+            _optional_modules[module] = None
+            print(f"提示: 要支持该格式，请安装: pip install {package or module}")
+    return _optional_modules[module]
+
+
+def preview_available(extension: str) -> bool:
+    """判断某扩展名的文档预览库是否已安装（只查找不导入，用于缓存键与规则版本）"""
+    entry = PREVIEW_LIBRARIES.get(extension)
+    if entry is None:
+        return False
+    module = _optional_modules.get(entry[0], False)
+    if module is not False:
+        return module is not None
+    return importlib.util.find_spec(entry[0]) is not None
+
+
+# ========== 阶段耗时统计 ==========
+
+def new_timing() -> Dict[str, float]:
+    """空的计时记录：墙钟时间与 CPU 时间（毫秒）"""
+    return {'wall_ms': 0.0, 'cpu_ms': 0.0}
+
+
+class StageTimer:
     """
-    email_data = {
+    上下文管理器：把 with 块的墙钟时间与 CPU 时间累加到计时记录
+
+    同一条记录可以多次累加（如附件解析时计一次，之后按需生成预览再计一次）。
+    CPU 时间取当前线程（time.thread_time），守护进程多线程处理时互不干扰。
+    每次计时只读四次时钟，开销在微秒级，生产环境可常开。
+    """
+    __slots__ = ('record', '_wall', '_cpu')
+
+    def __init__(self, record: Dict[str, float]):
+        self.record = record
+
+    def __enter__(self) -> Dict[str, float]:
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self.record
+
+    def __exit__(self, *exc_info) -> bool:
+        self.record['wall_ms'] += (time.perf_counter() - self._wall) * 1000
+        self.record['cpu_ms'] += (time.thread_time() - self._cpu) * 1000
+        return False
+
+
+def new_email_data() -> Dict[str, Any]:
+    """空的邮件解析结果（parse_email / parse_headers 在此基础上填充）"""
+    return {
         'from': [],
         'to': [],
         'cc': [],
@@ -45,6 +213,8 @@ def parse_email(file_path: str) -> Dict[str, Any]:
         'references': [],
         'in_reply_to': [],
         'headers': {},        # 新增：完整原始 headers
+        'html_index': None,   # HTML 正文的共享解析结果（见 get_html_index）
+        'text_urls': None,    # 纯文本正文中的 URL（见 get_text_urls）
         'thread_info': {
             'original_sender': '',
             'original_recipients': [],
@@ -52,66 +222,94 @@ def parse_email(file_path: str) -> Dict[str, Any]:
             'original_date': ''
         }
     }
+
+
+def parse_address_list(header_value: Any) -> List[str]:
+    """解析邮件地址列表"""
+    if not header_value:
+        return []
+    # 处理可能的多行地址
+    if isinstance(header_value, (list, tuple)):
+        addresses = []
+        for item in header_value:
+            addresses.extend([addr.strip() for addr in str(item).split(',')])
+        return addresses
+    return [addr.strip() for addr in str(header_value).split(',')]
+
+
+def read_headers(msg: Any, email_data: Dict[str, Any]) -> None:
+    """从 .eml 邮件（或只含邮件头的 BytesHeaderParser 结果）读取地址、主题、日期与完整 headers"""
+    # 处理发件人
+    from_header = msg.get('From', '')
+    email_data['from'] = parse_address_list(from_header)
+
+    # 处理收件人
+    to_header = msg.get('To', '')
+    email_data['to'] = parse_address_list(to_header)
+
+    # 处理抄送人
+    cc_header = msg.get('Cc', '')
+    email_data['cc'] = parse_address_list(cc_header)
+
+    # 处理密送人
+    bcc_header = msg.get('Bcc', '')
+    email_data['bcc'] = parse_address_list(bcc_header)
+
+    # 处理回复地址
+    reply_to_header = msg.get('Reply-To', '')
+    email_data['reply_to'] = parse_address_list(reply_to_header)
+
+    # 处理主题和日期
+    email_data['subject'] = msg.get('Subject', '')
+    email_data['date'] = msg.get('Date', '')
+
+    # 提取所有原始 headers（供 SPF/DKIM/DMARC/Received 检测使用）
+    for key in msg.keys():
+        k = key.lower()
+        val = str(msg.get(key, ''))
+        if k == 'received':
+            email_data['headers'].setdefault('received', [])
+            if isinstance(email_data['headers']['received'], list):
+                email_data['headers']['received'].append(val)
+        else:
+            email_data['headers'][k] = val
+
+    # 处理邮件引用和回复信息
+    references = msg.get('References', '')
+    in_reply_to = msg.get('In-Reply-To', '')
+    email_data['references'] = parse_address_list(references)
+    email_data['in_reply_to'] = parse_address_list(in_reply_to)
+
+
+def parse_email(file_path: str, raw: bytes = None) -> Dict[str, Any]:
+    """
+    解析邮件文件，提取关键信息
+
+    Args:
+        file_path: 邮件文件路径（提供 raw 时只用其扩展名判断格式）
+        raw: 邮件原始字节（可选，如守护进程收到的提交内容）
+
+    Returns:
+        包含邮件信息的字典；email_data['timings']['parse'] 为解析耗时（含附件解码）
+    """
+    timing = new_timing()
+    with StageTimer(timing):
+        email_data = _parse_email(file_path, raw)
+    email_data['timings'] = {'parse': timing, 'detectors': {}}
+    return email_data
+
+
+def _parse_email(file_path: str, raw: bytes = None) -> Dict[str, Any]:
+    """解析邮件文件（由 parse_email 调用并计时）"""
+    email_data = new_email_data()
     
     try:
         if file_path.lower().endswith('.eml'):
-            with open(file_path, 'rb') as f:
+            with (io.BytesIO(raw) if raw is not None else open(file_path, 'rb')) as f:
                 msg = BytesParser(policy=policy.default).parse(f)
                 
-                # 解析邮件头
-                def parse_address_list(header_value):
-                    """解析邮件地址列表"""
-                    if not header_value:
-                        return []
-                    # 处理可能的多行地址
-                    if isinstance(header_value, (list, tuple)):
-                        addresses = []
-                        for item in header_value:
-                            addresses.extend([addr.strip() for addr in str(item).split(',')])
-                        return addresses
-                    return [addr.strip() for addr in str(header_value).split(',')]
-                
-                # 处理发件人
-                from_header = msg.get('From', '')
-                email_data['from'] = parse_address_list(from_header)
-                
-                # 处理收件人
-                to_header = msg.get('To', '')
-                email_data['to'] = parse_address_list(to_header)
-                
-                # 处理抄送人
-                cc_header = msg.get('Cc', '')
-                email_data['cc'] = parse_address_list(cc_header)
-                
-                # 处理密送人
-                bcc_header = msg.get('Bcc', '')
-                email_data['bcc'] = parse_address_list(bcc_header)
-                
-                # 处理回复地址
-                reply_to_header = msg.get('Reply-To', '')
-                email_data['reply_to'] = parse_address_list(reply_to_header)
-                
-                # 处理主题和日期
-                email_data['subject'] = msg.get('Subject', '')
-                email_data['date'] = msg.get('Date', '')
-
-                # 提取所有原始 headers（供 SPF/DKIM/DMARC/Received 检测使用）
-                for key in msg.keys():
-                    k = key.lower()
-                    val = str(msg.get(key, ''))
-                    if k == 'received':
-                        email_data['headers'].setdefault('received', [])
-                        if isinstance(email_data['headers']['received'], list):
-                            email_data['headers']['received'].append(val)
-                    else:
-                        email_data['headers'][k] = val
-                
-                # 处理邮件引用和回复信息
-                references = msg.get('References', '')
-                in_reply_to = msg.get('In-Reply-To', '')
-                email_data['references'] = parse_address_list(references)
-                email_data['in_reply_to'] = parse_address_list(in_reply_to)
-                
+                read_headers(msg, email_data)
+
                 # 尝试获取原始邮件信息
                 if msg.is_multipart():
                     for part in msg.walk():
@@ -274,7 +472,9 @@ def parse_email(file_path: str) -> Dict[str, Any]:
                         print(f"尝试重新解码HTML内容失败: {str(e)}")
                 
         elif file_path.lower().endswith('.msg'):
-            msg = extract_msg.Message(file_path)
+            # extract_msg 导入较慢，只在真正遇到 .msg 文件时加载
+            import extract_msg
+            msg = extract_msg.Message(raw if raw is not None else file_path)
             try:
                 # 处理发件人
                 sender = msg.sender
@@ -348,9 +548,9 @@ def parse_email(file_path: str) -> Dict[str, Any]:
                     if not any(email_data['thread_info'].values()):
                         html_body = msg.htmlBody or ''
                         if html_body:
-                            # 使用BeautifulSoup清理HTML标签
-                            soup = BeautifulSoup(html_body, 'html.parser')
-                            clean_text = soup.get_text()
+                            # 解析一次HTML，后续各检测器复用同一份 DOM
+                            email_data['html_index'] = index_html(html_body)
+                            clean_text = email_data['html_index']['soup'].get_text()
                             
                             # 重新查找
                             from_matches = re.findall(from_pattern, clean_text)
@@ -396,30 +596,410 @@ def parse_email(file_path: str) -> Dict[str, Any]:
         
     return email_data
 
+# ========== 附件负载 ==========
+
+DECODE_CHUNK = 1024 * 1024          # 分块解码的编码文本长度
+_BASE64_JUNK = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+def _unlink_quietly(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class AttachmentPayload:
+    """
+    附件解码后的内容句柄
+
+    分块写入时同时计算 MD5 / SHA-256；小于 spool_threshold 的内容留在内存，
+    超过后整体转存到临时文件。检测器通过 open() / read() 按需读取，
+    close() 或对象被回收时删除临时文件。
+    """
+
+    def __init__(self, threshold: int = None):
+        self.threshold = CONFIG['spool_threshold'] if threshold is None else threshold
+        self.size = 0
+        self.path = None
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._finalizer = None
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self._md5.update(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+        if self._file is None and self._buffer is not None and self.size > self.threshold:
+            self._file = tempfile.NamedTemporaryFile(prefix='mer-att-', dir=CONFIG['spool_dir'], delete=False)
+            self.path = self._file.name
+            self._finalizer = weakref.finalize(self, _unlink_quietly, self.path)
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._file or self._buffer).write(chunk)
+
+    def finish(self) -> 'AttachmentPayload':
+        """写入结束，关闭临时文件的写句柄"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def spooled(self) -> bool:
+        return self.path is not None
+
+    def open(self):
+        """返回只读的二进制文件对象（调用方负责关闭）"""
+        if self.path is not None:
+            return open(self.path, 'rb')
+        return io.BytesIO(self._buffer.getvalue() if self._buffer is not None else b'')
+
+    def read(self, limit: int = None) -> bytes:
+        """读取前 limit 字节（默认全部）"""
+        if self.path is None:
+            data = self._buffer.getbuffer() if self._buffer is not None else b''
+            return bytes(data[:limit] if limit is not None else data)
+        with open(self.path, 'rb') as f:
+            return f.read(-1 if limit is None else limit)
+
+    def close(self) -> None:
+        """释放内存缓冲并删除临时文件"""
+        self.finish()
+        self._buffer = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+
+def decode_part_payload(part: Any) -> AttachmentPayload:
+    """
+    分块解码 MIME 部分的内容
+
+    base64 / quoted-printable 按块解码，不生成完整的中间字节串；
+    其他编码以及分块解码失败时回退到 get_payload(decode=True)。
+    """
+    cte = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+    raw = part.get_payload(decode=False)
+    if isinstance(raw, str) and cte in ('base64', 'quoted-printable'):
+        payload = AttachmentPayload()
+        try:
+            if cte == 'base64':
+                carry = ''
+                for pos in range(0, len(raw), DECODE_CHUNK):
+                    text = carry + _BASE64_JUNK.sub('', raw[pos:pos + DECODE_CHUNK])
+                    cut = len(text) - len(text) % 4
+                    payload.write(binascii.a2b_base64(text[:cut]))
+                    carry = text[cut:]
+                if carry:
+                    payload.write(binascii.a2b_base64(carry + '=' * (-len(carry) % 4)))
+            else:
+                pos = 0
+                while pos < len(raw):
+                    end = raw.find('\n', pos + DECODE_CHUNK)
+                    end = len(raw) if end < 0 else end + 1
+                    payload.write(binascii.a2b_qp(raw[pos:end].encode('ascii', 'surrogateescape')))
+                    pos = end
+            return payload.finish()
+        except (binascii.Error, ValueError, UnicodeError):
+            payload.close()
+
+    payload = AttachmentPayload()
+    data = part.get_payload(decode=True)
+    if data:
+        payload.write(data)
+    return payload.finish()
+
+
+def release_email_data(email_data: Dict[str, Any]) -> None:
+    """分析完成后释放附件内容（删除临时文件）"""
+    for att in email_data.get('attachments', []):
+        if isinstance(att.get('data'), AttachmentPayload):
+            att['data'].close()
+
+
+# ========== 压缩包递归检查 ==========
+
+ARCHIVE_SNIFF_BYTES = 265               # tar 的 ustar 标记位于偏移 257
+ARCHIVE_RATIO_MIN_BYTES = 1024 * 1024   # 解压后小于该大小的成员不做压缩比判断
+# 基于 zip 的文档格式：内部结构不是用户文件，不按压缩包处理
+ZIP_CONTAINER_EXTENSIONS = {
+    '.docx', '.xlsx', '.pptx', '.docm', '.xlsm', '.pptm', '.dotx', '.dotm', '.xltx', '.xltm',
+    '.potx', '.potm', '.odt', '.ods', '.odp', '.epub', '.jar', '.apk', '.xpi', '.vsix',
+}
+
+
+def sniff_archive(head: bytes) -> str:
+    """按文件头识别标准库可解析的压缩格式：'zip' / 'gzip' / 'bz2' / 'tar'，否则返回空串"""
+    if head.startswith((b'PK\x03\x04', b'PK\x05\x06')):
+        return 'zip'
+    if head.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if head.startswith(b'BZh'):
+        return 'bz2'
+    if head[257:262] == b'ustar':
+        return 'tar'
+    return ''
+
+
+class _ArchiveLimit(Exception):
+    """解包总量超限，停止遍历"""
+
+
+class ArchiveWalker:
+    """
+    递归遍历压缩包（zip / tar / gzip / bz2），收集带完整嵌套路径的成员列表
+
+    普通成员只读取文件头用于识别嵌套压缩包，不做解压；嵌套压缩包与
+    gzip / bz2 的解压结果分块写入 AttachmentPayload（超过阈值转存临时文件）。
+    嵌套层数、成员总数、解压总字节数与单个成员压缩比超限时记录告警并停止深入。
+    """
+
+    def __init__(self):
+        self.paths: List[str] = []
+        self.warnings: List[str] = []
+        self.members = 0
+        self.total_bytes = 0
+        self.max_depth = CONFIG['archive_max_depth']
+        self.max_members = CONFIG['archive_max_members']
+        self.max_bytes = CONFIG['archive_max_bytes']
+        self.max_ratio = CONFIG['archive_max_ratio']
+
+    def _warn(self, message: str) -> None:
+        if message not in self.warnings:
+            self.warnings.append(message)
+
+    def _account(self, size: int) -> None:
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self._warn(f'解压总大小超过 {self.max_bytes // (1024 * 1024)} MB，停止检查')
+            raise _ArchiveLimit()
+
+    def _add_member(self, path: str) -> None:
+        self.members += 1
+        if self.members > self.max_members:
+            self._warn(f'成员数超过 {self.max_members} 个，停止检查')
+            raise _ArchiveLimit()
+        self.paths.append(path)
+
+    def _check_ratio(self, path: str, size: int, compressed: int) -> bool:
+        """压缩比超限时记录告警并返回 False"""
+        if size > ARCHIVE_RATIO_MIN_BYTES and size > compressed * self.max_ratio:
+            self._warn(f'{path} 压缩比异常（{size // max(compressed, 1)}:1），疑似压缩炸弹')
+            return False
+        return True
+
+    def _spool(self, head: bytes, stream, path: str, compressed: int = 0):
+        """
+        把已读出的文件头和剩余内容写入 AttachmentPayload；超限时返回 None
+
+        compressed 非 0 表示 gzip / bz2 解压流：边解压边累计字节数并检查压缩比
+        （zip / tar 成员的大小在列出时已按声明值计入总量）。
+        """
+        payload = AttachmentPayload()
+        payload.write(head)
+        try:
+            while True:
+                chunk = stream.read(DECODE_CHUNK)
+                if not chunk:
+                    break
+                payload.write(chunk)
+                if compressed:
+                    self._account(len(chunk))
+                    if not self._check_ratio(path, payload.size, compressed):
+                        payload.close()
+                        return None
+        except BaseException:
+            payload.close()
+            raise
+        return payload.finish()
+
+    def walk(self, payload: 'AttachmentPayload', kind: str, prefix: str = '', depth: int = 0, name: str = '',
+             accounted: bool = False) -> None:
+        """
+        遍历一个压缩包
+
+        Args:
+            prefix: 成员路径前缀（外层路径加 /，顶层为空）
+            name: 压缩包自身的文件名（gzip / bz2 据此推断解压出的文件名）
+            accounted: 压缩包自身的字节已计入解压总量（外层成员或 gzip / bz2 解压结果）；
+                tar 不压缩，此时其成员不再重复计入
+
+        .tar.gz 的解压字节只计入一次：
+
+        >>> import io, gzip, tarfile
+        >>> tar = io.BytesIO()
+        >>> with tarfile.open(fileobj=tar, mode='w') as tf:
+        ...     info = tarfile.TarInfo('a.txt')
+        ...     info.size = 1000
+        ...     tf.addfile(info, io.BytesIO(b'x' * 1000))
+        >>> payload = AttachmentPayload()
+        >>> payload.write(gzip.compress(tar.getvalue()))
+        >>> walker = ArchiveWalker()
+        >>> walker.walk(payload.finish(), 'gzip', name='a.tar.gz')
+        >>> walker.paths, walker.total_bytes == len(tar.getvalue())
+        (['a.txt'], True)
+        """
+        try:
+            with payload.open() as f:
+                if kind == 'zip':
+                    self._walk_zip(f, prefix, depth)
+                elif kind == 'tar':
+                    self._walk_tar(f, prefix, depth, accounted)
+                else:
+                    self._walk_stream(f, kind, payload.size, prefix, depth, name)
+        except _ArchiveLimit:
+            raise
+        except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError, zlib.error, RuntimeError, ValueError) as e:
+            print(f"解析压缩文件内容失败: {prefix or name} {str(e)}")
+
+    def _descend(self, head: bytes, stream, path: str, depth: int, compressed: int = 0) -> None:
+        """成员本身是压缩包时递归进入"""
+        kind = sniff_archive(head)
+        if not kind:
+            return
+        if depth + 1 > self.max_depth:
+            self._warn(f'嵌套层数超过 {self.max_depth} 层: {path}')
+            return
+        nested = self._spool(head, stream, path, compressed)
+        if nested is not None:
+            try:
+                self.walk(nested, kind, path + '/', depth + 1, path.rsplit('/', 1)[-1], accounted=True)
+            finally:
+                nested.close()
+
+    def _walk_zip(self, f, prefix: str, depth: int) -> None:
+        with zipfile.ZipFile(f) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                path = prefix + info.filename
+                self._add_member(path)
+                ratio_ok = self._check_ratio(path, info.file_size, info.compress_size)
+                self._account(info.file_size)
+                if not ratio_ok:
+                    continue
+                if info.flag_bits & 0x1:
+                    self._warn(f'含加密成员，无法检查内容: {path}')
+                    continue
+                with zf.open(info) as member:
+                    self._descend(member.read(ARCHIVE_SNIFF_BYTES), member, path, depth)
+
+    def _walk_tar(self, f, prefix: str, depth: int, accounted: bool = False) -> None:
+        with tarfile.open(fileobj=f, mode='r:') as tf:
+            for member in tf:
+                if not member.isfile():
+                    continue
+                path = prefix + member.name
+                self._add_member(path)
+                if not accounted:
+                    self._account(member.size)
+                extracted = tf.extractfile(member)
+                if extracted is not None:
+                    with extracted:
+                        self._descend(extracted.read(ARCHIVE_SNIFF_BYTES), extracted, path, depth)
+
+    def _walk_stream(self, f, kind: str, compressed: int, prefix: str, depth: int, name: str) -> None:
+        """gzip / bz2 单文件压缩：解压后若为 tar 直接列出其成员，否则列出解压出的文件"""
+        base, ext = os.path.splitext(name)
+        inner = base + '.tar' if ext.lower() in ('.tgz', '.tbz', '.tbz2') else (base or 'data')
+        path = prefix + inner
+        if kind == 'gzip' and compressed >= 18:
+            # gzip 尾部记录了解压后大小（模 2^32），无需解压即可发现压缩炸弹
+            f.seek(-4, os.SEEK_END)
+            declared = struct.unpack('<I', f.read(4))[0]
+            f.seek(0)
+            if not self._check_ratio(path, declared, compressed):
+                self._add_member(path)
+                return
+        opener = gzip.GzipFile(fileobj=f) if kind == 'gzip' else bz2.BZ2File(f)
+        with opener as stream:
+            head = stream.read(ARCHIVE_SNIFF_BYTES)
+            self._account(len(head))
+            if sniff_archive(head) == 'tar':
+                # foo.tar.gz：tar 成员直接挂在外层路径下
+                decompressed = self._spool(head, stream, path, compressed)
+                if decompressed is not None:
+                    try:
+                        self.walk(decompressed, 'tar', prefix, depth, accounted=True)
+                    finally:
+                        decompressed.close()
+                return
+            self._add_member(path)
+            self._descend(head, stream, path, depth, compressed)
+
+
+def inspect_archive(attachment_info: Dict[str, Any]) -> None:
+    """递归检查附件压缩包，结果写入 archive_contents / archive_warnings"""
+    data = attachment_info['data']
+    if not data:
+        return
+    kind = sniff_archive(data.read(ARCHIVE_SNIFF_BYTES))
+    if not kind:
+        return
+    walker = ArchiveWalker()
+    try:
+        walker.walk(data, kind, name=attachment_info['filename'])
+    except _ArchiveLimit:
+        pass
+    attachment_info['archive_contents'] = walker.paths
+    attachment_info['archive_warnings'] = walker.warnings
+
+
 def parse_attachment(attachment: Any, attachment_index: int) -> Dict[str, Any]:
     """
     解析邮件附件，提取详细信息
-    
+
     Args:
         attachment: 附件对象
         attachment_index: 附件索引号
-        
+
     Returns:
-        包含附件详细信息的字典
+        包含附件详细信息的字典；attachment_info['timing'] 累计该附件的解码、
+        压缩包检查与预览生成耗时
     """
+    timing = new_timing()
+    with StageTimer(timing):
+        attachment_info = _parse_attachment(attachment, attachment_index)
+    attachment_info['timing'] = timing
+    return attachment_info
+
+
+def _parse_attachment(attachment: Any, attachment_index: int) -> Dict[str, Any]:
+    """解析单个附件（由 parse_attachment 调用并计时）"""
     attachment_info = {
         'filename': '',          # 文件名
         'mime_type': '',         # MIME类型
         'size': 0,              # 文件大小
-        'data': None,           # 原始数据
+        'data': None,           # 内容句柄（AttachmentPayload，按需读取）
         'is_inline': False,     # 是否为内联附件
         'content_id': '',       # 内联附件的Content-ID
         'extension': '',        # 文件扩展名
         'hash_md5': '',         # MD5哈希值
         'hash_sha256': '',      # SHA256哈希值
-        'text_preview': '',     # 文本预览（如果是文本文件）
+        'text_preview': None,   # 文本预览（首次调用 get_text_preview 时生成）
         'is_archive': False,    # 是否为压缩文件
-        'archive_contents': [],  # 压缩文件内容列表
+        'archive_contents': [],  # 压缩文件内容列表（含嵌套路径，如 inner.zip/evil.exe）
+        'archive_warnings': [],  # 解包限制告警（嵌套过深、成员过多、疑似压缩炸弹等）
+        'preview_urls': None,   # 预览文本中的 URL（首次调用 get_preview_urls 时生成）
+        'cache_hit': False,     # 内容分析是否来自附件缓存
         'is_executable': False, # 是否为可执行文件
         'created_date': '',     # 创建日期
         'modified_date': '',    # 修改日期
@@ -431,8 +1011,13 @@ def parse_attachment(attachment: Any, attachment_index: int) -> Dict[str, Any]:
             filename = attachment.longFilename or attachment.shortFilename or f"未命名附件_{attachment_index}"
             attachment_info['filename'] = filename
             attachment_info['mime_type'] = attachment.mimetype or 'application/octet-stream'
-            attachment_info['data'] = attachment.data
-            attachment_info['size'] = len(attachment.data) if attachment.data else 0
+            payload = AttachmentPayload()
+            if isinstance(attachment.data, bytes):
+                view = memoryview(attachment.data)
+                for pos in range(0, len(view), DECODE_CHUNK):
+                    payload.write(view[pos:pos + DECODE_CHUNK])
+            attachment_info['data'] = payload.finish()
+            attachment_info['size'] = payload.size
             
         # 处理EML附件
         else:
@@ -456,152 +1041,307 @@ def parse_attachment(attachment: Any, attachment_index: int) -> Dict[str, Any]:
             if content_id:
                 attachment_info['content_id'] = content_id.strip('<>')
             
-            # 获取附件数据
-            payload = attachment.get_payload(decode=True)
-            if payload:
-                attachment_info['data'] = payload
-                attachment_info['size'] = len(payload)
+            # 获取附件数据（分块解码，大附件写入临时文件）
+            payload = decode_part_payload(attachment)
+            attachment_info['data'] = payload
+            attachment_info['size'] = payload.size
         
         # 获取文件扩展名
         attachment_info['extension'] = os.path.splitext(attachment_info['filename'])[1].lower()
         
-        # 计算哈希值
+        # 哈希值在解码时已同步计算
         if attachment_info['data']:
-            import hashlib
-            attachment_info['hash_md5'] = hashlib.md5(attachment_info['data']).hexdigest()
-            attachment_info['hash_sha256'] = hashlib.sha256(attachment_info['data']).hexdigest()
+            attachment_info['hash_md5'] = attachment_info['data'].md5
+            attachment_info['hash_sha256'] = attachment_info['data'].sha256
         
         # 检查是否为可执行文件
         executable_extensions = {'.exe', '.dll', '.bat', '.cmd', '.msi', '.vbs', '.js', '.ps1', '.com', '.scr'}
         attachment_info['is_executable'] = attachment_info['extension'] in executable_extensions
         
-        # 检查是否为压缩文件并提取内容列表
-        archive_extensions = {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2'}
+        # 同一内容此前已分析过：直接复用压缩包列表与预览 URL（预览 URL 可能尚未生成）
+        cached = _attachment_cache_get(attachment_info)
+        if cached is not None:
+            attachment_info['archive_contents'] = cached['archive_contents']
+            attachment_info['archive_warnings'] = cached['archive_warnings']
+            attachment_info['preview_urls'] = cached['preview_urls']
+            attachment_info['cache_hit'] = True
+        
+        # 检查是否为压缩文件并递归列出内容（按扩展名或文件头识别）
+        archive_extensions = {'.zip', '.rar', '.7z', '.tar', '.gz', '.tgz', '.bz2', '.tbz2'}
         if attachment_info['extension'] in archive_extensions:
             attachment_info['is_archive'] = True
+        elif attachment_info['data'] and attachment_info['extension'] not in ZIP_CONTAINER_EXTENSIONS:
+            attachment_info['is_archive'] = bool(sniff_archive(attachment_info['data'].read(ARCHIVE_SNIFF_BYTES)))
+        if attachment_info['is_archive'] and not attachment_info['cache_hit']:
+            inspect_archive(attachment_info)
+            # 立即写入缓存：提前结束时 URL 检测器可能不会运行，不能等到生成预览 URL 时再写
+            _attachment_cache_put(attachment_info)
+        
+    except Exception as e:
+        print(f"解析附件失败: {str(e)}")
+    
+    return attachment_info
+
+# 附件分析内容或格式变化时递增，使旧缓存条目失效
+ATTACHMENT_CACHE_VERSION = 3
+
+
+def _attachment_cache_key(attachment_info: Dict[str, Any]) -> str:
+    """
+    附件分析缓存键：版本 + 内容 SHA-256 + 扩展名（决定压缩包解析与预览方式）
+    + 该格式的预览库是否可用；空附件或未启用缓存时返回空串
+    """
+    if not CONFIG['attachment_cache'] or not attachment_info['hash_sha256']:
+        return ''
+    extension = attachment_info['extension']
+    return (f"v{ATTACHMENT_CACHE_VERSION}:{attachment_info['hash_sha256']}:"
+            f"{extension}:{int(preview_available(extension))}")
+
+
+def _attachment_cache_get(attachment_info: Dict[str, Any]):
+    key = _attachment_cache_key(attachment_info)
+    return get_cache('attachments').get(key) if key else None
+
+
+def _attachment_cache_put(attachment_info: Dict[str, Any]) -> None:
+    """写入压缩包列表与预览 URL（尚未生成时为 None，之后由 get_preview_urls 补写）"""
+    key = _attachment_cache_key(attachment_info)
+    if key:
+        get_cache('attachments').put(key, {
+            'archive_contents': attachment_info['archive_contents'],
+            'archive_warnings': attachment_info['archive_warnings'],
+            'preview_urls': attachment_info['preview_urls'],
+        }, ttl=CONFIG['attachment_ttl'])
+
+
+def get_preview_urls(attachment_info: Dict[str, Any]) -> List[str]:
+    """
+    获取附件预览文本中的 URL（首次调用时生成，并连同压缩包列表更新附件缓存）
+
+    分诊模式下不生成预览，返回空列表且不写缓存。
+    """
+    if attachment_info.get('preview_urls') is not None:
+        return attachment_info['preview_urls']
+    if CONFIG['triage']:
+        return []
+    preview = get_text_preview(attachment_info)
+    urls = find_urls(preview) if preview else []
+    attachment_info['preview_urls'] = urls
+    _attachment_cache_put(attachment_info)
+    return urls
+
+
+# 可生成内容预览的附件类型
+PREVIEW_TEXT_EXTENSIONS = {'.txt', '.csv', '.log', '.xml', '.json', '.html', '.htm', '.css', '.js', '.py', '.java', '.cpp', '.c', '.h', '.sql'}
+PREVIEW_DOCUMENT_EXTENSIONS = {'.pdf', '.docx', '.xlsx', '.pptx', '.doc', '.xls', '.ppt'}
+
+
+def get_text_preview(attachment_info: Dict[str, Any]) -> str:
+    """
+    获取附件的文本预览（首次调用时生成并缓存在 attachment_info 中）
+
+    文本文件只读取开头 8000 字节；文档超过 preview_max_bytes 时不解析，
+    PDF 页数 / PPT 幻灯片数受 preview_max_pages 限制。分诊模式下直接返回空串。
+
+    Returns:
+        预览文本，不支持的类型返回空串
+    """
+    if attachment_info.get('text_preview') is not None:
+        return attachment_info['text_preview']
+    if CONFIG['triage']:
+        return ''
+    with StageTimer(attachment_info.setdefault('timing', new_timing())):
+        attachment_info['text_preview'] = _build_text_preview(attachment_info)
+    return attachment_info['text_preview']
+
+
+def _build_text_preview(attachment_info: Dict[str, Any]) -> str:
+    """生成附件预览文本（由 get_text_preview 调用）"""
+    data = attachment_info['data']
+    extension = attachment_info['extension']
+    max_pages = CONFIG['preview_max_pages']
+    preview_text = ""
+
+    # 如果是文本文件，添加预览
+    if extension in PREVIEW_TEXT_EXTENSIONS and data:
+        try:
+            # 预览只需前 2000 个字符，UTF-8 每字符最多 4 字节
+            preview_text = data.read(8000).decode('utf-8', errors='ignore')
+            return preview_text[:2000] + '...' if len(preview_text) > 2000 else preview_text
+        except Exception as e:
+            print(f"生成文本预览失败: {str(e)}")
+            return ""
+
+    # 如果是文档文件且支持扩展格式，添加预览
+    if not (extension in PREVIEW_DOCUMENT_EXTENSIONS and data):
+        return ""
+    if data.size > CONFIG['preview_max_bytes']:
+        return ""
+    if extension not in PREVIEW_LIBRARIES:
+        return ""
+    # 对应的文档库只在第一次预览该格式时导入
+    library = optional_import(*PREVIEW_LIBRARIES[extension])
+    if library is None:
+        return ""
+
+    try:
+        # PDF文件处理
+        if extension == '.pdf':
             try:
-                import zipfile
-                if attachment_info['extension'] == '.zip' and attachment_info['data']:
-                    from io import BytesIO
-                    with zipfile.ZipFile(BytesIO(attachment_info['data'])) as zf:
-                        attachment_info['archive_contents'] = zf.namelist()
+                with data.open() as pdf_file:
+                    pdf_reader = library.PdfReader(pdf_file)
+                    preview_text = "PDF文档内容预览:\n"
+                    # 只预览前几页
+                    page_count = min(max_pages, len(pdf_reader.pages))
+                    for page_num in range(page_count):
+                        preview_text += f"\n--- 第{page_num + 1}页 ---\n"
+                        preview_text += pdf_reader.pages[page_num].extract_text()[:1000]
+                        if page_num < page_count - 1:
+                            preview_text += "\n...\n"
             except Exception as e:
-                print(f"解析压缩文件内容失败: {str(e)}")
-        
-        # 扩展文本文件和文档预览支持
-        preview_extensions = {
-            'text': {'.txt', '.csv', '.log', '.xml', '.json', '.html', '.htm', '.css', '.js', '.py', '.java', '.cpp', '.c', '.h', '.sql'},
-            'document': {'.pdf', '.docx', '.xlsx', '.pptx', '.doc', '.xls', '.ppt'},
-        }
-        
-        # 如果是文本文件，添加预览
-        if attachment_info['extension'] in preview_extensions['text'] and attachment_info['data']:
+                print(f"PDF文档预览失败: {str(e)}")
+
+        # Word文档处理
+        elif extension == '.docx':
             try:
-                preview_text = attachment_info['data'].decode('utf-8', errors='ignore')
-                attachment_info['text_preview'] = preview_text[:2000] + '...' if len(preview_text) > 2000 else preview_text
+                with data.open() as docx_file:
+                    doc = library.Document(docx_file)
+                    preview_text = "Word文档内容预览:\n\n"
+                    # 获取文档的前10个段落
+                    for i, para in enumerate(doc.paragraphs[:10]):
+                        if para.text.strip():
+                            preview_text += para.text + "\n"
+                    if len(doc.paragraphs) > 10:
+                        preview_text += "\n... (更多内容已省略)"
             except Exception as e:
-                print(f"生成文本预览失败: {str(e)}")
-        
-        # 如果是文档文件且支持扩展格式，添加预览
-        elif EXTRA_FORMATS_SUPPORTED and attachment_info['extension'] in preview_extensions['document'] and attachment_info['data']:
+                print(f"Word文档预览失败: {str(e)}")
+
+        # Excel文件处理
+        elif extension == '.xlsx':
             try:
-                preview_text = ""
-                
-                # PDF文件处理
-                if attachment_info['extension'] == '.pdf':
-                    try:
-                        pdf_file = io.BytesIO(attachment_info['data'])
-                        pdf_reader = PyPDF2.PdfReader(pdf_file)
-                        preview_text = "PDF文档内容预览:\n"
-                        # 只预览前3页
-                        for page_num in range(min(3, len(pdf_reader.pages))):
-                            preview_text += f"\n--- 第{page_num + 1}页 ---\n"
-                            preview_text += pdf_reader.pages[page_num].extract_text()[:1000]
-                            if page_num < min(2, len(pdf_reader.pages) - 1):
-                                preview_text += "\n...\n"
-                    except Exception as e:
-                        print(f"PDF文档预览失败: {str(e)}")
-                
-                # Word文档处理
-                elif attachment_info['extension'] == '.docx':
-                    try:
-                        docx_file = io.BytesIO(attachment_info['data'])
-                        doc = Document(docx_file)
-                        preview_text = "Word文档内容预览:\n\n"
-                        # 获取文档的前10个段落
-                        for i, para in enumerate(doc.paragraphs[:10]):
-                            if para.text.strip():
-                                preview_text += para.text + "\n"
-                        if len(doc.paragraphs) > 10:
-                            preview_text += "\n... (更多内容已省略)"
-                    except Exception as e:
-                        print(f"Word文档预览失败: {str(e)}")
-                
-                # Excel文件处理
-                elif attachment_info['extension'] == '.xlsx':
-                    try:
-                        xlsx_file = io.BytesIO(attachment_info['data'])
-                        wb = openpyxl.load_workbook(xlsx_file, read_only=True)
-                        preview_text = "Excel文档内容预览:\n\n"
-                        # 预览第一个工作表的前10行
-                        sheet = wb.active
-                        for i, row in enumerate(sheet.iter_rows(max_row=10)):
-                            if i == 0:
-                                preview_text += "表头: "
-                            preview_text += " | ".join(str(cell.value) for cell in row) + "\n"
-                        if sheet.max_row > 10:
-                            preview_text += "\n... (更多行已省略)"
-                        wb.close()  # 确保关闭工作簿
-                    except Exception as e:
-                        print(f"Excel文档预览失败: {str(e)}")
-                
-                # PowerPoint文件处理
-                elif attachment_info['extension'] == '.pptx':
-                    try:
-                        pptx_file = io.BytesIO(attachment_info['data'])
-                        prs = pptx.Presentation(pptx_file)
-                        preview_text = "PowerPoint文档内容预览:\n\n"
-                        # 预览前3张幻灯片
-                        for i, slide in enumerate(prs.slides[:3]):
-                            preview_text += f"\n--- 幻灯片 {i+1} ---\n"
-                            for shape in slide.shapes:
-                                if hasattr(shape, "text"):
-                                    preview_text += shape.text + "\n"
-                        if len(prs.slides) > 3:
-                            preview_text += "\n... (更多幻灯片已省略)"
-                    except Exception as e:
-                        print(f"PowerPoint文档预览失败: {str(e)}")
-                
-                if preview_text:
-                    attachment_info['text_preview'] = preview_text
-                
+                with data.open() as xlsx_file:
+                    wb = library.load_workbook(xlsx_file, read_only=True)
+                    preview_text = "Excel文档内容预览:\n\n"
+                    # 预览第一个工作表的前10行
+                    sheet = wb.active
+                    for i, row in enumerate(sheet.iter_rows(max_row=10)):
+                        if i == 0:
+                            preview_text += "表头: "
+                        preview_text += " | ".join(str(cell.value) for cell in row) + "\n"
+                    if sheet.max_row > 10:
+                        preview_text += "\n... (更多行已省略)"
+                    wb.close()  # 确保关闭工作簿
             except Exception as e:
-                print(f"文档预览处理失败: {str(e)}")
-        
+                print(f"Excel文档预览失败: {str(e)}")
+
+        # PowerPoint文件处理
+        elif extension == '.pptx':
+            try:
+                with data.open() as pptx_file:
+                    prs = library.Presentation(pptx_file)
+                    preview_text = "PowerPoint文档内容预览:\n\n"
+                    # 预览前几张幻灯片
+                    for i, slide in enumerate(prs.slides[:max_pages]):
+                        preview_text += f"\n--- 幻灯片 {i+1} ---\n"
+                        for shape in slide.shapes:
+                            if hasattr(shape, "text"):
+                                preview_text += shape.text + "\n"
+                    if len(prs.slides) > max_pages:
+                        preview_text += "\n... (更多幻灯片已省略)"
+            except Exception as e:
+                print(f"PowerPoint文档预览失败: {str(e)}")
+
     except Exception as e:
-        print(f"解析附件失败: {str(e)}")
-    
-    return attachment_info
+        print(f"文档预览处理失败: {str(e)}")
+
+    return preview_text
 
 # ========== 公共工具函数 ==========
 
-def levenshtein_distance(s1: str, s2: str) -> int:
-    """计算两个字符串的编辑距离"""
+def _myers_peq(pattern: str) -> Dict[str, int]:
+    """为 Myers 位并行算法构造模式串的字符位掩码表"""
+    peq: Dict[str, int] = {}
+    bit = 1
+    for c in pattern:
+        peq[c] = peq.get(c, 0) | bit
+        bit <<= 1
+    return peq
+
+
+def _myers_distance(peq: Dict[str, int], m: int, text: str, max_distance=None) -> int:
+    """
+    Myers / Hyyrö 位并行编辑距离：模式串的整列 DP 用一个整数的各个位表示，
+    每处理 text 的一个字符只需常数次位运算（Python 整数不限长度）。
+
+    超过 max_distance 时提前返回 max_distance + 1。
+    """
+    n = len(text)
+    if max_distance is not None and abs(m - n) > max_distance:
+        return max_distance + 1
+    if m == 0:
+        return n
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for j, c in enumerate(text):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+        # 剩余字符每个最多让距离减 1，已不可能回到阈值内
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return max_distance + 1
+    return score
+
+
+def levenshtein_distance(s1: str, s2: str, max_distance=None) -> int:
+    """
+    计算两个字符串的编辑距离
+
+    Args:
+        max_distance: 可选阈值；实际距离超过阈值时提前退出并返回 max_distance + 1
+
+    Returns:
+        编辑距离（不超过阈值时与逐格 DP 结果完全一致）
+    """
     if len(s1) < len(s2):
-        return levenshtein_distance(s2, s1)
-    if len(s2) == 0:
-        return len(s1)
-    previous_row = range(len(s2) + 1)
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            current_row.append(min(
-                previous_row[j + 1] + 1,
-                current_row[j] + 1,
-                previous_row[j] + (c1 != c2)
-            ))
-        previous_row = current_row
-    return previous_row[-1]
+        s1, s2 = s2, s1
+    return _myers_distance(_myers_peq(s2), len(s2), s1, max_distance)
+
+
+def levenshtein_many(query: str, candidates: List[str], max_distance=None) -> List[int]:
+    """
+    一个字符串与多个候选串的编辑距离（只构造一次位掩码表）
+
+    Returns:
+        与 candidates 一一对应的距离列表，语义同 levenshtein_distance()
+    """
+    peq = _myers_peq(query)
+    return [_myers_distance(peq, len(query), c, max_distance) for c in candidates]
+
+
+def similarity_cutoff(max_len: int) -> int:
+    """满足 1 - d / max_len > 0.8（“高度相似”）的最大编辑距离 d"""
+    k = max_len // 5
+    while k >= 0 and not 1 - k / max_len > 0.8:
+        k -= 1
+    return k
+
+
+# 仿冒域名中常见的追加词（如 company → companylogin）
+SUSPICIOUS_ADDITIONS = {
+    'portal', 'service', 'vendor', 'secure', 'mail',
+    'auth', 'login', 'account', 'verify', 'update', 'support'
+}
 
 
 def analyze_domain_similarity(domain1: str, domain2: str) -> Dict[str, Any]:
@@ -609,42 +1349,84 @@ def analyze_domain_similarity(domain1: str, domain2: str) -> Dict[str, Any]:
     分析两个域名之间的相似关系。
     返回 {'similarity': float, 'relationship_type': str|None, 'risk': str}
     """
-    if not domain1 or not domain2 or domain1 == domain2:
-        return {'similarity': 0.0, 'relationship_type': None, 'risk': 'low'}
+    return analyze_domain_similarity_many(domain1, [domain2])[0]
 
-    base1 = domain1.split('.')[0].lower()
-    base2 = domain2.split('.')[0].lower()
 
-    # 1. 字符替换（sinopc → sinopec，差1个字符）
-    if abs(len(base1) - len(base2)) <= 1:
-        diff = sum(c1 != c2 for c1, c2 in zip(base1, base2))
-        if diff <= 1:
-            return {'similarity': 0.95, 'relationship_type': '可疑的字符替换', 'risk': 'high'}
+def analyze_domain_similarity_many(domain: str, others: List[str], exact_low: bool = True) -> List[Dict[str, Any]]:
+    """
+    将一个域名与多个域名逐一比较，规则同 analyze_domain_similarity()。
 
-    # 2. 字母顺序调换（anagram）
-    if sorted(base1) == sorted(base2) and base1 != base2:
-        return {'similarity': 1.0, 'relationship_type': '字母顺序调换', 'risk': 'high'}
+    前三条规则逐对判断，剩余的对统一进入编辑距离比较：以“相似度 > 0.8”
+    换算出的最大距离为阈值做批量有界计算，超出阈值即提前退出，
+    提前退出的低风险结果再补算一次精确距离，全部字段与逐格计算完全一致。
 
-    # 3. 包含关系 + 可疑追加词
-    suspicious_additions = {
-        'portal', 'service', 'vendor', 'secure', 'mail',
-        'auth', 'login', 'account', 'verify', 'update', 'support'
-    }
-    if base1 in base2 or base2 in base1:
-        longer  = base1 if len(base1) > len(base2) else base2
-        shorter = base2 if len(base1) > len(base2) else base1
-        remaining = longer.replace(shorter, '').lower()
-        if any(w in remaining for w in suspicious_additions):
-            return {'similarity': 0.9, 'relationship_type': '可疑的域名包含', 'risk': 'high'}
+    Args:
+        exact_low: 为 False 时不补算，提前退出的低风险结果 similarity 为 None
+                   （只关心高风险结果的调用方用，省去整串计算）
+
+    Returns:
+        与 others 一一对应的结果列表
+    """
+    results: List[Dict[str, Any]] = [None] * len(others)
+    base1 = domain.split('.')[0].lower() if domain else ''
+    sorted1 = sorted(base1)
+    pending: Dict[int, List[int]] = {}   # 阈值 → 待算编辑距离的下标
+
+    for i, other in enumerate(others):
+        if not domain or not other or domain == other:
+            results[i] = {'similarity': 0.0, 'relationship_type': None, 'risk': 'low'}
+            continue
+        base2 = other.split('.')[0].lower()
+
+        # 1. 字符替换（sinopc → sinopec，差1个字符）
+        if abs(len(base1) - len(base2)) <= 1:
+            diff = sum(c1 != c2 for c1, c2 in zip(base1, base2))
+            if diff <= 1:
+                results[i] = {'similarity': 0.95, 'relationship_type': '可疑的字符替换', 'risk': 'high'}
+                continue
+
+        # 2. 字母顺序调换（anagram）
+        if sorted1 == sorted(base2) and base1 != base2:
+            results[i] = {'similarity': 1.0, 'relationship_type': '字母顺序调换', 'risk': 'high'}
+            continue
 
-    # 4. 编辑距离相似度
-    dist = levenshtein_distance(base1, base2)
-    max_len = max(len(base1), len(base2))
-    similarity = 1 - dist / max_len if max_len else 0
-    if similarity > 0.8:
-        return {'similarity': similarity, 'relationship_type': '高度相似', 'risk': 'high'}
+        # 3. 包含关系 + 可疑追加词
+        if base1 in base2 or base2 in base1:
+            longer  = base1 if len(base1) > len(base2) else base2
+            shorter = base2 if len(base1) > len(base2) else base1
+            remaining = longer.replace(shorter, '').lower()
+            if any(w in remaining for w in SUSPICIOUS_ADDITIONS):
+                results[i] = {'similarity': 0.9, 'relationship_type': '可疑的域名包含', 'risk': 'high'}
+                continue
+
+        max_len = max(len(base1), len(base2))
+        if not max_len:
+            results[i] = {'similarity': 0, 'relationship_type': None, 'risk': 'low'}
+            continue
+        pending.setdefault(similarity_cutoff(max_len), []).append(i)
+
+    # 4. 编辑距离相似度（按阈值分组批量计算）
+    low = []
+    for cutoff, indexes in pending.items():
+        bases = [others[i].split('.')[0].lower() for i in indexes]
+        for i, base2, dist in zip(indexes, bases, levenshtein_many(base1, bases, cutoff)):
+            if dist <= cutoff:
+                similarity = 1 - dist / max(len(base1), len(base2))
+                results[i] = {'similarity': similarity, 'relationship_type': '高度相似', 'risk': 'high'}
+            else:
+                low.append((i, base2))
+
+    # 超出阈值时返回的只是 cutoff + 1，低风险结果的 similarity 用精确距离计算
+    if low and exact_low:
+        bases = [base2 for _, base2 in low]
+        for (i, base2), dist in zip(low, levenshtein_many(base1, bases)):
+            similarity = 1 - dist / max(len(base1), len(base2))
+            results[i] = {'similarity': similarity, 'relationship_type': None, 'risk': 'low'}
+    else:
+        for i, _ in low:
+            results[i] = {'similarity': None, 'relationship_type': None, 'risk': 'low'}
 
-    return {'similarity': similarity, 'relationship_type': None, 'risk': 'low'}
+    return results
 
 
 def extract_email_domain(email_str: str) -> str:
@@ -653,6 +1435,162 @@ def extract_email_domain(email_str: str) -> str:
     return m.group(1).lower() if m else ''
 
 
+# URL 提取：用一个由定长分支组成的正则一次扫出候选锚点（协议前缀、www. 前缀、“.顶级域/”），
+# 再从锚点向两侧确定起点与终点。没有嵌套量词，括号配对每个片段只统计一次，
+# 任意输入下耗时都与文本长度成正比
+# 不用 (?i)：显式字符类能让 re 按首字符快速跳过，比忽略大小写的写法快约 10 倍
+_URL_ANCHOR = re.compile(r'[hHwW](?:[tT][tT][pP][sS]?://|[wW][wW]\d{0,3}\.)|\.[A-Za-z]{2,4}/')
+_URL_RUN = re.compile(r'[^\s<>]*')
+_URL_PARENS = re.compile(r'[()]')
+_DOMAIN_SPAN = re.compile(r'[A-Za-z0-9.\-]*')
+# URL 末尾不计入的标点（成对括号结尾保留）
+_URL_TRAILING = '`!([]{};:\'".,?«»“”‘’'
+# URL 中允许的括号嵌套层数（如 wiki/A_(b_(c))）
+URL_MAX_PAREN_DEPTH = 2
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == '_'
+
+
+def _domain_start(text: str, i: int, floor: int) -> int:
+    """从 i 向前越过域名字符（不越过 floor），返回域名字符区间的起点；按 64 字符一段反向匹配"""
+    while i > floor:
+        window = text[max(floor, i - 64):i][::-1]
+        span = _DOMAIN_SPAN.match(window).end()
+        if span < len(window):
+            return i - span
+        i -= span
+    return floor
+
+
+def _bare_domain(text: str, lo: int, slash: int) -> int:
+    """
+    [lo, slash) 为域名字符区间、其后是 '/' 时，“域名.顶级域/”形式 URL 的起点：
+    最后一个点号后须为 2-4 个字母，起点取区间内最靠左的单词边界；不成立返回 -1
+    """
+    dot = text.rfind('.', lo, slash)
+    if dot <= lo or not (2 <= slash - dot - 1 <= 4) or not text[dot + 1:slash].isalpha():
+        return -1
+    for i in range(lo, dot):
+        if (i > 0 and _is_word_char(text[i - 1])) != _is_word_char(text[i]):
+            return i
+    return -1
+
+
+def _paren_groups(text: str, start: int, end: int):
+    """
+    [start, end) 中括号的位置，以及每个成对左括号的右括号位置与嵌套高度（单遍栈匹配）
+
+    Returns:
+        (括号位置列表, {左括号位置: 右括号位置}, {左括号位置: 嵌套高度})；不成对的左括号不在字典中
+    """
+    positions = [m.start() for m in _URL_PARENS.finditer(text, start, end)]
+    close, height = {}, {}
+    stack = []
+    for i in positions:
+        if text[i] == '(':
+            stack.append([i, 0])
+        elif stack:
+            opened, inner = stack.pop()
+            close[opened], height[opened] = i, inner + 1
+            if stack:
+                # 内层括号不能为空（与原正则一致），含空内层的括号组视为嵌套过深
+                stack[-1][1] = max(stack[-1][1], inner + 1 if i > opened + 1 else URL_MAX_PAREN_DEPTH)
+    return positions, close, height
+
+
+def _url_end(start: int, run_end: int, parens) -> int:
+    """
+    URL 的终点：片段末尾，或本 URL 内第一个不成对的括号、嵌套过深的括号组
+
+    只在括号之间跳跃，成对的括号组整体跳过。
+    """
+    positions, close, height = parens
+    k = bisect.bisect_left(positions, start)
+    while k < len(positions):
+        i = positions[k]
+        if i not in close or height[i] > URL_MAX_PAREN_DEPTH:
+            return i
+        k = bisect.bisect_right(positions, close[i], k)
+    return run_end
+
+
+def find_urls(text: str) -> List[str]:
+    """
+    提取文本中的全部 URL（http(s)://、www. 开头，或“域名.顶级域/路径”），按出现顺序去重
+
+    识别范围与原 URL 正则一致（末尾的中文引号也会去掉），但为线性扫描，
+    不会因大量括号、点号等构造输入回溯。
+    """
+    urls = {}
+    pos = 0
+    run_end = -1
+    parens = None
+    # 已被否决（没有合法起点或前缀之后内容不足）的“域名.顶级域/”所在的 '/' 位置：同一个 '/' 的其他起点结果相同
+    dead_slash = -1
+    # 上一个 www. 锚点所在域名字符区间的终点；锚点落在区间内时直接复用，每个字符只扫描一次
+    domain_end = -1
+    while True:
+        anchor = _URL_ANCHOR.search(text, pos)
+        if anchor is None:
+            break
+        a = anchor.start()
+        start = slash = -1
+        if text[a] == '.':
+            # “.顶级域/”：向前找域名起点
+            if anchor.end() - 1 != dead_slash:
+                slash = anchor.end() - 1
+                start = _bare_domain(text, _domain_start(text, a, pos), slash)
+        else:
+            if not (a > 0 and _is_word_char(text[a - 1])):
+                # 协议前缀须在单词边界上
+                start, prefix_end = a, anchor.end()
+            if text[a] in 'wW':
+                # www.x.com/ 与其前面的域名字符可能构成更靠左的“域名.顶级域/”起点
+                if a >= domain_end:
+                    domain_end = _DOMAIN_SPAN.match(text, a).end()
+                tail = domain_end
+                if tail < len(text) and text[tail] == '/' and tail != dead_slash:
+                    bare = _bare_domain(text, _domain_start(text, a, pos), tail)
+                    if bare < 0:
+                        dead_slash = tail
+                    elif start < 0 or bare < start:
+                        start, slash = bare, tail
+        if start < 0:
+            pos = a + 1
+            continue
+        if slash >= 0:
+            prefix_end = slash + 1
+        if start >= run_end:
+            run_end = _URL_RUN.match(text, start).end()
+            parens = None
+            if '(' in text[start:run_end] or ')' in text[start:run_end]:
+                parens = _paren_groups(text, start, run_end)
+        end = _url_end(start, run_end, parens) if parens else run_end
+        url = text[start:end].rstrip(_URL_TRAILING)
+        # 前缀之后至少还要有两个单元（字符或成对括号组），否则从下一个字符继续找
+        prefix = prefix_end - start
+        if len(url) - prefix >= 2 and not (parens and url[prefix] == '(' and
+                                           parens[1].get(prefix_end) == start + len(url) - 1):
+            urls[url] = None
+            pos = end
+        else:
+            if slash >= 0:
+                dead_slash = slash
+            pos = start + 1
+    return list(urls)
+
+
+def get_text_urls(email_data: Dict[str, Any]) -> List[str]:
+    """纯文本正文中的 URL（首次调用时提取并缓存到 email_data，各检测器共用）"""
+    urls = email_data.get('text_urls')
+    if urls is None:
+        urls = find_urls(email_data.get('body_text') or '')
+        email_data['text_urls'] = urls
+    return urls
+
+
 def extract_url_domain(url: str) -> str:
     """从 URL 中提取域名"""
     try:
@@ -692,62 +1630,123 @@ def _sep(title: str = '', width: int = 60) -> str:
     return '─' * width
 
 
-# ========== 新增检测方法 ==========
+# ========== HTML 正文共享解析 ==========
 
-def detect_homograph_attack(email_data: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    检测同形字攻击（Homograph/IDN Homograph Attack）：
-    使用 Unicode 字符（如西里尔字母 а≠a）伪装域名。
-    """
-    result = {
-        'suspicious': [],
-        'risk_level': 'low',
-        'risk_score': 0.0,
-        'warnings': []
-    }
+# 优先使用 lxml（C 实现，解析大体积 HTML 明显更快），未安装时回退到标准库解析器；
+# 可通过环境变量 MER_HTML_PARSER 强制指定
+HTML_PARSER = os.environ.get('MER_HTML_PARSER') or (
+    'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+)
 
-    # ASCII 范围之外的字母映射（常见混淆字符集）
-    confusables = {
-        'а': 'a', 'е': 'e', 'о': 'o', 'р': 'p', 'с': 'c',
-        'х': 'x', 'у': 'y', 'і': 'i', 'ԁ': 'd', 'ɡ': 'g',
-        'ⅼ': 'l', '０': '0', '１': '1', '２': '2',
-    }
+# 图片隐藏/跟踪像素样式
+HIDDEN_IMG_STYLES = [
+    'display:none', 'display: none',
+    'visibility:hidden', 'visibility: hidden',
+    'opacity:0', 'opacity: 0',
+    'width:1px', 'width: 1px',
+    'height:1px', 'height: 1px'
+]
 
-    def has_confusable(s: str) -> bool:
-        return any(c in confusables for c in s)
+# 元素隐藏样式
+HIDDEN_ELEMENT_STYLES = [
+    'display:none', 'display: none',
+    'visibility:hidden', 'visibility: hidden',
+    'opacity:0', 'opacity: 0',
+    'font-size:0', 'font-size: 0'
+]
 
-    addresses = (
-        email_data.get('from', []) +
-        email_data.get('to', []) +
-        email_data.get('reply_to', [])
-    )
-    for addr in addresses:
-        if has_confusable(addr):
-            result['suspicious'].append(addr)
-            result['risk_score'] += 4.0
-            result['warnings'].append(
-                f'地址含同形混淆字符（可能是仿冒域名）: {addr}'
-            )
 
-    if result['risk_score'] >= 4:
-        result['risk_level'] = 'high'
+def index_html(html_content: Any) -> Dict[str, Any]:
+    """
+    解析 HTML 并单次遍历 DOM，按类别收集各检测器需要的元素
 
-    return result
+    Args:
+        html_content: HTML 字符串（bytes 会先按常见编码解码）
 
-
-def detect_suspicious_subject(email_data: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    基于主题关键词的威胁评分。
-    涵盖：紧迫感、金融诱导、账户威胁、凭证钓鱼等常见主题词。
+    Returns:
+        包含以下键的字典（元素均按文档顺序排列）：
+          soup             BeautifulSoup 文档对象
+          links            <a> 元素
+          images           <img> 元素
+          forms            <form> 元素
+          url_elements     <a> / <img> / <form> 元素
+          resources        <script> / <iframe> / <img> / <link> 元素
+          hidden_images    样式命中 HIDDEN_IMG_STYLES 的 <img>
+          hidden_elements  样式命中 HIDDEN_ELEMENT_STYLES 的任意元素
+          text             去除 script/style 后的可见文本（按行拼接）
     """
-    result = {
-        'matched_keywords': [],
-        'risk_level': 'low',
-        'risk_score': 0.0,
-        'warnings': []
+    if isinstance(html_content, bytes):
+        encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5']
+        for encoding in encodings:
+            try:
+                html_content = html_content.decode(encoding)
+                break
+            except:
+                continue
+
+    from bs4 import BeautifulSoup, CData, NavigableString, Tag
+
+    soup = BeautifulSoup(html_content or '', HTML_PARSER)
+    index = {
+        'soup': soup,
+        'links': [],
+        'images': [],
+        'forms': [],
+        'url_elements': [],
+        'resources': [],
+        'hidden_images': [],
+        'hidden_elements': [],
+        'text': '',
     }
-
-    HIGH_RISK = [
+    text_parts = []
+
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            name = node.name
+            if name == 'a':
+                index['links'].append(node)
+            elif name == 'img':
+                index['images'].append(node)
+            elif name == 'form':
+                index['forms'].append(node)
+            if name in ('a', 'img', 'form'):
+                index['url_elements'].append(node)
+            if name in ('script', 'iframe', 'img', 'link'):
+                index['resources'].append(node)
+
+            style = node.get('style')
+            if style:
+                style = style.lower()
+                if name == 'img' and any(s in style for s in HIDDEN_IMG_STYLES):
+                    index['hidden_images'].append(node)
+                if any(s in style for s in HIDDEN_ELEMENT_STYLES):
+                    index['hidden_elements'].append(node)
+
+        elif type(node) in (NavigableString, CData):
+            if node.parent is not None and node.parent.name in ('script', 'style'):
+                continue
+            stripped = node.strip()
+            if stripped:
+                text_parts.append(stripped)
+
+    index['text'] = '\n'.join(text_parts)
+    return index
+
+
+def get_html_index(email_data: Dict[str, Any]) -> Dict[str, Any]:
+    """获取邮件 HTML 正文的共享解析结果（首次调用时解析并缓存到 email_data）"""
+    index = email_data.get('html_index')
+    if index is None:
+        index = index_html(email_data.get('body_html') or '')
+        email_data['html_index'] = index
+    return index
+
+
+# ========== 关键词多模式匹配 ==========
+
+# 内置关键词表：短语 → 权重（高风险 2.0，中风险 0.5）
+DEFAULT_KEYWORDS = {
+    **dict.fromkeys([
         '紧急', '立即', '马上', 'urgent', 'immediate', 'action required',
         '账号被冻结', '账户异常', '密码过期', 'password expired',
         '验证失败', 'verify your account', '点击此处', 'click here',
@@ -755,26 +1754,385 @@ def detect_suspicious_subject(email_data: Dict[str, Any]) -> Dict[str, Any]:
         '汇款', '转账', 'wire transfer', '发票', 'invoice',
         '退款', 'refund', '付款确认', 'payment confirmation',
         '报价', 'quotation', '合同', 'contract',
-    ]
-    MED_RISK = [
+    ], 2.0),
+    **dict.fromkeys([
         '通知', 'notification', '更新', 'update', '确认', 'confirm',
         '重要', 'important', '提醒', 'reminder',
-    ]
+    ], 0.5),
+}
 
-    subject = email_data.get('subject', '').lower()
-    for kw in HIGH_RISK:
-        if kw.lower() in subject:
-            result['matched_keywords'].append(kw)
-            result['risk_score'] += 2.0
-    for kw in MED_RISK:
-        if kw.lower() in subject:
-            result['matched_keywords'].append(kw)
-            result['risk_score'] += 0.5
+# 全角 ASCII / 全角空格 → 半角；零宽字符、软连字符 → 删除
+_NORMALIZE_TABLE = {cp: cp - 0xFEE0 for cp in range(0xFF01, 0xFF5F)}
+_NORMALIZE_TABLE[0x3000] = ord(' ')
+_NORMALIZE_TABLE.update(dict.fromkeys([0x00AD, 0x200B, 0x200C, 0x200D, 0x2060, 0xFEFF]))
+
+
+def normalize_text(text: str) -> str:
+    """关键词匹配前的文本归一化：全角转半角、去除零宽字符、大小写折叠"""
+    return text.translate(_NORMALIZE_TABLE).casefold()
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick 多模式匹配自动机
+
+    所有关键词编译进同一个自动机，扫描一段文本只需一次线性遍历，
+    耗时与词表大小无关。
+    """
+
+    def __init__(self, keywords: Dict[str, float]):
+        self.phrases: List[str] = []
+        self.weights: List[float] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+
+        for phrase, weight in keywords.items():
+            key = normalize_text(phrase)
+            if not key:
+                continue
+            state = 0
+            for c in key:
+                nxt = self._goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][c] = nxt
+                    self._goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(len(self.phrases))
+            self.phrases.append(phrase)
+            self.weights.append(float(weight))
+
+        # 广度优先计算失败指针，并把后缀状态的输出合并进来
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(c, 0)
+                outputs[nxt].extend(outputs[self._fail[nxt]])
+        self._out = [tuple(o) for o in outputs]
+
+    def scan(self, text: str) -> set:
+        """返回 text（先归一化）中出现的全部关键词编号"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for c in normalize_text(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+_keyword_automaton = None
+
+
+def load_keywords(path: str) -> Dict[str, float]:
+    """读取关键词配置文件（JSON 对象：短语 → 权重）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("关键词文件必须是 {\"短语\": 权重} 形式的 JSON 对象")
+    return {str(phrase): float(weight) for phrase, weight in data.items()}
+
+
+def get_keyword_automaton() -> KeywordAutomaton:
+    """获取当前关键词自动机（关键词文件修改后自动重新编译）"""
+    global _keyword_automaton
+    path = CONFIG['keyword_file']
+    source = None
+    if path:
+        try:
+            source = (path, os.path.getmtime(path))
+        except OSError:
+            source = (path, None)
+    if _keyword_automaton is None or _keyword_automaton[0] != source:
+        keywords = DEFAULT_KEYWORDS
+        if path:
+            try:
+                keywords = load_keywords(path)
+            except (OSError, ValueError) as e:
+                print(f"加载关键词文件失败，使用内置词表: {str(e)}")
+        _keyword_automaton = (source, KeywordAutomaton(keywords))
+    return _keyword_automaton[1]
+
+
+# ========== Unicode 同形字骨架 ==========
+
+# 内置同形字表（UTS #39 confusables 中与拉丁小写字母、数字相混淆的常用字符）：
+# 目标字符 -> 外形相同的源字符。输入先做小写与 NFKD 兼容分解，全角字符、数学字母
+# （𝐩𝐚𝐲𝐩𝐚𝐥）、罗马数字（ⅼ）等已在分解时还原为 ASCII，不必列出
+CONFUSABLE_TABLE = {
+    'a': '\u0430\u0251\u03b1\u237a',            # а ɑ α ⍺
+    'b': '\u044c\u0184\u13cf\u15af',            # ь Ƅ Ꮟ ᖯ
+    'c': '\u0441\u03f2\u1d04\u2ca5\u217d',      # с ϲ ᴄ ⲥ ⅽ
+    'd': '\u0501\u13e7\u146f\ua4d2',            # ԁ Ꮷ ᑯ ꓒ
+    'e': '\u0435\u04bd\u212e\uab32',            # е ҽ ℮ ꬲ
+    'g': '\u0261\u0581\u1d83\u018d',            # ɡ ց ᶃ ƍ
+    'h': '\u04bb\u0570\u13c2',                  # һ հ Ꮒ
+    'i': '\u0456\u0131\u0269\u03b9\ua647\u1fbe',  # і ı ɩ ι ꙇ ι
+    'j': '\u0458\u03f3',                        # ј ϳ
+    'k': '\u03ba\u1d0b\u2c95',                  # κ ᴋ ⲕ
+    'l': '1|\u04cf\u01c0\u05c0\u0627\u2223',     # 1 | ӏ ǀ ׀ ا ∣
+    'n': '\u0578\u057c\u0274',                  # ո ռ ɴ
+    'o': '0\u043e\u03bf\u0585\u03c3\u2c9f\u0ce6\u0d20\u101d\u10ff',  # 0 о ο օ σ ⲟ ೦ ഠ ဝ ჿ
+    'p': '\u0440\u03c1\u2ca3\u01bf',            # р ρ ⲣ ƿ
+    'q': '\u051b\u0563\u0566',                  # ԛ գ զ
+    'r': '\u0433\u1d26\u2c85\uab47',            # г ᴦ ⲅ ꭇ
+    's': '\u0455\ua731\u01bd',                  # ѕ ꜱ ƽ
+    't': '\u03c4\u1d1b',                        # τ ᴛ
+    'u': '\u03c5\u057d\u028b\u1d1c\ua79f',      # υ ս ʋ ᴜ ꞟ
+    'v': '\u03bd\u0475\u1d20\u2174',            # ν ѵ ᴠ ⅴ
+    'w': '\u051d\u0461\u1d21\u026f',            # ԝ ѡ ᴡ ɯ
+    'x': '\u0445\u03c7\u1541\u166e\u2179',      # х χ ᕁ ᙮ ⅹ
+    'y': '\u0443\u03b3\u04af\u028f\u10e7',      # у γ ү ʏ ყ
+    'z': '\u1d22\uab93',                        # ᴢ ꮓ
+}
+# UTS #39 中 ASCII 字符本身的骨架（m 与 rn、d 与 cl 同形）
+ASCII_SKELETON = {'m': 'rn', 'd': 'cl'}
+
+_confusable_map = None
+
+
+def load_confusables(path: str) -> Dict[int, str]:
+    """
+    读取 Unicode confusables.txt（`源码点 ; 目标码点序列 ; MA # 注释`）
+
+    Returns:
+        str.translate 映射表：源码点 -> 目标字符串（已小写）
+    """
+    table = {}
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split(';')
+            if len(fields) < 2 or not fields[0].strip():
+                continue
+            source = int(fields[0].strip(), 16)
+            table[source] = ''.join(chr(int(cp, 16)) for cp in fields[1].split()).lower()
+    return table
+
+
+def get_confusable_map() -> Dict[int, str]:
+    """
+    获取编译好的骨架映射表（str.translate 用；confusables 文件修改后自动重新编译）
+
+    内置表与外部文件合并后，每个目标字符串再按同一张表映射一次，
+    保证骨架一步到位（如 ԁ -> d -> cl）。
+    """
+    global _confusable_map
+    path = CONFIG['confusables_file']
+    source = None
+    if path:
+        try:
+            source = (path, os.path.getmtime(path))
+        except OSError:
+            source = (path, None)
+    if _confusable_map is None or _confusable_map[0] != source:
+        table = {ord(c): target for c, target in ASCII_SKELETON.items()}
+        for target, chars in CONFUSABLE_TABLE.items():
+            for c in chars:
+                table[ord(c)] = target
+        if path:
+            try:
+                table.update(load_confusables(path))
+            except (OSError, ValueError) as e:
+                print(f"加载 confusables 文件失败，使用内置同形字表: {str(e)}")
+        resolved = {src: target.translate(table) for src, target in table.items()}
+        _confusable_map = (source, resolved)
+    return _confusable_map[1]
+
+
+def skeleton(text: str, table: Dict[int, str] = None) -> str:
+    """
+    UTS #39 骨架：小写、NFKD 兼容分解后逐字符映射为原型字符；外形相同的字符串骨架相同
+
+    批量计算时先取一次 get_confusable_map() 作为 table 传入，避免每次调用都检查 confusables 文件。
+    """
+    if table is None:
+        table = get_confusable_map()
+    return unicodedata.normalize('NFKD', text.lower()).translate(table)
+
+
+def idna_decode(host: str) -> str:
+    """把主机名中的 xn-- 标签还原为 Unicode（无法解码的标签保持原样）"""
+    labels = []
+    for label in host.lower().split('.'):
+        if label.startswith('xn--'):
+            try:
+                label = label.encode('ascii').decode('idna')
+            except UnicodeError:
+                pass
+        labels.append(label)
+    return '.'.join(labels)
+
+
+def latin_confusable(text: str, latin_context: bool = False, table: Dict[int, str] = None) -> bool:
+    """
+    text 是否在冒充拉丁字母：含骨架为 ASCII 的非 ASCII 字符（如西里尔 а），且与 ASCII 字母
+    混用（pаypal-café）；或全部由这类字符组成（аррӏе），且同一主机名的其他标签是拉丁字母
+    （latin_context，如 аррӏе.com），与浏览器的 IDN 显示策略一致。正常的中文、俄文名称
+    不会命中：сахар.рф 整个主机名都是西里尔字母，只在骨架与受保护域名相同时才算仿冒
+
+    >>> latin_confusable('pаypal')
+    True
+    >>> latin_confusable('аррӏе', latin_context=True)
+    True
+    >>> latin_confusable('сахар')
+    False
+    >>> latin_confusable('иван')
+    False
+    """
+    if text.isascii():
+        return False
+    if table is None:
+        table = get_confusable_map()
+    disguised = [not c.isascii() and unicodedata.normalize('NFKD', c.lower()).translate(table).isascii()
+                 for c in text]
+    if not any(disguised):
+        return False
+    if any(c.isascii() and c.isalpha() for c in text):
+        return True
+    return latin_context and all(c.isascii() or fake for c, fake in zip(text, disguised))
+
+
+# ========== 新增检测方法 ==========
+
+def detect_homograph_attack(email_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    检测同形字攻击（Homograph/IDN Homograph Attack）：
+    使用 Unicode 字符（如西里尔字母 а≠a）伪装域名。
+
+    发件人 / 收件人 / 回复地址与正文中全部 URL 主机名先做 IDNA 解码（xn--），再计算
+    UTS #39 骨架：含冒充拉丁字母的字符，或骨架与收件人域名、受保护品牌域名相同
+    但本身不同的，均视为同形字仿冒。受保护域名的骨架预先建成字典，每次比较为 O(1)。
+    整个主机名都不是拉丁字母时（如 сахар.рф），只按骨架与受保护域名比较。
+
+    >>> email_data = new_email_data()
+    >>> email_data.update({'from': ['иван@сахар.рф'], 'to': ['b@xn--bcher-kva.de'], 'body_text': 'https://сахар.рф/'})
+    >>> detect_homograph_attack(email_data)['risk_score']
+    0.0
+    """
+    result = {
+        'suspicious': [],
+        'skeleton_matches': [],
+        'risk_level': 'low',
+        'risk_score': 0.0,
+        'warnings': []
+    }
+
+    def addr_spec(addr: str) -> str:
+        # 只检查地址本身，显示名中的中文等字符不参与判断
+        match = re.search(r'<([^<>]*)>', addr)
+        return (match.group(1) if match else addr).strip()
+
+    addresses = [addr_spec(a) for a in (
+        email_data.get('from', []) +
+        email_data.get('to', []) +
+        email_data.get('reply_to', [])
+    )]
+    hosts = [('地址', addr, extract_email_domain(addr)) for addr in addresses if addr]
+    hosts += [('URL', domain, domain) for domain in collect_url_domains(email_data)]
+
+    # 受保护骨架：收件人自己的域名 + 受保护品牌索引；域名一律取 IDNA 解码后的形式
+    table = get_confusable_map()
+    protected = {}
+    brand_index = get_brand_index()
+    if brand_index:
+        protected.update(brand_index.skeletons(table))
+    for addr in email_data.get('to', []):
+        domain = extract_email_domain(addr)
+        if domain:
+            domain = registrable_domain(idna_decode(domain))
+            protected.setdefault(skeleton(domain, table), domain)
+
+    seen = set()
+    for label, text, host in hosts:
+        decoded = idna_decode(host) if host else ''
+        if text in seen:
+            continue
+        seen.add(text)
+        local_part = text.split('@')[0] if label == '地址' and '@' in text else ''
+        labels = [part for part in decoded.split('.') if part]
+        latin_context = any(part.isascii() and any(c.isalpha() for c in part) for part in labels)
+        confusable = any(latin_confusable(part, latin_context, table)
+                         for part in [local_part, *labels] if part)
+        target = None
+        if decoded and not decoded.isascii():
+            domain = registrable_domain(decoded)
+            target = protected.get(skeleton(domain, table))
+            if target == domain:
+                target = None
+        if not (confusable or target):
+            continue
+        result['suspicious'].append(text)
+        result['risk_score'] += 4.0
+        shown = f"{text}（{decoded}）" if decoded != host and decoded else text
+        if target:
+            result['skeleton_matches'].append({'source': label, 'value': text, 'decoded': decoded, 'protected': target})
+            result['warnings'].append(f'{label} {shown} 与 {target} 外形相同（同形字仿冒）')
+        else:
+            result['warnings'].append(f'{label}含同形混淆字符（可能是仿冒域名）: {shown}')
+
+    if result['risk_score'] >= 4:
+        result['risk_level'] = 'high'
+
+    return result
+
+
+def detect_suspicious_subject(email_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    基于关键词的威胁评分。
+    涵盖：紧迫感、金融诱导、账户威胁、凭证钓鱼等常见主题词。
+    主题、纯文本正文和 HTML 正文文本各扫描一遍；同一关键词只计一次，
+    主题命中按完整权重计分，仅在正文中命中的按 body_keyword_factor 折算。
+    """
+    result = {
+        'matched_keywords': [],   # 主题命中
+        'body_keywords': [],      # 仅正文 / HTML 命中
+        'field_matches': {},      # 字段 → 命中的关键词
+        'risk_level': 'low',
+        'risk_score': 0.0,
+        'warnings': []
+    }
+
+    automaton = get_keyword_automaton()
+    fields = {
+        'subject': email_data.get('subject', ''),
+        'body': email_data.get('body_text', ''),
+        'html': get_html_index(email_data)['text'] if email_data.get('body_html') else '',
+    }
+    hits = {}
+    for field, text in fields.items():
+        if text:
+            found = automaton.scan(text)
+            if found:
+                hits[field] = found
+                result['field_matches'][field] = sorted(automaton.phrases[i] for i in found)
+
+    subject_hits = hits.get('subject', set())
+    body_hits = (hits.get('body', set()) | hits.get('html', set())) - subject_hits
+    factor = CONFIG['body_keyword_factor']
+    for i in sorted(subject_hits):
+        result['matched_keywords'].append(automaton.phrases[i])
+        result['risk_score'] += automaton.weights[i]
+    for i in sorted(body_hits):
+        result['body_keywords'].append(automaton.phrases[i])
+        result['risk_score'] += automaton.weights[i] * factor
 
     result['risk_level'] = risk_label(result['risk_score'])
     if result['matched_keywords']:
         result['warnings'].append(
-            f"主题含高风险关键词: {', '.join(set(result['matched_keywords']))}"
+            f"主题含高风险关键词: {', '.join(result['matched_keywords'])}"
+        )
+    if result['body_keywords']:
+        result['warnings'].append(
+            f"正文含可疑关键词: {', '.join(result['body_keywords'])}"
         )
     return result
 
@@ -838,6 +2196,12 @@ def detect_suspicious_attachments(email_data: Dict[str, Any]) -> Dict[str, Any]:
             )
             result['risk_score'] += 4.0
 
+        # 嵌套过深、成员过多、压缩比异常等解包限制
+        archive_warnings = att.get('archive_warnings', [])
+        if archive_warnings:
+            issues.append(f'压缩包 {fname} 触发解包保护: {"; ".join(archive_warnings[:3])}')
+            result['risk_score'] += 3.0
+
         if issues:
             result['suspicious'].append({'filename': fname, 'issues': issues})
             result['warnings'].extend(issues)
@@ -912,6 +2276,7 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
             'html': [],      # HTML内容中的URL
             'attachments': [] # 附件内容中的URL
         },
+        'unique_urls': [],       # 全部来源去重后的URL
         'suspicious_links': [],  # 可疑的超链接
         'risk_level': 'low',
         'risk_score': 0.0,
@@ -919,9 +2284,6 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
     }
     
     try:
-        # URL正则表达式模式
-        url_pattern = r'(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:\'".,<>?«»""'']))'
-        
         def analyze_link_safety(display_text: str, actual_url: str, email_domains: List[str]) -> Dict[str, Any]:
             """分析超链接的安全性"""
             res = {
@@ -932,7 +2294,7 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
                 'reasons': []
             }
 
-            display_domain = extract_url_domain(display_text) if re.search(url_pattern, display_text) else None
+            display_domain = extract_url_domain(display_text) if find_urls(display_text) else None
             actual_domain  = extract_url_domain(actual_url)
 
             if display_domain and actual_domain and display_domain != actual_domain:
@@ -941,9 +2303,9 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
                     f"超链接显示域名({display_domain})与实际域名({actual_domain})不匹配"
                 )
 
-            for email_domain in email_domains:
-                if actual_domain:
-                    analysis = analyze_domain_similarity(actual_domain, email_domain)
+            if actual_domain:
+                analyses = analyze_domain_similarity_many(actual_domain, email_domains, exact_low=False)
+                for email_domain, analysis in zip(email_domains, analyses):
                     if analysis['risk'] == 'high':
                         res['risk_score'] += 2.5
                         res['reasons'].append(
@@ -983,16 +2345,15 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
         
         # 从纯文本中提取URL
         if email_data['body_text']:
-            text_urls = re.findall(url_pattern, email_data['body_text'])
-            result['urls']['text'] = [url[0] for url in text_urls]
+            result['urls']['text'] = get_text_urls(email_data)
         
         # 从HTML内容中提取URL和分析超链接
         if email_data['body_html']:
             try:
-                soup = BeautifulSoup(email_data['body_html'], 'html.parser')
+                html_index = get_html_index(email_data)
                 
                 # 分析所有超链接
-                for link in soup.find_all('a'):
+                for link in html_index['links']:
                     href = link.get('href')
                     if href and not href.startswith('mailto:'):
                         display_text = link.get_text(strip=True)
@@ -1004,7 +2365,7 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
                             result['risk_score'] += analysis['risk_score']
                 
                 # 提取图片链接
-                for img in soup.find_all('img'):
+                for img in html_index['images']:
                     src = img.get('src')
                     if src and not src.startswith('data:'):
                         result['urls']['html'].append(src)
@@ -1014,15 +2375,15 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
         
         # 从附件中提取URL
         for attachment in email_data['attachments']:
-            if attachment.get('text_preview'):
-                attachment_urls = re.findall(url_pattern, attachment['text_preview'])
-                result['urls']['attachments'].extend([url[0] for url in attachment_urls])
+            result['urls']['attachments'].extend(get_preview_urls(attachment))
         
-        # 去重并清理URL
+        # 清理并去重URL：各来源按出现顺序去重，再汇总为全部来源共用的唯一URL集合
+        unique_urls = {}
         for source in result['urls']:
-            result['urls'][source] = list(set(result['urls'][source]))
-            result['urls'][source] = [url.rstrip('.,;:\'\"!?') for url in result['urls'][source]]
-            result['urls'][source] = [url for url in result['urls'][source] if url]
+            cleaned = (url.rstrip('.,;:\'\"!?') for url in result['urls'][source])
+            result['urls'][source] = list(dict.fromkeys(url for url in cleaned if url))
+            unique_urls.update(dict.fromkeys(result['urls'][source]))
+        result['unique_urls'] = list(unique_urls)
         
         # 设置最终风险等级
         if result['risk_score'] >= 5.0:
@@ -1033,7 +2394,7 @@ def extract_urls(email_data: Dict[str, Any]) -> Dict[str, Any]:
             result['warnings'].append("发现可疑URL，请谨慎点击")
         
         # 添加统计信息
-        total_urls = len(result['urls']['text']) + len(result['urls']['html']) + len(result['urls']['attachments'])
+        total_urls = len(result['unique_urls'])
         result['warnings'].append(f"总计发现 {total_urls} 个URL，其中 {len(result['suspicious_links'])} 个可疑")
         
     except Exception as e:
@@ -1063,27 +2424,10 @@ def detect_hidden_content(email_data: Dict[str, Any]) -> Dict[str, List[Dict[str
     
     try:
         if email_data['body_html']:
-            # 尝试多种编码方式解析HTML内容
-            html_content = email_data['body_html']
-            if isinstance(html_content, bytes):
-                encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5']
-                for encoding in encodings:
-                    try:
-                        html_content = html_content.decode(encoding)
-                        break
-                    except:
-                        continue
-            
-            soup = BeautifulSoup(html_content, 'html.parser')
+            html_index = get_html_index(email_data)
             
             # 1. 检查隐藏的图片和跟踪像素
-            hidden_images = soup.find_all('img', style=lambda x: x and any(style in x.lower() for style in [
-                'display:none', 'display: none',
-                'visibility:hidden', 'visibility: hidden',
-                'opacity:0', 'opacity: 0',
-                'width:1px', 'width: 1px',
-                'height:1px', 'height: 1px'
-            ]))
+            hidden_images = html_index['hidden_images']
             
             for img in hidden_images:
                 src = img.get('src', '')
@@ -1096,7 +2440,7 @@ def detect_hidden_content(email_data: Dict[str, Any]) -> Dict[str, List[Dict[str
                 findings['risk_score'] += 3.0
             
             # 2. 检查所有图片的尺寸属性
-            all_images = soup.find_all('img')
+            all_images = html_index['images']
             for img in all_images:
                 width = img.get('width', '').strip()
                 height = img.get('height', '').strip()
@@ -1110,12 +2454,7 @@ def detect_hidden_content(email_data: Dict[str, Any]) -> Dict[str, List[Dict[str
                     findings['risk_score'] += 2.5
             
             # 3. 检查隐藏的内容
-            hidden_elements = soup.find_all(lambda tag: tag.get('style') and any(style in tag.get('style', '').lower() for style in [
-                'display:none', 'display: none',
-                'visibility:hidden', 'visibility: hidden',
-                'opacity:0', 'opacity: 0',
-                'font-size:0', 'font-size: 0'
-            ]))
+            hidden_elements = html_index['hidden_elements']
             
             for element in hidden_elements:
                 content = element.get_text().strip()
@@ -1129,7 +2468,7 @@ def detect_hidden_content(email_data: Dict[str, Any]) -> Dict[str, List[Dict[str
                     findings['risk_score'] += 2.0
             
             # 4. 检查可疑的URL和链接
-            links = soup.find_all(['a', 'img', 'form'])
+            links = html_index['url_elements']
             for link in links:
                 url = link.get('href') or link.get('src') or link.get('action', '')
                 if url:
@@ -1173,7 +2512,7 @@ def detect_hidden_content(email_data: Dict[str, Any]) -> Dict[str, List[Dict[str
                         print(f"URL分析失败: {str(e)}")
             
             # 5. 检查外部资源加载
-            external_resources = soup.find_all(['script', 'iframe', 'img', 'link'])
+            external_resources = html_index['resources']
             for resource in external_resources:
                 src = resource.get('src') or resource.get('href', '')
                 if src and ('track' in src.lower() or 'beacon' in src.lower() or 'pixel' in src.lower()):
@@ -1376,8 +2715,45 @@ def verify_email_auth(email_data: Dict[str, Any]) -> Dict[str, Any]:
     
     return auth_results
 
+def run_detectors(email_data: Dict[str, Any], only: tuple = None,
+                  early_exit: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    依次运行全部检测器（不打印报告）
+
+    Args:
+        email_data: 邮件解析数据
+        only: 只运行这些维度（默认全部）
+        early_exit: 按 DETECTOR_COST_ORDER 由快到慢运行，恶意判定确定后跳过剩余检测器
+
+    Returns:
+        以维度键（auth/domain/spoof/...）为键的检测结果字典，提前结束时只含已运行的维度；
+        各检测器耗时记录在 email_data['timings']['detectors']
+    """
+    timings = email_data.setdefault('timings', {}).setdefault('detectors', {})
+    detectors = dict(DETECTORS)
+    results = {}
+    for key in (DETECTOR_COST_ORDER if early_exit else detectors):
+        if only is not None and key not in only:
+            continue
+        timings[key] = new_timing()
+        with StageTimer(timings[key]):
+            results[key] = detectors[key](email_data)
+        if early_exit and len(results) < len(detectors) and verdict_decided(results) is not None:
+            break
+    return results
+
 def display_report(email_data: Dict[str, Any]) -> None:
     """显示邮件分析报告（彩色高亮 + 综合评分）"""
+    render_report(analyze_email(email_data))
+
+
+def render_report(verdict: Dict[str, Any]) -> None:
+    """
+    将 analyze_email() 返回的结构化判定渲染为彩色终端报告
+
+    Args:
+        verdict: analyze_email() 的返回值
+    """
 
     # ── ANSI 颜色常量 ──
     R  = '\033[1;31m'   # 红（高危）
@@ -1404,121 +2780,22 @@ def display_report(email_data: Dict[str, Any]) -> None:
         print(f"\n{B}{'─'*60}{RS}")
         print(f"{W}[{num}] {title}{RS}")
 
-    # ══════════════════════════════════════════════
-    # 先运行所有检测，收集分数，最后汇总
-    # ══════════════════════════════════════════════
-    auth_r     = verify_email_auth(email_data)
-    domain_r   = check_similar_domains(email_data)
-    spoof_r    = detect_spoofed_sender(email_data)
-    reg_r      = analyze_domain_registration(email_data)
-    hidden_r   = detect_hidden_content(email_data)
-    url_r      = extract_urls(email_data)
-    att_r      = detect_suspicious_attachments(email_data)
-    subj_r     = detect_suspicious_subject(email_data)
-    homo_r     = detect_homograph_attack(email_data)
-    time_r     = detect_time_anomaly(email_data)
-
-
-    # ══════════════════════════════════════════════
-    # 综合评分（满分 100）
-    # ──────────────────────────────────────────────
-    # 权重设计依据（安全实践）：
-    #
-    # 【极高权重 - 单独触发即高度可疑】
-    #   同形字攻击(15)：几乎100%恶意，无正常使用场景
-    #   附件威胁(15)：可执行文件/宏/双扩展名，直接危害最高
-    #
-    # 【高权重 - 强信号】
-    #   发件人伪造(15)：SPF/Received链不匹配，确认身份欺骗
-    #   邮件认证(15)：SPF/DKIM/DMARC三重失败，发件人可信度极低
-    #   域名仿冒(12)：字符替换/高相似域名，典型钓鱼手法
-    #
-    # 【中权重 - 辅助信号】
-    #   URL风险(10)：链接显示与实际不符，辅助判断
-    #   隐藏内容(8)：跟踪像素等，钓鱼邮件常用
-    #   域名年龄(8)：新注册域名，单独价值中等
-    #
-    # 【低权重 - 弱信号，配合其他使用】
-    #   主题关键词(5)：正常邮件也可能触发
-    #   时间异常(5)：单独出现可能是服务器问题
-    # ──────────────────────────────────────────────
-    # 各维度格式：(原始分, 原始满分, 权重)
-    WEIGHTS = {
-        'homo':    (homo_r['risk_score'],    4.0,  15),  # 同形字：极高危
-        'att':     (att_r['risk_score'],    10.0,  15),  # 附件威胁：极高危
-        'spoof':   (spoof_r['risk_score'],   8.0,  15),  # 发件伪造：高危
-        'auth':    (auth_r['risk_score'],    9.0,  15),  # 邮件认证：高危
-        'domain':  (domain_r['risk_score'],  6.0,  12),  # 域名仿冒：高危
-        'url':     (url_r['risk_score'],     8.0,  10),  # URL风险：中危
-        'hidden':  (hidden_r['risk_score'],  8.0,   8),  # 隐藏内容：中危
-        'reg':     (reg_r['risk_score'],     5.0,   8),  # 域名年龄：中危
-        'subj':    (subj_r['risk_score'],    6.0,   5),  # 主题词：弱信号
-        'time':    (time_r['risk_score'],    4.0,   5),  # 时间异常：弱信号
-    }
-    # 各权重之和 = 108，压缩到100
-
-    total_score = 0.0
-    for key, (score, max_raw, weight) in WEIGHTS.items():
-        normalized = min(score / max_raw, 1.0) * weight if max_raw > 0 else 0
-        total_score += normalized
-
-    # ── 联动加分：多个强信号同时命中时额外加分 ──
-    # 钓鱼组合1：域名仿冒 + 域名年龄短（典型新建仿冒域名）
-    if domain_r['risk_level'] == 'high' and reg_r.get('sender_domain', {}).get('age_days', 999) < 90:
-        bonus = 15.0
-        total_score += bonus
-
-    # 钓鱼组合2：发件伪造 + 认证失败（双重身份欺骗）
-    if spoof_r['is_spoofed'] and auth_r['spf']['status'] in ('fail', 'softfail'):
-        total_score += 10.0
-
-    # 钓鱼组合3：域名仿冒 + 可疑URL（视觉欺骗配合链接劫持）
-    if domain_r['risk_level'] == 'high' and url_r['risk_level'] in ('high', 'medium'):
-        total_score += 8.0
-
-    # 钓鱼组合4：同形字 + 任意其他高危信号（几乎确认恶意）
-    if homo_r['risk_score'] >= 4 and any([
-        auth_r['risk_level'] == 'high',
-        domain_r['risk_level'] == 'high',
-        spoof_r['is_spoofed'],
-    ]):
-        total_score += 12.0
-
-    total_score = min(total_score, 100.0)
-
-    # ── 风险等级阈值（相比旧版更严格）──
-    if total_score >= 65:
-        overall_level = 'critical'
-    elif total_score >= 40:
-        overall_level = 'high'
-    elif total_score >= 20:
-        overall_level = 'medium'
-    else:
-        overall_level = 'low'
-
-    # ── 恶意判定：满足任一条件 ──
-    # 1. 综合评分高
-    # 2. 极强单一信号（同形字/可执行附件）
-    # 3. 三个以上高危信号联合
-    high_signals = sum([
-        auth_r['spf']['status'] in ('fail',),
-        auth_r['dkim']['status'] in ('fail',),
-        domain_r['risk_level'] == 'high',
-        spoof_r['is_spoofed'],
-        att_r['risk_level'] in ('high', 'critical'),
-        homo_r['risk_score'] >= 4,
-        reg_r.get('sender_domain', {}).get('age_days', 999) < 30,
-        url_r['risk_level'] == 'high',
-    ])
-    is_malicious = (
-        total_score >= 55
-        or homo_r['risk_score'] >= 4          # 同形字单独触发
-        or att_r['risk_score'] >= 8            # 可执行附件/双扩展名单独触发
-        or high_signals >= 4                   # 4个及以上高危信号
-        or (domain_r['risk_level'] == 'high'   # 域名仿冒 + 新域名（≤30天）
-            and reg_r.get('sender_domain', {}).get('age_days', 999) <= 30)
-    )
-
+    message    = verdict['message']
+    results    = verdict['results']
+    auth_r     = results['auth']
+    domain_r   = results['domain']
+    spoof_r    = results['spoof']
+    reg_r      = results['reg']
+    hidden_r   = results['hidden']
+    url_r      = results['url']
+    att_r      = results['att']
+    subj_r     = results['subj']
+    homo_r     = results['homo']
+    time_r     = results['time']
+
+    total_score   = verdict['total_score']
+    overall_level = verdict['overall_level']
+    is_malicious  = verdict['is_malicious']
 
     # ══════════════════════════════════════════════
     # 顶部横幅
@@ -1543,20 +2820,20 @@ def display_report(email_data: Dict[str, Any]) -> None:
     # [1] 基本信息
     # ══════════════════════════════════════════════
     section(1, '基本信息')
-    print(f"  发件人: {W}{', '.join(email_data['from']) or '未知'}{RS}")
-    print(f"  收件人: {', '.join(email_data['to']) or '未知'}")
-    if email_data['cc']:
-        print(f"  抄送:   {', '.join(email_data['cc'])}")
-    if email_data['reply_to']:
-        from_d  = extract_email_domain(email_data['from'][0]) if email_data['from'] else ''
-        reply_d = extract_email_domain(email_data['reply_to'][0])
-        rt_str  = ', '.join(email_data['reply_to'])
+    print(f"  发件人: {W}{', '.join(message['from']) or '未知'}{RS}")
+    print(f"  收件人: {', '.join(message['to']) or '未知'}")
+    if message['cc']:
+        print(f"  抄送:   {', '.join(message['cc'])}")
+    if message['reply_to']:
+        from_d  = extract_email_domain(message['from'][0]) if message['from'] else ''
+        reply_d = extract_email_domain(message['reply_to'][0])
+        rt_str  = ', '.join(message['reply_to'])
         if from_d and reply_d and from_d != reply_d:
             print(f"  回复地址: {R}{rt_str}  ← 与发件人域名不同！{RS}")
         else:
             print(f"  回复地址: {rt_str}")
-    print(f"  主题:   {W}{email_data['subject'] or '未知'}{RS}")
-    print(f"  日期:   {email_data['date'] or '未知'}")
+    print(f"  主题:   {W}{message['subject'] or '未知'}{RS}")
+    print(f"  日期:   {message['date'] or '未知'}")
 
     # 时间异常
     if time_r['warnings']:
@@ -1564,8 +2841,8 @@ def display_report(email_data: Dict[str, Any]) -> None:
             warn(w, 'medium')
 
     # 主题高危关键词
-    if subj_r['matched_keywords']:
-        warn(f"主题含高风险关键词: {', '.join(set(subj_r['matched_keywords']))}", 'medium')
+    for w in subj_r['warnings']:
+        warn(w, 'medium')
 
     # 同形字攻击
     if homo_r['suspicious']:
@@ -1666,7 +2943,7 @@ def display_report(email_data: Dict[str, Any]) -> None:
     # ══════════════════════════════════════════════
     section(7, f'URL分析  风险: {clr(url_r["risk_level"].upper(), url_r["risk_level"])}  得分贡献: {min(url_r["risk_score"]/8,1)*10:.1f}/10')
 
-    total_urls = sum(len(v) for v in url_r['urls'].values())
+    total_urls = len(url_r.get('unique_urls', ()))
     print(f"  共发现 {total_urls} 个URL（文本:{len(url_r['urls']['text'])}  HTML:{len(url_r['urls']['html'])}  附件:{len(url_r['urls']['attachments'])}）")
 
     if url_r['suspicious_links']:
@@ -1683,10 +2960,10 @@ def display_report(email_data: Dict[str, Any]) -> None:
     # ══════════════════════════════════════════════
     section(8, f'附件分析  风险: {clr(att_r["risk_level"].upper(), att_r["risk_level"])}  得分贡献: {min(att_r["risk_score"]/10,1)*10:.1f}/10')
 
-    if not email_data['attachments']:
+    if not message['attachments']:
         print('  无附件')
     else:
-        for i, att in enumerate(email_data['attachments'], 1):
+        for i, att in enumerate(message['attachments'], 1):
             fname = att.get('filename', '未知')
             size  = att.get('size', 0)
             ext   = att.get('extension', '')
@@ -1709,21 +2986,15 @@ def display_report(email_data: Dict[str, Any]) -> None:
     # ══════════════════════════════════════════════
     section(9, '正文预览')
 
-    if email_data['body_text']:
-        snippet = email_data['body_text'][:400]
-        print(f"  {snippet}{'...' if len(email_data['body_text'])>400 else ''}")
-        print(f"  {C}（纯文本共 {len(email_data['body_text'])} 字符）{RS}")
-    elif email_data['body_html']:
-        try:
-            soup = BeautifulSoup(email_data['body_html'], 'html.parser')
-            for tag in soup(['script', 'style']):
-                tag.decompose()
-            clean = soup.get_text(separator='\n', strip=True)
-            snippet = clean[:400]
-            print(f"  {snippet}{'...' if len(clean)>400 else ''}")
-            print(f"  {C}（HTML转文本共 {len(clean)} 字符）{RS}")
-        except Exception:
-            print('  （HTML正文解析失败）')
+    body = message['body_preview']
+    if body['kind'] == 'text':
+        print(f"  {body['snippet']}{'...' if body['length']>400 else ''}")
+        print(f"  {C}（纯文本共 {body['length']} 字符）{RS}")
+    elif body['kind'] == 'html':
+        print(f"  {body['snippet']}{'...' if body['length']>400 else ''}")
+        print(f"  {C}（HTML转文本共 {body['length']} 字符）{RS}")
+    elif body['kind'] == 'html_error':
+        print('  （HTML正文解析失败）')
     else:
         print('  未找到邮件正文')
 
@@ -1733,25 +3004,37 @@ def display_report(email_data: Dict[str, Any]) -> None:
     print(f"\n{B}{'═'*60}{RS}")
     print(f"{W}  综合评分: {score_color}{total_score:.1f}/100{RS}  {W}风险等级: {clr(overall_level.upper(), overall_level)}{RS}")
 
-    # 各维度得分小结
-    dim_names = {
-        'homo':   '同形字攻击',
-        'att':    '附件威胁',
-        'spoof':  '发件伪造',
-        'auth':   '邮件认证',
-        'domain': '域名仿冒',
-        'url':    'URL风险',
-        'hidden': '隐藏内容',
-        'reg':    '域名年龄',
-        'subj':   '主题关键词',
-        'time':   '时间异常',
-    }
-    print(f"\n  {'维度':<10} {'原始分':>6}  {'贡献分':>6}")
-    print(f"  {'─'*28}")
-    for key, (score, max_raw, weight) in WEIGHTS.items():
-        contrib = min(score / max_raw, 1.0) * weight if max_raw > 0 else 0
+    # 各维度得分小结（开启 show_timings 时在右侧附上各检测器耗时）
+    timings = verdict.get('timings') if CONFIG['show_timings'] else None
+    if timings:
+        print(f"\n  {'维度':<10} {'原始分':>6}  {'贡献分':>6}    {'耗时ms':>8} {'CPU ms':>8}")
+        print(f"  {'─'*48}")
+    else:
+        print(f"\n  {'维度':<10} {'原始分':>6}  {'贡献分':>6}")
+        print(f"  {'─'*28}")
+    for key, item in verdict['contributions'].items():
+        score, contrib, weight = item['raw'], item['score'], item['weight']
         bar_c = R if contrib / weight >= 0.6 else (Y if contrib / weight >= 0.3 else G)
-        print(f"  {dim_names[key]:<10} {score:>6.1f}  {bar_c}{contrib:>5.1f}{RS}/{weight}")
+        line = f"  {DIMENSION_NAMES[key]:<10} {score:>6.1f}  {bar_c}{contrib:>5.1f}{RS}/{weight:<3}"
+        stage = timings['detectors'].get(key) if timings else None
+        if stage:
+            line += f" {stage['wall_ms']:>8.1f} {stage['cpu_ms']:>8.1f}"
+        print(line.rstrip())
+    if timings:
+        print(f"  {'─'*48}")
+        rows = [('邮件解析', timings['parse'])]
+        rows += [(f"  附件 {att['filename'][:20]}", att) for att in timings['attachments']]
+        rows += [('评分汇总', timings['score']), ('合计', timings['total'])]
+        for label, stage in rows:
+            print(f"  {label:<28} {stage['wall_ms']:>8.1f} {stage['cpu_ms']:>8.1f}")
+        if verdict.get('cache_hit'):
+            print(f"  {C}（结果来自缓存，以上为首次分析时的耗时）{RS}")
+    if verdict.get('tier') == 1:
+        print(f"\n{C}  （头部分诊：仅分析了邮件头，未解析正文与附件）{RS}")
+    elif verdict.get('skipped'):
+        names = '、'.join(DIMENSION_NAMES[key] for key in verdict['skipped'])
+        print(f"\n{C}  （结论已确定，未运行: {names}；综合评分只计入已运行的维度，是下界；"
+              f"使用 --complete 查看完整证据）{RS}")
 
     if is_malicious:
         print(f"\n{R}{'█'*60}{RS}")
@@ -1765,6 +3048,286 @@ def display_report(email_data: Dict[str, Any]) -> None:
     print(f"{B}{'═'*60}{RS}\n")
 
 
+# ========== 受保护品牌仿冒索引 ==========
+
+BRAND_MAGIC = b'MERBRD02'
+BRAND_HEADER = struct.Struct('<8sQQQ')   # 魔数、槽位数、条目数、品牌域名数
+BRAND_DELETE_DEPTH = 2                    # 删除邻域深度：覆盖短基础名编辑距离 ≤2，其余由分段索引查找
+BRAND_LONG_LENGTH = 13                    # 查询基础名达到此长度后只用分段索引（删除邻域变体数随长度平方增长）
+
+# 索引键前缀：删除邻域 / 字母排序键（字母顺序调换）/ 完整域名（白名单）
+# / 去掉可疑追加词后剩下的部分（品牌名 = 查询名 + 追加词，如 hot → hotmail）
+_KEY_DELETE, _KEY_SORTED, _KEY_DOMAIN, _KEY_PART = '\x00', '\x01', '\x03', '\x04'
+
+
+def _deletion_variants(word: str, depth: int) -> set:
+    """生成删除至多 depth 个字符得到的全部字符串（SymSpell 删除邻域，含原串）"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+_ADDITION_PATTERN = re.compile('|'.join(map(re.escape, sorted(SUSPICIOUS_ADDITIONS))))
+
+
+def _addition_parts(base: str, known=None):
+    """
+    base 的全部真子串 part：从 base 中去掉 part 后剩余部分含可疑追加词（与域名包含规则一致；
+    去掉子串后前后两段拼接可能构成新词，因此逐个检查）。known 给出时只取其中的子串
+    """
+    for size in range(1, len(base)):
+        for i in range(len(base) - size + 1):
+            part = base[i:i + size]
+            if known is not None and part not in known:
+                continue
+            if _ADDITION_PATTERN.search(base.replace(part, '')):
+                yield part
+
+
+def _brand_keys(domain: str):
+    """受保护域名写入索引的全部键"""
+    base = domain.split('.')[0]
+    yield _KEY_DOMAIN + domain
+    yield _KEY_SORTED + ''.join(sorted(base))
+    for part in _addition_parts(base):
+        yield _KEY_PART + part
+    # 更长的基础名只会被长度 ≥ BRAND_LONG_LENGTH 的查询命中，由分段索引查找
+    if len(base) < BRAND_LONG_LENGTH + BRAND_DELETE_DEPTH:
+        for variant in _deletion_variants(base, BRAND_DELETE_DEPTH):
+            yield _KEY_DELETE + variant
+
+
+def _segment_radius(length: int) -> int:
+    """长度为 length 的基础名与其他基础名之间需要查找的最大编辑距离（对方可以更长）"""
+    radius = max(similarity_cutoff(length), BRAND_DELETE_DEPTH)
+    while similarity_cutoff(length + radius + 1) > radius:
+        radius += 1
+    return radius
+
+
+def _segments(base: str, radius: int):
+    """
+    把 base 均分为 radius + 1 段，返回 [(起始位置, 段)]
+
+    鸽巢原理：编辑距离不超过 radius 的字符串必然原样包含其中至少一段，
+    且所在位置与原位置相差不超过 radius。
+    """
+    count = radius + 1
+    size, extra = divmod(len(base), count)
+    segments = []
+    pos = 0
+    for i in range(count):
+        end = pos + size + (1 if i < extra else 0)
+        segments.append((pos, base[pos:end]))
+        pos = end
+    return segments
+
+
+def build_brand_index(sources: List[str], out_path: str) -> int:
+    """
+    将受保护品牌/合作方域名列表预计算为仿冒候选索引
+
+    每个域名按可注册域名归一化，基础名（首个标签）写入：
+      - 删除邻域（BRAND_DELETE_DEPTH 个字符）：覆盖短基础名的字符替换、增删字符与编辑距离 ≤2 的高度相似；
+        长基础名及编辑距离 ≥3 的高度相似由 BrandIndex 的分段索引查找
+      - 字母排序键：覆盖字母顺序调换
+      - 去掉可疑追加词后的各部分：覆盖“品牌名 = 查询名 + 追加词”；反方向（查询名 = 品牌名 + 追加词）
+        由 BrandIndex 在内存中的基础名表里查找
+    全部键以 64 位哈希存入开放寻址表，与品牌域名表一起写入单个文件，
+    各工作进程内存映射共享。
+
+    Args:
+        sources: 每行一个域名的列表文件（# 开头为注释）
+        out_path: 输出索引文件路径
+
+    Returns:
+        收录的受保护域名数
+    """
+    domains = []
+    seen = set()
+    for source in sources:
+        with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip().rstrip('.').lower()
+                if '.' not in line:
+                    continue
+                domain = registrable_domain(line)
+                if domain not in seen:
+                    seen.add(domain)
+                    domains.append(domain)
+
+    pairs = [
+        (_hash64(key), brand_id)
+        for brand_id, domain in enumerate(domains)
+        for key in set(_brand_keys(domain))
+    ]
+    slot_count, table = _pack_slot_table(pairs, len(pairs), load_factor=0.7)
+    names = '\n'.join(domains).encode('utf-8')
+    _write_atomic(out_path, BRAND_HEADER.pack(BRAND_MAGIC, slot_count, len(pairs), len(domains)), table, names)
+    return len(domains)
+
+
+class BrandIndex:
+    """
+    受保护品牌仿冒索引（内存映射，只读）
+
+    lookalikes() 用查询域名的删除邻域（短基础名）、字母排序键和子串在哈希表中取候选，
+    长基础名在内存中的分段索引里查找，再用 analyze_domain_similarity() 逐个确认，
+    关系类型与逐对比较完全一致。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.entry_count, brand_count = BRAND_HEADER.unpack_from(self._mm, 0)
+        if magic != BRAND_MAGIC:
+            self._mm.close()
+            raise ValueError(f"不是有效的品牌仿冒索引文件: {path}")
+        self._mask = self.slot_count - 1
+        names_offset = BRAND_HEADER.size + self.slot_count * NRD_SLOT.size
+        self.brands = self._mm[names_offset:].decode('utf-8').split('\n') if brand_count else []
+        self._memo: Dict[str, List[Dict[str, Any]]] = {}
+        self._skeletons = None
+        self._segment_index = None
+
+    def _segments(self):
+        """
+        ({基础名: [品牌编号]}, 全部基础名长度, {段: [(品牌编号, 起始位置, 编辑距离)]}, 全部段长)，
+        首次调用时构建；分段只收录可能被长查询命中的长基础名
+        """
+        if self._segment_index is None:
+            bases: Dict[str, List[int]] = {}
+            lengths = set()
+            segments: Dict[str, List[tuple]] = {}
+            for brand_id, brand in enumerate(self.brands):
+                base = brand.split('.')[0]
+                bases.setdefault(base, []).append(brand_id)
+                lengths.add(len(base))
+                if len(base) >= BRAND_LONG_LENGTH - BRAND_DELETE_DEPTH:
+                    radius = _segment_radius(len(base))
+                    for pos, segment in _segments(base, radius):
+                        segments.setdefault(segment, []).append((brand_id, pos, radius))
+            self._segment_index = (bases, lengths, segments, {len(segment) for segment in segments})
+        return self._segment_index
+
+    def skeletons(self, table: Dict[int, str]) -> Dict[str, str]:
+        """受保护域名（IDNA 解码后）的同形字骨架 -> 域名（首次调用或骨架映射表变化时计算）"""
+        if self._skeletons is None or self._skeletons[0] is not table:
+            skeletons = {}
+            for brand in self.brands:
+                brand = idna_decode(brand)
+                skeletons.setdefault(skeleton(brand, table), brand)
+            self._skeletons = (table, skeletons)
+        return self._skeletons[1]
+
+    def _probe(self, key: str) -> set:
+        """返回键对应的全部品牌编号"""
+        h = _hash64(key)
+        slot = h & self._mask
+        found = set()
+        while True:
+            stored, brand_id = NRD_SLOT.unpack_from(self._mm, BRAND_HEADER.size + slot * NRD_SLOT.size)
+            if stored == 0:
+                return found
+            if stored == h:
+                found.add(brand_id)
+            slot = (slot + 1) & self._mask
+
+    def is_protected(self, domain: str) -> bool:
+        """域名本身是否在受保护列表中"""
+        return bool(self._probe(_KEY_DOMAIN + registrable_domain(domain)))
+
+    def lookalikes(self, domain: str) -> List[Dict[str, Any]]:
+        """
+        查找与 domain 构成仿冒关系的受保护域名
+
+        Returns:
+            [{'brand', 'relationship', 'similarity'}]；domain 本身受保护时为空列表
+        """
+        domain = registrable_domain(domain)
+        if domain in self._memo:
+            return self._memo[domain]
+        matches = []
+        if '.' in domain and not self.is_protected(domain):
+            base = domain.split('.')[0]
+            bases, lengths, segments, sizes = self._segments()
+            candidates = self._probe(_KEY_SORTED + ''.join(sorted(base)))
+            # 品牌名 = 查询名 + 追加词
+            candidates |= self._probe(_KEY_PART + base)
+            # 查询名 = 品牌名 + 追加词（子串较多，在内存中的基础名表里查）
+            for part in _addition_parts(base, bases):
+                candidates.update(bases[part])
+            # 短查询名：删除邻域覆盖编辑距离 ≤2，且只能连到长度相差不超过深度的品牌
+            if len(base) < BRAND_LONG_LENGTH and any(abs(length - len(base)) <= BRAND_DELETE_DEPTH for length in lengths):
+                for variant in _deletion_variants(base, BRAND_DELETE_DEPTH):
+                    candidates |= self._probe(_KEY_DELETE + variant)
+            # 长基础名：查询名中原样出现的段，位置偏移不超过该品牌的编辑距离
+            for size in sizes:
+                for i in range(len(base) - size + 1):
+                    for brand_id, pos, radius in segments.get(base[i:i + size], ()):
+                        if abs(i - pos) <= radius:
+                            candidates.add(brand_id)
+            brands = [self.brands[brand_id] for brand_id in candidates]
+            for brand, analysis in zip(brands, analyze_domain_similarity_many(domain, brands, exact_low=False)):
+                if analysis['risk'] == 'high':
+                    matches.append({
+                        'brand': brand,
+                        'relationship': analysis['relationship_type'],
+                        'similarity': analysis['similarity'],
+                    })
+            matches.sort(key=lambda m: (-m['similarity'], m['brand']))
+        if len(self._memo) >= 65536:
+            self._memo.clear()
+        self._memo[domain] = matches
+        return matches
+
+
+_brand_index = None
+
+
+def get_brand_index():
+    """获取 CONFIG['brand_index'] 指定的品牌仿冒索引（文件被重建后自动重新映射），未配置返回 None"""
+    global _brand_index
+    path = CONFIG['brand_index']
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+        if _brand_index is None or _brand_index.path != path or _brand_index.mtime != mtime:
+            _brand_index = BrandIndex(path)
+    except (OSError, ValueError) as e:
+        print(f"加载品牌仿冒索引失败: {str(e)}")
+        CONFIG['brand_index'] = ''
+        return None
+    return _brand_index
+
+
+def collect_url_domains(email_data: Dict[str, Any]) -> List[str]:
+    """收集正文（纯文本 + HTML 链接/图片/表单）中出现的全部 URL 域名"""
+    urls = []
+    if email_data['body_text']:
+        urls.extend(get_text_urls(email_data))
+    if email_data['body_html']:
+        for element in get_html_index(email_data)['url_elements']:
+            url = element.get('href') or element.get('src') or element.get('action', '')
+            if url:
+                urls.append(url)
+
+    domains = []
+    for url in urls:
+        if '://' not in url:
+            url = 'http://' + url
+        domain = extract_url_domain(url).split('@')[-1].split(':')[0]
+        if '.' in domain:
+            domains.append(domain)
+    return list(dict.fromkeys(domains))
+
+
 def check_similar_domains(email_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     检查邮件中所有地址的域名相似度
@@ -1801,9 +3364,10 @@ def check_similar_domains(email_data: Dict[str, Any]) -> Dict[str, Any]:
 
         # 比较所有域名组合
         # 1. 发件人域名与收件人域名比较
+        to_domains = sorted(domains['to'])
         for from_domain in domains['from']:
-            for to_domain in domains['to']:
-                analysis = analyze_domain_similarity(from_domain, to_domain)
+            analyses = analyze_domain_similarity_many(from_domain, to_domains, exact_low=False)
+            for to_domain, analysis in zip(to_domains, analyses):
                 if analysis['risk'] == 'high':
                     result['similar_domains'].append({
                         'domain1': from_domain,
@@ -1832,6 +3396,35 @@ def check_similar_domains(email_data: Dict[str, Any]) -> Dict[str, Any]:
                     })
                     result['risk_score'] += 3.0
         
+        # 3. 发件人 / 回复地址 / URL 域名与受保护品牌列表比较
+        brand_index = get_brand_index()
+        if brand_index:
+            reply_domains = {extract_email_domain(a) for a in email_data['reply_to']} - {''}
+            sources = [
+                ('发件人', sorted(domains['from'])),
+                ('回复地址', sorted(reply_domains)),
+                ('URL', collect_url_domains(email_data)),
+            ]
+            seen_pairs = set()
+            for label, source_domains in sources:
+                for domain in source_domains:
+                    for match in brand_index.lookalikes(domain):
+                        pair = (registrable_domain(domain), match['brand'])
+                        if pair in seen_pairs:
+                            continue
+                        seen_pairs.add(pair)
+                        result['similar_domains'].append({
+                            'domain1': domain,
+                            'domain2': match['brand'],
+                            'type': f'{label}-受保护品牌',
+                            'relationship': match['relationship'],
+                            'similarity': match['similarity']
+                        })
+                        result['risk_score'] += 3.0
+                        result['warnings'].append(
+                            f"{label}域名 {domain} 疑似仿冒受保护域名 {match['brand']} ({match['relationship']})"
+                        )
+        
         # 设置最终风险等级
         if result['risk_score'] >= 3.0:
             result['risk_level'] = 'high'
@@ -1946,137 +3539,621 @@ def detect_spoofed_sender(email_data: Dict[str, Any]) -> Dict[str, Any]:
     
     return result
 
-def check_domain_registration(domain: str) -> Dict[str, Any]:
+# ========== 本地持久化缓存 ==========
+
+class SqliteCache:
     """
-    检查域名的注册信息
+    基于 SQLite 的本地键值缓存（值为 JSON，带过期时间）
+
+    每个进程按需建立自己的连接，数据库使用 WAL 模式，
+    批量模式下的多个工作进程可以同时读写同一个缓存文件。
+    缓存读写出错时只当作未命中处理，不影响分析流程。
     """
-    result = {
-        'domain': domain,
-        'creation_date': None,
-        'expiration_date': None,
-        'last_updated': None,
-        'age_days': None,
-        'risk_level': 'low',
-        'risk_score': 0.0,
-        'warnings': []
-    }
-    
-    try:
-        # 预处理域名
-        if not domain or '.' not in domain:
-            raise ValueError(f"无效的域名格式: {domain}")
-            
-        # 移除可能的端口号和路径
-        domain = domain.split(':')[0].split('/')[0]
-        
-        # 尝试 WHOIS 查询
+
+    def __init__(self, path: str, table: str):
+        self.path = path
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Any:
+        """读取未过期的缓存值，未命中返回 None"""
         try:
-            w = whois.whois(domain)
-        except Exception as e:
-            raise Exception(f"WHOIS查询失败: {str(e)}")
-        
-        if not w or not w.domain_name:
-            raise Exception(f"无法获取域名信息")
-        
-        def ensure_datetime_with_timezone(dt):
-            """确保日期时间对象带有时区信息"""
-            if dt is None:
-                return None
-            if isinstance(dt, str):
-                try:
-                    # 尝试解析字符串为datetime对象
-                    dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
-                except:
-                    try:
-                        dt = datetime.strptime(dt, "%Y-%m-%d")
-                    except:
-                        return None
-            if not isinstance(dt, datetime):
-                return None
-            if dt.tzinfo is None:
-                # 如果没有时区信息，假定为UTC
-                dt = dt.replace(tzinfo=timezone.utc)
-            return dt
-        
+            with self._lock:
+                row = self._connect().execute(
+                    f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None or (row[1] and row[1] < time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any, ttl: float = 0) -> None:
+        """写入缓存值；ttl 为 0 表示永不过期"""
+        expires_at = time.time() + ttl if ttl else 0
+        try:
+            with self._lock:
+                self._connect().execute(
+                    f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+        except sqlite3.Error:
+            pass
+
+
+_caches: Dict[str, SqliteCache] = {}
+
+
+def get_cache(name: str) -> SqliteCache:
+    """按名称获取（并复用）本进程的缓存实例，数据库文件位于 CONFIG['cache_dir']"""
+    path = os.path.join(CONFIG['cache_dir'], f'{name}.sqlite3')
+    cache = _caches.get(name)
+    if cache is None or cache.path != path:
+        cache = _caches[name] = SqliteCache(path, name)
+    return cache
+
+
+# 常见的多级公共后缀（registrable_domain 使用，未覆盖的后缀按两级处理）
+MULTI_LEVEL_SUFFIXES = {
+    'com.cn', 'net.cn', 'org.cn', 'gov.cn', 'edu.cn', 'ac.cn',
+    'com.hk', 'com.tw', 'com.sg', 'com.my', 'com.au', 'net.au', 'org.au',
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'co.jp', 'ne.jp', 'or.jp', 'ac.jp',
+    'co.kr', 'co.nz', 'co.in', 'co.za', 'com.br', 'com.mx', 'com.tr', 'com.ru',
+}
+
+
+def registrable_domain(domain: str) -> str:
+    """
+    返回域名的可注册部分（如 mail.corp.example.com.cn → example.com.cn）
+
+    Args:
+        domain: 域名或主机名（可带端口）
+
+    Returns:
+        小写的可注册域名
+    """
+    labels = domain.split(':')[0].strip('.').lower().split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in MULTI_LEVEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+class TokenBucket:
+    """
+    令牌桶限速器（线程安全）
+
+    以 rate 个/秒的速度补充令牌，最多积累 capacity 个。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        """在 timeout 秒内取得一个令牌返回 True，否则返回 False（不会超时等待）"""
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate if self.rate > 0 else float('inf')
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# ========== 离线新注册域名索引 ==========
+
+NRD_MAGIC = b'MERNRD01'
+NRD_HEADER = struct.Struct('<8sQQ')   # 魔数、槽位数、域名数
+NRD_SLOT = struct.Struct('<QI')       # 域名哈希（0 表示空槽）、注册日期（1970-01-01 起的天数）
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _hash64(text: str) -> int:
+    """字符串的稳定 64 位哈希（跨进程一致；0 保留为空槽标记）"""
+    h = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    return h or 1
+
+
+def _pack_slot_table(pairs, count: int, load_factor: float = 0.5):
+    """
+    将 (64位键, 32位值) 对打包为开放寻址（线性探测）哈希表
+
+    允许重复键：查询时沿探测链收集所有相同键的槽位，直到遇到空槽。
+
+    Args:
+        pairs: (key, value) 可迭代对象
+        count: 键值对数量
+        load_factor: 最大装载因子
+
+    Returns:
+        (槽位数, 槽位数据 bytearray)
+    """
+    slot_count = 16
+    while slot_count * load_factor < count:
+        slot_count *= 2
+    mask = slot_count - 1
+    table = bytearray(slot_count * NRD_SLOT.size)
+    occupied = bytearray(slot_count)
+    for key, value in pairs:
+        slot = key & mask
+        while occupied[slot]:
+            slot = (slot + 1) & mask
+        occupied[slot] = 1
+        NRD_SLOT.pack_into(table, slot * NRD_SLOT.size, key, value)
+    return slot_count, table
+
+
+def _write_atomic(out_path: str, *chunks: bytes) -> None:
+    """写入临时文件后原子替换目标文件（正在映射旧文件的进程不受影响）"""
+    directory = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{out_path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, out_path)
+
+
+def _parse_feed_date(value: str):
+    """解析数据源中的日期（YYYY-MM-DD / YYYYMMDD / ISO 时间），失败返回 None"""
+    value = value.strip().strip('"')
+    for fmt, width in (('%Y-%m-%d', 10), ('%Y%m%d', 8)):
+        try:
+            return datetime.strptime(value[:width], fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+
+def build_nrd_index(sources: List[str], out_path: str, default_date: str = None) -> int:
+    """
+    将新注册域名数据源批量导入为紧凑的磁盘索引
+
+    支持两种数据源格式（可混用）：
+      - CSV：`domain,注册日期[,其他列...]`，表头行会被自动跳过
+      - 域名列表 / 区域文件差异：每行第一个字段为域名，注册日期取 default_date，
+        未指定时使用数据源文件的修改日期
+
+    同一域名出现多次时保留最早的日期；早于 1970-01-01 的行无法存入（也不可能是新注册域名），
+    跳过并提示。索引为开放寻址哈希表
+    （槽位数为 2 的幂，装载因子 ≤ 0.5），写入临时文件后原子替换，
+    正在使用旧索引的进程不受影响。
+
+    Args:
+        sources: 数据源文件路径列表
+        out_path: 输出索引文件路径
+        default_date: 域名列表类数据源的注册日期（YYYY-MM-DD）
+
+    Returns:
+        写入索引的域名数
+
+    Raises:
+        ValueError: default_date 无法解析（不静默退回文件修改日期）
+    """
+    entries: Dict[int, int] = {}
+    fallback = None
+    if default_date:
+        fallback = _parse_feed_date(default_date)
+        if fallback is None:
+            raise ValueError(f"无法解析的注册日期: {default_date}（应为 YYYY-MM-DD）")
+    parsed_dates = {}   # 数据源中日期高度重复，缓存解析结果
+    skipped = 0
+
+    for source in sources:
+        source_date = fallback or datetime.fromtimestamp(os.path.getmtime(source), timezone.utc)
+        with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(('#', ';')):
+                    continue
+                if ',' in line:
+                    fields = line.split(',')
+                    raw_date = fields[1] if len(fields) > 1 else ''
+                    created = parsed_dates.get(raw_date)
+                    if created is None:
+                        created = parsed_dates[raw_date] = _parse_feed_date(raw_date)
+                    if created is None:
+                        continue  # 表头或格式错误的行
+                else:
+                    fields = line.split()
+                    created = source_date
+                domain = fields[0].strip().strip('"').rstrip('.').lower()
+                if '.' not in domain:
+                    continue
+                day = (created - _EPOCH).days
+                if day < 0:
+                    skipped += 1
+                    continue
+                key = _hash64(domain)
+                if key not in entries or day < entries[key]:
+                    entries[key] = day
+
+    if skipped:
+        print(f"跳过 {skipped} 行注册日期早于 1970-01-01 的记录")
+    slot_count, table = _pack_slot_table(entries.items(), len(entries))
+    _write_atomic(out_path, NRD_HEADER.pack(NRD_MAGIC, slot_count, len(entries)), table)
+    return len(entries)
+
+
+class NrdIndex:
+    """
+    只读的离线新注册域名索引（内存映射）
+
+    查询为开放寻址哈希表的 O(1) 探测，多个进程映射同一文件时共享页缓存。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.entry_count = NRD_HEADER.unpack_from(self._mm, 0)
+        if magic != NRD_MAGIC:
+            self._mm.close()
+            raise ValueError(f"不是有效的新注册域名索引文件: {path}")
+        self._mask = self.slot_count - 1
+
+    def lookup(self, domain: str):
+        """
+        查询域名的注册日期
+
+        Returns:
+            带时区的 datetime；索引中没有该域名时返回 None
+        """
+        key = _hash64(domain.rstrip('.').lower())
+        slot = key & self._mask
+        while True:
+            stored, day = NRD_SLOT.unpack_from(self._mm, NRD_HEADER.size + slot * NRD_SLOT.size)
+            if stored == key:
+                return _EPOCH + timedelta(days=day)
+            if stored == 0:
+                return None
+            slot = (slot + 1) & self._mask
+
+
+_nrd_index = None
+
+
+def get_nrd_index():
+    """获取 CONFIG['nrd_index'] 指定的索引（文件被重建后自动重新映射），未配置返回 None"""
+    global _nrd_index
+    path = CONFIG['nrd_index']
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+        if _nrd_index is None or _nrd_index.path != path or _nrd_index.mtime != mtime:
+            _nrd_index = NrdIndex(path)
+    except (OSError, ValueError) as e:
+        print(f"加载新注册域名索引失败: {str(e)}")
+        CONFIG['nrd_index'] = ''
+        return None
+    return _nrd_index
+
+
+# ========== 域名注册信息 ==========
+
+_whois_buckets: Dict[str, TokenBucket] = {}
+_whois_lock = threading.Lock()
+_whois_pool = None
+_whois_pool_pid = None
+
+
+def _whois_bucket(domain: str) -> TokenBucket:
+    """获取域名所属顶级域的令牌桶"""
+    tld = domain.rsplit('.', 1)[-1]
+    with _whois_lock:
+        bucket = _whois_buckets.get(tld)
+        if bucket is None:
+            bucket = _whois_buckets[tld] = TokenBucket(CONFIG['whois_rate'], CONFIG['whois_burst'])
+        return bucket
+
+
+def _whois_executor() -> ThreadPoolExecutor:
+    """本进程共享的 WHOIS 查询线程池（fork 出的子进程会重新创建）"""
+    global _whois_pool, _whois_pool_pid
+    with _whois_lock:
+        if _whois_pool is None or _whois_pool_pid != os.getpid():
+            _whois_pool = ThreadPoolExecutor(max_workers=CONFIG['whois_workers'],
+                                             thread_name_prefix='whois')
+            _whois_pool_pid = os.getpid()
+        return _whois_pool
+
+
+_whois_local = threading.local()
+
+
+class _WhoisSocket(socket.socket):
+    """
+    WHOIS 查询用的套接字：每次连接、收发前把超时收紧到当前线程查询截止时间的剩余秒数
+
+    python-whois 0.8.0 的 whois() 没有超时参数，内部固定 settimeout(10)，且每次 recv 单独计时，
+    持续慢速回应的注册商服务器能一直占住 WHOIS 线程；socket.setdefaulttimeout() 也会被它覆盖。
+    """
+
+    def _tighten(self) -> None:
+        deadline = getattr(_whois_local, 'deadline', None)
+        if deadline is None:
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('WHOIS查询超过截止时间')
+        current = self.gettimeout()
+        super().settimeout(remaining if current is None else min(current, remaining))
+
+    def connect(self, address) -> None:
+        self._tighten()
+        super().connect(address)
+
+    def send(self, data, flags: int = 0) -> int:
+        self._tighten()
+        return super().send(data, flags)
+
+    def recv(self, bufsize: int, flags: int = 0) -> bytes:
+        self._tighten()
+        return super().recv(bufsize, flags)
+
+
+class _WhoisSocketModule:
+    """替换 whois 库模块内的 socket 名字：只换掉套接字类，其余照旧转发到 socket 模块"""
+
+    socket = _WhoisSocket
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(socket, name)
+
+
+def _whois_lookup(domain: str, timeout: float = None) -> Dict[str, Any]:
+    """
+    执行一次实时 WHOIS 查询，返回标准化后的注册日期
+
+    Args:
+        timeout: 本次查询（含转到注册商 WHOIS 服务器的后续查询）的总秒数上限，None 表示不限
+
+    Returns:
+        {'creation_date', 'expiration_date', 'last_updated', 'warnings'}，
+        日期均为带时区的 datetime 或 None
+
+    Raises:
+        Exception: 查询失败、超时或没有返回域名信息
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        # whois 库只在真正需要联网查询时导入
+        import whois
+        nic_module = sys.modules.get('whois.whois')
+        if nic_module is not None and not isinstance(nic_module.socket, _WhoisSocketModule):
+            nic_module.socket = _WhoisSocketModule()
+        _whois_local.deadline = deadline
+        try:
+            w = whois.whois(domain)
+        finally:
+            _whois_local.deadline = None
+    except Exception as e:
+        raise Exception(f"WHOIS查询失败: {str(e)}")
+    # whois 库把套接字超时吞掉，当作空回应解析
+    if deadline is not None and time.monotonic() >= deadline:
+        raise Exception(f"WHOIS查询超时（{timeout:.1f} 秒）")
+
+    if not w or not w.domain_name:
+        raise Exception(f"无法获取域名信息")
+
+    def ensure_datetime_with_timezone(dt):
+        """确保日期时间对象带有时区信息"""
+        if dt is None:
+            return None
+        if isinstance(dt, str):
+            try:
+                # 尝试解析字符串为datetime对象
+                dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
+            except:
+                try:
+                    dt = datetime.strptime(dt, "%Y-%m-%d")
+                except:
+                    return None
+        if not isinstance(dt, datetime):
+            return None
+        if dt.tzinfo is None:
+            # 如果没有时区信息，假定为UTC
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt
+
+    def pick_date(value, choose, label):
+        """处理单个或多个日期的情况，多个时按 choose（min/max）选取"""
+        if not value:
+            return None
+        try:
+            if isinstance(value, list):
+                valid_dates = [dt for dt in map(ensure_datetime_with_timezone, value) if dt]
+                return choose(valid_dates) if valid_dates else None
+            return ensure_datetime_with_timezone(value)
+        except Exception as e:
+            dates['warnings'].append(f"处理{label}时出错: {str(e)}")
+            return None
+
+    dates = {'warnings': []}
+    # 多个创建日期选择最早的；过期/更新日期选择最晚的
+    dates['creation_date'] = pick_date(w.creation_date, min, '创建日期')
+    dates['expiration_date'] = pick_date(w.expiration_date, max, '过期日期')
+    dates['last_updated'] = pick_date(w.updated_date, max, '更新日期')
+    return dates
+
+
+def lookup_domain_dates(domain: str, deadline: float = None, cache_only: bool = False) -> Dict[str, Any]:
+    """
+    查询域名注册日期：离线新注册域名索引 → 本地 WHOIS 缓存 → 实时 WHOIS
+
+    缓存以可注册域名为键：成功结果保留 CONFIG['whois_ttl'] 秒，
+    查询失败也会缓存 CONFIG['whois_negative_ttl'] 秒（为 0 时不缓存），避免反复请求 WHOIS 服务器。
+    实时查询前需从所属顶级域的令牌桶取得令牌，截止时间前取不到则放弃。
+    离线模式（CONFIG['offline']）下不发起实时查询：索引中未收录的域名
+    视为非近期注册，注册日期未知。
+
+    Args:
+        domain: 域名
+        deadline: time.monotonic() 截止时间，None 表示不限
+        cache_only: 只查缓存，未命中时返回 None
+
+    Returns:
+        同 _whois_lookup()
+
+    Raises:
+        Exception: 查询失败（包括命中失败缓存、限速预算耗尽）
+    """
+    key = registrable_domain(domain)
+    date_fields = ('creation_date', 'expiration_date', 'last_updated')
+    nrd = get_nrd_index()
+    if nrd:
+        created = nrd.lookup(key)
+        if created:
+            return {'creation_date': created, 'expiration_date': None, 'last_updated': None,
+                    'warnings': [], 'source': 'nrd'}
+
+    cache = get_cache('whois') if CONFIG['whois_cache'] else None
+
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            if cached.get('error'):
+                raise Exception(cached['error'])
+            for field in date_fields:
+                if cached.get(field):
+                    cached[field] = datetime.fromisoformat(cached[field])
+            cached['source'] = 'cache'
+            return cached
+
+    if CONFIG['offline']:
+        if not nrd:
+            raise Exception("离线模式，未配置新注册域名索引")
+        return {'creation_date': None, 'expiration_date': None, 'last_updated': None,
+                'warnings': [], 'source': 'nrd'}
+    if cache_only:
+        return None
+
+    remaining = deadline - time.monotonic() if deadline is not None else CONFIG['whois_deadline']
+    if remaining <= 0:
+        # 调用方已放弃等待（排队中的查询到期后才开始执行），不再发起实时查询
+        raise Exception("WHOIS查询预算已耗尽，未发起查询")
+    if not _whois_bucket(key).acquire(remaining):
+        raise Exception("WHOIS查询限速，预算时间内未能发起查询")
+
+    # 取令牌可能已等待了一部分预算，查询本身只能用剩下的时间
+    timeout = deadline - time.monotonic() if deadline is not None else CONFIG['whois_deadline']
+    try:
+        dates = _whois_lookup(key, max(timeout, 0.0))
+    except Exception as e:
+        # SqliteCache 的 ttl 为 0 表示永不过期，这里 ≤0 表示不缓存失败结果
+        if cache and CONFIG['whois_negative_ttl'] > 0:
+            cache.put(key, {'error': str(e)}, CONFIG['whois_negative_ttl'])
+        raise
+
+    dates['source'] = 'whois'
+    if cache:
+        stored = dict(dates)
+        for field in date_fields:
+            if stored.get(field):
+                stored[field] = stored[field].isoformat()
+        cache.put(key, stored, CONFIG['whois_ttl'])
+    return dates
+
+
+def check_domain_registration(domain: str, deadline: float = None, cache_only: bool = False) -> Dict[str, Any]:
+    """
+    检查域名的注册信息
+
+    Args:
+        domain: 域名
+        deadline: time.monotonic() 截止时间（用于 WHOIS 限速等待），None 表示不限
+        cache_only: 只使用本地缓存，未命中时返回 None
+    """
+    result = {
+        'domain': domain,
+        'creation_date': None,
+        'expiration_date': None,
+        'last_updated': None,
+        'age_days': None,
+        'source': None,         # 注册日期来源: nrd / cache / whois
+        'risk_level': 'low',
+        'risk_score': 0.0,
+        'warnings': []
+    }
+    
+    try:
+        # 预处理域名
+        if not domain or '.' not in domain:
+            raise ValueError(f"无效的域名格式: {domain}")
+            
+        # 移除可能的端口号和路径
+        domain = domain.split(':')[0].split('/')[0]
+        
+        # 查询注册日期（本地缓存 → WHOIS）
+        dates = lookup_domain_dates(domain, deadline, cache_only)
+        if dates is None:
+            return None
+        
         # 获取当前时间（带时区信息）
         now = datetime.now(timezone.utc)
         
         # 处理创建日期
-        if w.creation_date:
-            try:
-                if isinstance(w.creation_date, list):
-                    # 处理多个创建日期的情况，选择最早的有效日期
-                    valid_dates = []
-                    for date in w.creation_date:
-                        dt = ensure_datetime_with_timezone(date)
-                        if dt:
-                            valid_dates.append(dt)
-                    creation_date = min(valid_dates) if valid_dates else None
-                else:
-                    creation_date = ensure_datetime_with_timezone(w.creation_date)
-                
-                if creation_date:
-                    result['creation_date'] = creation_date
-                    age_days = (now - creation_date).days
-                    result['age_days'] = age_days
-                    
-                    # 评估风险
-                    if age_days <= 7:  # 一周内注册
-                        result['risk_level'] = 'critical'
-                        result['risk_score'] = 5.0
-                        result['warnings'].append(f"域名 {domain} 注册时间极短（{age_days}天），非常可疑！")
-                    elif age_days <= 30:  # 一个月内注册
-                        result['risk_level'] = 'high'
-                        result['risk_score'] = 4.0
-                        result['warnings'].append(f"域名 {domain} 注册时间很短（{age_days}天），高度可疑")
-                    elif age_days <= 90:  # 三个月内注册
-                        result['risk_level'] = 'medium'
-                        result['risk_score'] = 3.0
-                        result['warnings'].append(f"域名 {domain} 注册时间较短（{age_days}天），需要注意")
-                    elif age_days <= 365:  # 一年内注册
-                        result['risk_level'] = 'low'
-                        result['risk_score'] = 2.0
-                        result['warnings'].append(f"域名 {domain} 注册时间不足一年（{age_days}天）")
-            except Exception as e:
-                result['warnings'].append(f"处理创建日期时出错: {str(e)}")
-        
-        # 处理过期日期
-        if w.expiration_date:
-            try:
-                if isinstance(w.expiration_date, list):
-                    # 处理多个过期日期的情况，选择最晚的有效日期
-                    valid_dates = []
-                    for date in w.expiration_date:
-                        dt = ensure_datetime_with_timezone(date)
-                        if dt:
-                            valid_dates.append(dt)
-                    expiration_date = max(valid_dates) if valid_dates else None
-                else:
-                    expiration_date = ensure_datetime_with_timezone(w.expiration_date)
-                
-                if expiration_date:
-                    result['expiration_date'] = expiration_date
-            except Exception as e:
-                result['warnings'].append(f"处理过期日期时出错: {str(e)}")
+        creation_date = dates.get('creation_date')
+        if creation_date:
+            result['creation_date'] = creation_date
+            age_days = (now - creation_date).days
+            result['age_days'] = age_days
+            
+            # 评估风险
+            if age_days <= 7:  # 一周内注册
+                result['risk_level'] = 'critical'
+                result['risk_score'] = 5.0
+                result['warnings'].append(f"域名 {domain} 注册时间极短（{age_days}天），非常可疑！")
+            elif age_days <= 30:  # 一个月内注册
+                result['risk_level'] = 'high'
+                result['risk_score'] = 4.0
+                result['warnings'].append(f"域名 {domain} 注册时间很短（{age_days}天），高度可疑")
+            elif age_days <= 90:  # 三个月内注册
+                result['risk_level'] = 'medium'
+                result['risk_score'] = 3.0
+                result['warnings'].append(f"域名 {domain} 注册时间较短（{age_days}天），需要注意")
+            elif age_days <= 365:  # 一年内注册
+                result['risk_level'] = 'low'
+                result['risk_score'] = 2.0
+                result['warnings'].append(f"域名 {domain} 注册时间不足一年（{age_days}天）")
         
-        # 处理更新日期
-        if w.updated_date:
-            try:
-                if isinstance(w.updated_date, list):
-                    # 处理多个更新日期的情况，选择最近的有效日期
-                    valid_dates = []
-                    for date in w.updated_date:
-                        dt = ensure_datetime_with_timezone(date)
-                        if dt:
-                            valid_dates.append(dt)
-                    updated_date = max(valid_dates) if valid_dates else None
-                else:
-                    updated_date = ensure_datetime_with_timezone(w.updated_date)
-                
-                if updated_date:
-                    result['last_updated'] = updated_date
-            except Exception as e:
-                result['warnings'].append(f"处理更新日期时出错: {str(e)}")
+        result['expiration_date'] = dates.get('expiration_date')
+        result['last_updated'] = dates.get('last_updated')
+        result['source'] = dates.get('source')
+        result['warnings'].extend(dates.get('warnings', []))
                 
     except Exception as e:
         result['warnings'].append(f"无法获取域名 {domain} 的注册信息: {str(e)}")
@@ -2099,23 +4176,27 @@ def analyze_domain_registration(email_data: Dict[str, Any]) -> Dict[str, Any]:
     }
     
     try:
-        # 提取发件人域名
+        # 提取发件人、收件人域名
         sender_domain = None
         if email_data['from']:
             domain_match = re.search(r'@([\w.-]+)', email_data['from'][0])
             if domain_match:
                 sender_domain = domain_match.group(1).lower()
-                result['sender_domain'] = check_domain_registration_with_retry(sender_domain)
-                if result['sender_domain'].get('risk_score'):
-                    result['risk_score'] += result['sender_domain']['risk_score']
         
-        # 提取收件人域名
         recipient_domain = None
         if email_data['to']:
             domain_match = re.search(r'@([\w.-]+)', email_data['to'][0])
             if domain_match:
                 recipient_domain = domain_match.group(1).lower()
-                result['recipient_domain'] = check_domain_registration_with_retry(recipient_domain)
+        
+        # 并发查询，受单封邮件的总时间预算约束
+        registrations = check_domains_registration([sender_domain, recipient_domain])
+        if sender_domain:
+            result['sender_domain'] = registrations[sender_domain]
+            if result['sender_domain'].get('risk_score'):
+                result['risk_score'] += result['sender_domain']['risk_score']
+        if recipient_domain:
+            result['recipient_domain'] = registrations[recipient_domain]
         
         # 如果发件人和收件人域名不同，进行对比分析
         if (sender_domain and recipient_domain and 
@@ -2165,25 +4246,626 @@ def analyze_domain_registration(email_data: Dict[str, Any]) -> Dict[str, Any]:
     
     return result
 
-def check_domain_registration_with_retry(domain: str, max_retries: int = 3) -> Dict[str, Any]:
-    """带重试机制的域名注册信息检查"""
-    for attempt in range(max_retries):
+def _unknown_registration(domain: str, reason: str) -> Dict[str, Any]:
+    """构造“注册信息未知”的结果（查询超时/预算耗尽时使用）"""
+    return {
+        'domain': domain,
+        'creation_date': None,
+        'expiration_date': None,
+        'last_updated': None,
+        'age_days': None,
+        'source': None,
+        'risk_level': 'unknown',
+        'risk_score': 0.0,
+        'warnings': [reason]
+    }
+
+
+def check_domains_registration(domains: List[str], budget: float = None) -> Dict[str, Dict[str, Any]]:
+    """
+    并发查询多个域名的注册信息
+
+    缓存命中的域名直接返回；其余域名提交到 WHOIS 线程池并发查询。
+    每个查询最多等待 CONFIG['whois_timeout'] 秒，全部查询共享
+    budget（默认 CONFIG['whois_deadline']）秒的总预算，
+    超时的域名返回 age_days 为 None 的未知结果，不会阻塞后续评分。
+
+    Args:
+        domains: 域名列表（空值和重复项会被忽略）
+        budget: 总时间预算（秒）
+
+    Returns:
+        以域名为键的 check_domain_registration() 结果字典
+    """
+    budget = CONFIG['whois_deadline'] if budget is None else budget
+    start = time.monotonic()
+    # 到期后不再等待结果；工作线程也以此为截止时间，被放弃的查询不会再去限速等待或发起实时查询
+    lookup_deadline = start + min(CONFIG['whois_timeout'], budget)
+
+    results = {}
+    pending = {}
+    for domain in dict.fromkeys(d for d in domains if d):
+        cached = check_domain_registration(domain, cache_only=True)
+        if cached is not None:
+            results[domain] = cached
+        else:
+            pending[domain] = _whois_executor().submit(check_domain_registration, domain, lookup_deadline)
+
+    for domain, future in pending.items():
+        try:
+            results[domain] = future.result(timeout=max(lookup_deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            results[domain] = _unknown_registration(
+                domain, f"域名 {domain} 的WHOIS查询超时（{lookup_deadline - start:.1f}秒），注册年龄未知"
+            )
+    return results
+
+
+def check_domain_registration_with_retry(domain: str) -> Dict[str, Any]:
+    """带超时预算的单个域名注册信息检查（超时返回未知结果，不再串行 sleep 重试）"""
+    return check_domains_registration([domain])[domain]
+
+# ========== 综合评分引擎 ==========
+
+# 维度键 -> 检测函数，按报告中的先后顺序排列；run_detectors() 与基准测试共用
+DETECTORS = (
+    ('auth',   verify_email_auth),
+    ('domain', check_similar_domains),
+    ('spoof',  detect_spoofed_sender),
+    ('reg',    analyze_domain_registration),
+    ('hidden', detect_hidden_content),
+    ('url',    extract_urls),
+    ('att',    detect_suspicious_attachments),
+    ('subj',   detect_suspicious_subject),
+    ('homo',   detect_homograph_attack),
+    ('time',   detect_time_anomaly),
+)
+
+# 提前结束时的执行顺序：由快到慢（bench_pipeline.py 各维度 p50）。
+# subj / homo / url / hidden 共享 HTML 解析结果，放在一起；reg 需要 WHOIS 网络查询，放在最后
+DETECTOR_COST_ORDER = ('spoof', 'att', 'auth', 'domain', 'time', 'subj', 'homo', 'url', 'hidden', 'reg')
+
+
+# analyze_email() 返回的结构化判定结果（纯数据，可直接序列化为 JSON）
+Verdict = Dict[str, Any]
+
+# ══════════════════════════════════════════════
+# 综合评分（满分 100）
+# ──────────────────────────────────────────────
+# 权重设计依据（安全实践）：
+#
+# 【极高权重 - 单独触发即高度可疑】
+#   同形字攻击(15)：几乎100%恶意，无正常使用场景
+#   附件威胁(15)：可执行文件/宏/双扩展名，直接危害最高
+#
+# 【高权重 - 强信号】
+#   发件人伪造(15)：SPF/Received链不匹配，确认身份欺骗
+#   邮件认证(15)：SPF/DKIM/DMARC三重失败，发件人可信度极低
+#   域名仿冒(12)：字符替换/高相似域名，典型钓鱼手法
+#
+# 【中权重 - 辅助信号】
+#   URL风险(10)：链接显示与实际不符，辅助判断
+#   隐藏内容(8)：跟踪像素等，钓鱼邮件常用
+#   域名年龄(8)：新注册域名，单独价值中等
+#
+# 【低权重 - 弱信号，配合其他使用】
+#   主题关键词(5)：正常邮件也可能触发
+#   时间异常(5)：单独出现可能是服务器问题
+# ──────────────────────────────────────────────
+# 各维度格式：(原始满分, 权重)
+SCORE_WEIGHTS = {
+    'homo':    ( 4.0,  15),  # 同形字：极高危
+    'att':     (10.0,  15),  # 附件威胁：极高危
+    'spoof':   ( 8.0,  15),  # 发件伪造：高危
+    'auth':    ( 9.0,  15),  # 邮件认证：高危
+    'domain':  ( 6.0,  12),  # 域名仿冒：高危
+    'url':     ( 8.0,  10),  # URL风险：中危
+    'hidden':  ( 8.0,   8),  # 隐藏内容：中危
+    'reg':     ( 5.0,   8),  # 域名年龄：中危
+    'subj':    ( 6.0,   5),  # 主题词：弱信号
+    'time':    ( 4.0,   5),  # 时间异常：弱信号
+}
+# 各权重之和 = 108，压缩到100
+
+DIMENSION_NAMES = {
+    'homo':   '同形字攻击',
+    'att':    '附件威胁',
+    'spoof':  '发件伪造',
+    'auth':   '邮件认证',
+    'domain': '域名仿冒',
+    'url':    'URL风险',
+    'hidden': '隐藏内容',
+    'reg':    '域名年龄',
+    'subj':   '主题关键词',
+    'time':   '时间异常',
+}
+
+
+def _sender_age_days(reg_r: Dict[str, Any]) -> int:
+    """发件人域名注册天数；WHOIS 未查到时视为老域名（999 天）"""
+    age = (reg_r.get('sender_domain') or {}).get('age_days')
+    return 999 if age is None else age
+
+
+def score_results(results: Dict[str, Dict[str, Any]]) -> Verdict:
+    """
+    根据各检测器结果计算综合评分与恶意判定
+
+    Args:
+        results: run_detectors() 的返回值
+
+    Returns:
+        包含 contributions / bonuses / total_score / overall_level /
+        high_signals / is_malicious 的字典
+    """
+    auth_r   = results['auth']
+    domain_r = results['domain']
+    spoof_r  = results['spoof']
+    reg_r    = results['reg']
+    url_r    = results['url']
+    att_r    = results['att']
+    homo_r   = results['homo']
+
+    contributions = {}
+    total_score = 0.0
+    for key, (max_raw, weight) in SCORE_WEIGHTS.items():
+        score = results[key].get('risk_score', 0.0)
+        normalized = min(score / max_raw, 1.0) * weight if max_raw > 0 else 0
+        contributions[key] = {'raw': score, 'max_raw': max_raw, 'weight': weight, 'score': normalized}
+        total_score += normalized
+
+    sender_age = _sender_age_days(reg_r)
+
+    # ── 联动加分：多个强信号同时命中时额外加分 ──
+    bonuses = []
+    # 钓鱼组合1：域名仿冒 + 域名年龄短（典型新建仿冒域名）
+    if domain_r['risk_level'] == 'high' and sender_age < 90:
+        bonuses.append({'name': '域名仿冒 + 新注册域名', 'points': 15.0})
+
+    # 钓鱼组合2：发件伪造 + 认证失败（双重身份欺骗）
+    if spoof_r['is_spoofed'] and auth_r['spf']['status'] in ('fail', 'softfail'):
+        bonuses.append({'name': '发件伪造 + SPF 失败', 'points': 10.0})
+
+    # 钓鱼组合3：域名仿冒 + 可疑URL（视觉欺骗配合链接劫持）
+    if domain_r['risk_level'] == 'high' and url_r['risk_level'] in ('high', 'medium'):
+        bonuses.append({'name': '域名仿冒 + 可疑URL', 'points': 8.0})
+
+    # 钓鱼组合4：同形字 + 任意其他高危信号（几乎确认恶意）
+    if homo_r['risk_score'] >= 4 and any([
+        auth_r['risk_level'] == 'high',
+        domain_r['risk_level'] == 'high',
+        spoof_r['is_spoofed'],
+    ]):
+        bonuses.append({'name': '同形字 + 高危信号', 'points': 12.0})
+
+    total_score += sum(b['points'] for b in bonuses)
+    total_score = min(total_score, 100.0)
+
+    # ── 风险等级阈值（相比旧版更严格）──
+    if total_score >= 65:
+        overall_level = 'critical'
+    elif total_score >= 40:
+        overall_level = 'high'
+    elif total_score >= 20:
+        overall_level = 'medium'
+    else:
+        overall_level = 'low'
+
+    # ── 恶意判定：满足任一条件 ──
+    # 1. 综合评分高
+    # 2. 极强单一信号（同形字/可执行附件）
+    # 3. 三个以上高危信号联合
+    high_signals = sum([
+        auth_r['spf']['status'] in ('fail',),
+        auth_r['dkim']['status'] in ('fail',),
+        domain_r['risk_level'] == 'high',
+        spoof_r['is_spoofed'],
+        att_r['risk_level'] in ('high', 'critical'),
+        homo_r['risk_score'] >= 4,
+        sender_age < 30,
+        url_r['risk_level'] == 'high',
+    ])
+    is_malicious = (
+        total_score >= 55
+        or homo_r['risk_score'] >= 4          # 同形字单独触发
+        or att_r['risk_score'] >= 8            # 可执行附件/双扩展名单独触发
+        or high_signals >= 4                   # 4个及以上高危信号
+        or (domain_r['risk_level'] == 'high'   # 域名仿冒 + 新域名（≤30天）
+            and sender_age <= 30)
+    )
+
+    return {
+        'contributions': contributions,
+        'bonuses': bonuses,
+        'total_score': total_score,
+        'overall_level': overall_level,
+        'high_signals': high_signals,
+        'is_malicious': is_malicious,
+    }
+
+
+_neutral_results = None
+
+
+def _neutral() -> Dict[str, Dict[str, Any]]:
+    """各维度在空邮件上的检测结果，风险分清零（结构完整、不贡献任何分数）"""
+    global _neutral_results
+    if _neutral_results is None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_detectors(new_email_data())
+        for result in results.values():
+            result['risk_score'] = 0.0
+            result['risk_level'] = 'low'
+        _neutral_results = results
+    return _neutral_results
+
+
+def _worst_case(key: str) -> Dict[str, Any]:
+    """尚未运行的维度可能取到的最坏结果：满分且触发 score_results() 中的全部条件"""
+    return {
+        'risk_score': SCORE_WEIGHTS[key][0],
+        'risk_level': 'high',
+        'is_spoofed': True,
+        'spf': {'status': 'fail'},
+        'dkim': {'status': 'fail'},
+        'sender_domain': {'age_days': 0},
+    }
+
+
+def verdict_decided(results: Dict[str, Dict[str, Any]]) -> Optional[bool]:
+    """
+    部分维度的检测结果是否已经决定了恶意判定
+
+    score_results() 对每个维度单调：风险越高，总分、联动加分与高危信号只增不减。
+    未运行的维度全部按未命中计仍判为恶意，则结论已确定为恶意；全部按最坏情况计
+    仍达不到任何恶意条件（含 55 分阈值），则结论已确定为非恶意。
+
+    Returns:
+        True / False 为已确定的判定，None 表示还取决于未运行的维度
+    """
+    neutral = _neutral()
+    if score_results({key: results.get(key) or neutral[key] for key, _ in DETECTORS})['is_malicious']:
+        return True
+    if not score_results({key: results.get(key) or _worst_case(key) for key, _ in DETECTORS})['is_malicious']:
+        return False
+    return None
+
+
+def fill_skipped(results: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """按 DETECTORS 顺序补全未运行维度的占位结果（空邮件上的结果副本），供评分与报告使用"""
+    neutral = _neutral()
+    return {key: results[key] if key in results else copy.deepcopy(neutral[key]) for key, _ in DETECTORS}
+
+
+def summarize_message(email_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    提取报告展示所需的邮件基本信息（不含附件原始数据）
+
+    Args:
+        email_data: 邮件解析数据
+
+    Returns:
+        地址、主题、日期、附件元数据与正文预览
+    """
+    body_preview = {'kind': None, 'snippet': '', 'length': 0}
+    if email_data['body_text']:
+        body_preview = {
+            'kind': 'text',
+            'snippet': email_data['body_text'][:400],
+            'length': len(email_data['body_text']),
+        }
+    elif email_data['body_html']:
+        try:
+            clean = get_html_index(email_data)['text']
+            body_preview = {'kind': 'html', 'snippet': clean[:400], 'length': len(clean)}
+        except Exception:
+            body_preview = {'kind': 'html_error', 'snippet': '', 'length': 0}
+
+    attachment_keys = (
+        'filename', 'mime_type', 'size', 'extension', 'hash_md5', 'hash_sha256',
+        'is_inline', 'is_executable', 'is_archive', 'archive_contents', 'archive_warnings', 'cache_hit',
+    )
+    return {
+        'from': email_data['from'],
+        'to': email_data['to'],
+        'cc': email_data['cc'],
+        'reply_to': email_data['reply_to'],
+        'subject': str(email_data['subject'] or ''),
+        'date': str(email_data['date'] or ''),
+        'attachments': [
+            {k: att.get(k) for k in attachment_keys}
+            for att in email_data['attachments']
+        ],
+        'body_preview': body_preview,
+    }
+
+
+def analyze_email(email_data: Dict[str, Any], complete: bool = None) -> Verdict:
+    """
+    无界面分析入口：运行检测器并返回结构化判定（不打印任何报告）
+
+    Args:
+        email_data: parse_email() 的返回值
+        complete: 运行全部检测器；默认取 not CONFIG['early_exit']，
+                  否则恶意判定确定后跳过剩余检测器（见 verdict_decided）
+
+    Returns:
+        Verdict 字典：
+          message        邮件基本信息（summarize_message）
+          results        各维度检测结果
+          contributions  各维度原始分 / 权重 / 贡献分
+          bonuses        命中的联动加分
+          total_score    综合评分（0-100）
+          overall_level  综合风险等级
+          high_signals   高危信号个数
+          is_malicious   是否判定为恶意邮件
+          timings        各阶段耗时（collect_timings）
+          skipped        因结论已确定而未运行的维度（其结果为空邮件上的占位结果）
+          score_is_lower_bound  有维度未运行时为 True：total_score / overall_level 只计入
+                         已运行的维度，完整运行的评分只会更高或相同
+    """
+    if complete is None:
+        complete = not CONFIG['early_exit']
+    return score_email(email_data, run_detectors(email_data, early_exit=not complete))
+
+
+def score_email(email_data: Dict[str, Any], results: Dict[str, Dict[str, Any]]) -> Verdict:
+    """对检测结果评分，组装为 Verdict（analyze_email / analyze_headers 共用）"""
+    score_timing = new_timing()
+    with StageTimer(score_timing):
+        verdict = {
+            'message': summarize_message(email_data),
+            'results': fill_skipped(results),
+        }
+        verdict.update(score_results(verdict['results']))
+        verdict['skipped'] = [key for key, _ in DETECTORS if key not in results]
+        verdict['score_is_lower_bound'] = bool(verdict['skipped'])
+    verdict['timings'] = collect_timings(email_data, score_timing)
+    return verdict
+
+
+def collect_timings(email_data: Dict[str, Any], score_timing: Dict[str, float]) -> Dict[str, Any]:
+    """
+    汇总一封邮件各阶段的墙钟 / CPU 耗时（毫秒）
+
+    Returns:
+        {'parse', 'attachments': [{'filename', ...}], 'detectors': {维度键: ...}, 'score', 'total'}；
+        附件耗时已包含在 parse 与触发预览的检测器中，total 不重复计算
+    """
+    def rounded(record):
+        return {field: round(value, 3) for field, value in record.items()}
+
+    timings = email_data.get('timings') or {}
+    parse = timings.get('parse') or new_timing()
+    detectors = timings.get('detectors') or {}
+    stages = [parse, score_timing, *detectors.values()]
+    return {
+        'parse': rounded(parse),
+        'attachments': [
+            {'filename': att['filename'], **rounded(att.get('timing') or new_timing())}
+            for att in email_data['attachments']
+        ],
+        'detectors': {key: rounded(record) for key, record in detectors.items()},
+        'score': rounded(score_timing),
+        'total': rounded({field: sum(stage[field] for stage in stages) for field in ('wall_ms', 'cpu_ms')}),
+    }
+
+
+def _json_default(obj: Any) -> Any:
+    """json.dumps 的兜底转换：日期转 ISO 字符串，集合转列表，二进制数据丢弃"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    if isinstance(obj, (bytes, bytearray)):
+        return None
+    return str(obj)
+
+
+def verdict_to_json(verdict: Verdict, **kwargs) -> str:
+    """将判定结果序列化为 JSON 字符串（供下游系统消费）"""
+    return json.dumps(verdict, ensure_ascii=False, default=_json_default, **kwargs)
+
+
+# ========== 头部分诊 ==========
+
+# 只依赖邮件头的检测维度：第一层分诊只运行这些（reg 需要 WHOIS，留给第二层；
+# domain / homo / subj 在第一层只看地址和主题，正文中的转发发件人、URL 与关键词留给第二层）
+HEADER_DIMENSIONS = ('auth', 'domain', 'spoof', 'subj', 'homo', 'time')
+# 只读邮件头就能得到与完整分析相同结果的维度；其余维度的结论都可能被正文改变
+HEADER_COMPLETE_DIMENSIONS = ('auth', 'spoof', 'time')
+HEADER_READ_CHUNK = 64 * 1024
+# 不会携带附件的顶层 Content-Type：只有这些邮件可以凭低分在第一层直接放行
+TEXT_ONLY_CONTENT_TYPES = ('text/plain', 'text/html', 'multipart/alternative')
+_HEADER_BLOCK_END = re.compile(rb'\r?\n\r?\n')
+
+def read_header_block(file_path: str) -> bytes:
+    """只读取 .eml 文件开头的邮件头（到第一个空行为止），不读入正文和附件"""
+    data = b''
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HEADER_READ_CHUNK), b''):
+            # 从上一块末尾往前 3 字节开始找，分隔符可能跨块
+            start = max(0, len(data) - 3)
+            data += chunk
+            match = _HEADER_BLOCK_END.search(data, start)
+            if match:
+                return data[:match.end()]
+    return data
+
+
+def parse_headers(raw: bytes) -> Dict[str, Any]:
+    """
+    只解析邮件头（BytesHeaderParser），返回与 parse_email() 结构相同的 email_data，
+    正文与附件为空；raw 可以是整封邮件，也可以只是 read_header_block() 读出的头部
+    """
+    email_data = new_email_data()
+    parse_timing = new_timing()
+    with StageTimer(parse_timing):
         try:
-            return check_domain_registration(domain)
+            read_headers(BytesHeaderParser(policy=policy.default).parsebytes(raw), email_data)
         except Exception as e:
-            if attempt == max_retries - 1:
-                return {
-                    'domain': domain,
-                    'creation_date': None,
-                    'expiration_date': None,
-                    'last_updated': None,
-                    'age_days': None,
-                    'risk_level': 'unknown',
-                    'risk_score': 0.0,
-                    'warnings': [f"多次尝试后仍无法获取域名信息: {str(e)}"]
-                }
-            print(f"第 {attempt + 1} 次尝试失败，准备重试...")
-            time.sleep(2)  # 等待2秒后重试
+            print(f"邮件头解析失败: {str(e)}")
+    email_data['timings'] = {'parse': parse_timing, 'detectors': {}}
+    return email_data
+
+
+def analyze_headers(raw: bytes) -> Verdict:
+    """
+    第一层分诊：只解析邮件头并运行 HEADER_DIMENSIONS，其余维度按未命中计分
+
+    Returns:
+        与 analyze_email() 结构相同的判定，verdict['tier'] 为 1
+    """
+    email_data = parse_headers(raw)
+    verdict = score_email(email_data, run_detectors(email_data, HEADER_DIMENSIONS))
+    verdict['tier'] = 1
+    verdict['content_type'] = email_data['headers'].get('content-type', 'text/plain').split(';')[0].strip().lower()
+    return verdict
+
+
+def needs_full_analysis(verdict: Verdict) -> bool:
+    r"""
+    第一层结论是否还需要第二层完整分析
+
+    其余维度只会加分、不会减分，因此第一层已判定为恶意、或评分达到 triage_high 的邮件
+    无需再看正文和附件。低于 triage_low 的邮件只有在正文、附件无论如何都改变不了结论时
+    才放行：顶层 Content-Type 不可能携带附件，且只取 HEADER_COMPLETE_DIMENSIONS 的结果、
+    其余维度全部按最坏情况计（verdict_decided()）仍不可能判为恶意。正文中的一个
+    同形字链接单独即可判为恶意，所以有正文的邮件实际上都会进入第二层。
+
+    >>> raw = (b'From: Apple <no-reply@apple.com>\r\nTo: user@example.org\r\nSubject: hi\r\n'
+    ...        b'Authentication-Results: mx.example.org; spf=pass; dkim=pass; dmarc=pass\r\n'
+    ...        b'Content-Type: text/html\r\n\r\n<a href="https://xn--le-6kc8da.com/signin">x</a>')
+    >>> verdict = analyze_headers(raw)
+    >>> verdict['is_malicious'], verdict['total_score'] < CONFIG['triage_low'], needs_full_analysis(verdict)
+    (False, True, True)
+    >>> analyze_email(parse_email('message.eml', raw))['is_malicious']
+    True
+    """
+    if verdict['is_malicious']:
+        return False
+    score = verdict['total_score']
+    if score < CONFIG['triage_low']:
+        if verdict['content_type'] not in TEXT_ONLY_CONTENT_TYPES:
+            return True
+        complete = {key: verdict['results'][key] for key in HEADER_COMPLETE_DIMENSIONS}
+        return verdict_decided(complete) is not False
+    return score < CONFIG['triage_high']
+
+
+# ========== 整封邮件结果缓存 ==========
+
+# 检测逻辑变化（规则、判定方式）时递增；权重、词表、索引等变化会自动反映在规则版本中
+DETECTOR_VERSION = 5
+
+# 影响判定结果的运行配置项
+RULESET_CONFIG_KEYS = (
+    'offline', 'triage', 'body_keyword_factor', 'preview_max_bytes', 'preview_max_pages',
+    'archive_max_depth', 'archive_max_members', 'archive_max_bytes', 'archive_max_ratio',
+    'header_triage', 'triage_low', 'triage_high', 'early_exit',
+)
+
+
+def _file_signature(path: str):
+    """外部规则文件的标识（路径 + 修改时间），未配置或不存在时为 None"""
+    if not path:
+        return None
+    try:
+        return [path, os.path.getmtime(path)]
+    except OSError:
+        return [path, None]
+
+
+def ruleset_version() -> str:
+    """
+    当前检测规则的版本指纹：检测器版本、评分权重、内置关键词、外部词表 / 索引文件
+    以及影响判定的运行配置，任何一项变化都会得到不同的版本
+    """
+    material = {
+        'detector': DETECTOR_VERSION,
+        'weights': SCORE_WEIGHTS,
+        'keywords': DEFAULT_KEYWORDS,
+        'keyword_file': _file_signature(CONFIG['keyword_file']),
+        'confusables_file': _file_signature(CONFIG['confusables_file']),
+        'brand_index': _file_signature(CONFIG['brand_index']),
+        'nrd_index': _file_signature(CONFIG['nrd_index']),
+        'config': {key: CONFIG[key] for key in RULESET_CONFIG_KEYS},
+        'extra_formats': sorted(ext for ext in PREVIEW_LIBRARIES if preview_available(ext)),
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def hash_file(file_path: str) -> str:
+    """分块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DECODE_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cached_analysis(content_hash: str, file_path: str, raw: bytes = None) -> Verdict:
+    """按内容哈希查询结果缓存，未命中时解析并分析邮件，判定写回缓存"""
+    cache = get_cache('results') if CONFIG['result_cache'] else None
+    key = f"{content_hash}:{ruleset_version()}"
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            cached['cache_hit'] = True
+            cached['content_sha256'] = content_hash
+            return cached
+
+    header_verdict = None
+    if CONFIG['header_triage'] and not file_path.lower().endswith('.msg'):
+        header_verdict = analyze_headers(raw if raw is not None else read_header_block(file_path))
+    if header_verdict is not None and not needs_full_analysis(header_verdict):
+        verdict = json.loads(verdict_to_json(header_verdict))
+    else:
+        email_data = parse_email(file_path, raw)
+        try:
+            verdict = json.loads(verdict_to_json(analyze_email(email_data)))
+        finally:
+            release_email_data(email_data)
+        verdict['tier'] = 2
+    if header_verdict is not None:
+        verdict['header_score'] = header_verdict['total_score']
+    if cache:
+        cache.put(key, verdict, ttl=CONFIG['result_ttl'])
+    verdict['cache_hit'] = False
+    verdict['content_sha256'] = content_hash
+    return verdict
+
+
+def analyze_file(file_path: str) -> Verdict:
+    """
+    分析单个邮件文件并返回判定（带整封邮件结果缓存）
+
+    以原始文件字节的 SHA-256 + ruleset_version() 为键查询本地结果库，
+    命中时直接返回保存的判定，不再解析邮件。返回的判定均为 JSON 兼容结构
+    （日期为 ISO 字符串），缓存命中与否结构一致；verdict['cache_hit'] 标明来源，
+    verdict['content_sha256'] 为原始字节的 SHA-256。
+    """
+    return _cached_analysis(hash_file(file_path), file_path)
+
+
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'   # Outlook .msg（OLE 复合文档）文件头
+
+
+def analyze_bytes(raw: bytes, filename: str = '') -> Verdict:
+    """
+    分析内存中的邮件原始字节，行为同 analyze_file()
+
+    Args:
+        raw: 邮件原始字节
+        filename: 文件名，仅用扩展名区分 .eml / .msg（可省略）
+    """
+    if not filename.lower().endswith(('.eml', '.msg')):
+        # 未给出扩展名时按文件头判断：OLE 复合文档为 .msg，其余按 .eml 解析
+        filename = 'message.msg' if raw.startswith(OLE_MAGIC) else 'message.eml'
+    return _cached_analysis(hashlib.sha256(raw).hexdigest(), filename, raw)
+
 
 def print_banner():
     """启动欢迎界面"""
@@ -2236,8 +4918,10 @@ def analyze_one(file_path: str) -> str:
         print(f"\n{C}▶  开始分析: {os.path.basename(file_path)}  ({size:,} 字节){RS}")
         print(f"{'─'*62}")
 
-        email_data = parse_email(file_path)
-        display_report(email_data)
+        verdict = analyze_file(file_path)
+        if verdict['cache_hit']:
+            print(f"{C}（内容与此前分析过的邮件相同，使用缓存结果）{RS}")
+        render_report(verdict)
         return 'done'
 
     except Exception as e:
@@ -2247,7 +4931,1118 @@ def analyze_one(file_path: str) -> str:
         return 'error'
 
 
-if __name__ == "__main__":
+# ========== 批量模式 ==========
+
+SUPPORTED_EXTENSIONS = ('.eml', '.msg')
+
+
+def iter_email_files(patterns: List[str]) -> List[str]:
+    """
+    将目录 / 通配符 / 文件路径展开为邮件文件列表
+
+    目录会递归收集其中的 .eml / .msg 文件；每个参数内部按路径排序，
+    整体按参数顺序拼接并去重，保证多次运行的结果顺序稳定。
+
+    Args:
+        patterns: 目录、glob 通配符或文件路径列表
+
+    Returns:
+        邮件文件路径列表
+    """
+    files = []
+    seen = set()
+
+    def add(path):
+        path = os.path.normpath(path)
+        if path not in seen and path.lower().endswith(SUPPORTED_EXTENSIONS):
+            seen.add(path)
+            files.append(path)
+
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if os.path.isdir(pattern):
+            found = []
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                found.extend(os.path.join(root, n) for n in names)
+            for path in sorted(found):
+                add(path)
+        elif glob.has_magic(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    add(path)
+        elif os.path.isfile(pattern):
+            add(pattern)
+    return files
+
+
+def _batch_worker_init(quiet: bool = True, config: Dict[str, Any] = None) -> None:
+    """进程池初始化：同步主进程的运行配置，并屏蔽解析/检测过程中的逐条打印"""
+    if config:
+        CONFIG.update(config)
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+
+# 批量模式汇总命中率的缓存（名称 → 显示名）
+BATCH_CACHE_NAMES = {'results': '结果缓存', 'attachments': '附件缓存'}
+
+
+def _batch_worker(file_path: str, sniff: bool = False) -> Dict[str, Any]:
+    """
+    批量模式下的单封邮件分析（在工作进程中运行）
+
+    任何异常都在此处捕获并作为结果返回，单个损坏文件不会拖垮工作进程。
+    sniff 为 True 时按文件内容判断格式（Maildir 中的邮件文件没有扩展名）。
+    """
+    start = time.perf_counter()
+    caches = {name: get_cache(name) for name in BATCH_CACHE_NAMES}
+    before = {name: (c.hits, c.misses) for name, c in caches.items()}
+    try:
+        if sniff:
+            with open(file_path, 'rb') as f:
+                verdict = analyze_bytes(f.read(), file_path)
+        else:
+            verdict = analyze_file(file_path)
+        result = {
+            'path': file_path,
+            'status': 'ok',
+            'verdict': verdict,
+        }
+    except Exception as e:
+        result = {
+            'path': file_path,
+            'status': 'error',
+            'error': f'{type(e).__name__}: {e}',
+        }
+    result['elapsed'] = time.perf_counter() - start
+    result['cache_stats'] = {
+        name: {'hits': c.hits - before[name][0], 'misses': c.misses - before[name][1]}
+        for name, c in caches.items()
+    }
+    return result
+
+
+def run_batch(file_paths: List[str], workers: int = 0, quiet: bool = True):
+    """
+    使用进程池并发分析多封邮件
+
+    结果按 file_paths 的顺序逐个产出（与完成顺序无关）。
+
+    Args:
+        file_paths: 邮件文件路径列表
+        workers: 工作进程数，0 表示使用 CPU 核数，1 表示在当前进程内串行执行
+        quiet: 是否屏蔽工作进程中的逐条打印
+
+    Yields:
+        每封邮件的分析结果字典
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for path in file_paths:
+            if quiet:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = _batch_worker(path)
+            else:
+                result = _batch_worker(path)
+            yield result
+        return
+
+    chunksize = max(1, min(32, len(file_paths) // (workers * 8) or 1))
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_batch_worker_init,
+                             initargs=(quiet, dict(CONFIG))) as executor:
+        yield from executor.map(_batch_worker, file_paths, chunksize=chunksize)
+
+
+def format_batch_result(result: Dict[str, Any]) -> str:
+    """批量 / 监视模式下一封邮件的结果行：风险等级、评分、路径"""
+    R  = '\033[1;31m'
+    RS = '\033[0m'
+    if result['status'] == 'error':
+        return f"  {R}ERROR{RS}  {result['path']}  {result['error']}"
+    verdict = result['verdict']
+    if verdict['is_malicious']:
+        status = f"{R}MALICIOUS{RS}"
+    else:
+        level = verdict['overall_level']
+        status = fmt_risk(level) + ' ' * (9 - len(level))
+    # 跳过了部分维度时评分只是下界
+    bound = '≥' if verdict.get('score_is_lower_bound') else ' '
+    return f"  {status} {bound}{verdict['total_score']:5.1f}  {result['path']}"
+
+
+def batch_main(args) -> int:
+    """批量模式入口，返回进程退出码"""
+    R  = '\033[1;31m'
+    G  = '\033[1;32m'
+    C  = '\033[1;36m'
+    RS = '\033[0m'
+
+    file_paths = iter_email_files(args.paths)
+    if not file_paths:
+        print(f"{R}⚠  未找到任何 .eml / .msg 文件{RS}")
+        return 1
+    if args.triage:
+        CONFIG['triage'] = True
+    if args.header_triage:
+        CONFIG['header_triage'] = True
+    if args.complete:
+        CONFIG['early_exit'] = False
+
+    print(f"{C}▶  批量分析 {len(file_paths)} 封邮件（工作进程: {args.workers or os.cpu_count()}）{RS}")
+
+    jsonl = open(args.jsonl, 'w', encoding='utf-8') if args.jsonl else None
+
+    total = errors = malicious = header_only = 0
+    cache_totals = {name: {'hits': 0, 'misses': 0} for name in BATCH_CACHE_NAMES}
+    start = time.perf_counter()
+    try:
+        for result in run_batch(file_paths, workers=args.workers, quiet=not args.verbose):
+            total += 1
+            for name, stats in result['cache_stats'].items():
+                cache_totals[name]['hits'] += stats['hits']
+                cache_totals[name]['misses'] += stats['misses']
+            if jsonl:
+                jsonl.write(verdict_to_json(result) + '\n')
+            print(format_batch_result(result))
+            if result['status'] == 'error':
+                errors += 1
+            else:
+                malicious += result['verdict']['is_malicious']
+                header_only += result['verdict'].get('tier') == 1
+    except KeyboardInterrupt:
+        print(f"\n{R}⚠  已中断{RS}")
+    finally:
+        if jsonl:
+            jsonl.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"\n{G}✔  完成 {total} 封（恶意 {malicious}，失败 {errors}），耗时 {elapsed:.1f} 秒，{rate:.1f} 封/秒{RS}")
+    if CONFIG['header_triage']:
+        print(f"   头部分诊: {header_only} 封仅凭邮件头完成判定，{total - errors - header_only} 封完整分析")
+    for name, label in BATCH_CACHE_NAMES.items():
+        stats = cache_totals[name]
+        if stats['hits'] or stats['misses']:
+            print(f"   {label}: 命中 {stats['hits']}，未命中 {stats['misses']}")
+    return 1 if errors else 0
+
+
+# ========== 守护进程模式 ==========
+
+def _daemon_worker_init(config: Dict[str, Any]) -> None:
+    """守护进程工作进程初始化：同步配置后预热关键词自动机、索引与 HTML 解析器"""
+    _batch_worker_init(True, config)
+    get_keyword_automaton()
+    get_brand_index()
+    get_nrd_index()
+    index_html('<html><body><a href="http://example.com">x</a></body></html>')
+
+
+def _daemon_analyze(kind: str, value: Any, filename: str = '') -> Verdict:
+    """在工作进程中分析一次提交（kind 为 'path' 或 'raw'）"""
+    if kind == 'path':
+        return analyze_file(value)
+    return analyze_bytes(value, filename)
+
+
+def _warmup_ping(_: Any = None) -> int:
+    return os.getpid()
+
+
+def start_daemon_pool(workers: int) -> ProcessPoolExecutor:
+    """创建常驻工作进程池，并预先拉起全部工作进程，首个请求不承担启动和导入开销"""
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=_daemon_worker_init,
+                                   initargs=(dict(CONFIG),))
+    list(executor.map(_warmup_ping, range(workers * 2)))
+    return executor
+
+
+class MerRequestHandler(BaseHTTPRequestHandler):
+    """
+    守护进程 HTTP 接口
+
+      GET  /health    服务状态
+      POST /analyze   提交邮件：JSON {"path": "..."} 或原始 .eml / .msg 字节，
+                      文件名可由 ?filename= 或 X-MER-Filename 指定；返回判定 JSON
+
+    按路径提交会让守护进程读取本机任意可读文件，只在监听本机回环地址或 Unix 套接字时接受。
+    """
+
+    server_version = 'mer'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self) -> str:
+        # Unix 套接字没有客户端地址
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: Any, elapsed: float = None) -> None:
+        data = verdict_to_json(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if elapsed is not None:
+            self.send_header('X-MER-Elapsed-Ms', f'{elapsed * 1000:.1f}')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if urlparse(self.path).path != '/health':
+            self._send_json(404, {'error': '未知路径'})
+            return
+        self._send_json(200, {
+            'status': 'ok',
+            'workers': self.server.workers,
+            'ruleset': ruleset_version(),
+            'uptime': round(time.time() - self.server.started, 1),
+        })
+
+    def _restart_pool(self, broken: ProcessPoolExecutor) -> None:
+        """工作进程崩溃（如被 OOM 杀掉）后进程池不可再用，重建一次；并发请求只有第一个负责重建"""
+        with self.server.pool_lock:
+            if self.server.executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.server.executor = start_daemon_pool(self.server.workers)
+                print('工作进程异常退出，已重建进程池')
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != '/analyze':
+            self._send_json(404, {'error': '未知路径'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self._send_json(411, {'error': '缺少 Content-Length'})
+            return
+        if length < 0:
+            # rfile.read(-1) 会一直读到连接关闭
+            self._send_json(400, {'error': 'Content-Length 不能为负数'})
+            self.close_connection = True
+            return
+        if length > CONFIG['serve_max_bytes']:
+            self._send_json(413, {'error': f'提交内容超过 {CONFIG["serve_max_bytes"]} 字节'})
+            self.close_connection = True
+            return
+        body = self.rfile.read(length)
+
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type == 'application/json':
+            try:
+                path = json.loads(body)['path']
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {'error': 'JSON 提交需要 {"path": "..."}'})
+                return
+            if not self.server.allow_paths:
+                self._send_json(403, {'error': '监听非本机地址时不接受按路径提交，请提交原始邮件字节'})
+                return
+            if not os.path.isfile(path):
+                self._send_json(404, {'error': f'文件不存在: {path}'})
+                return
+            job = ('path', os.path.abspath(path), '')
+        else:
+            if not body:
+                self._send_json(400, {'error': '提交内容为空'})
+                return
+            filename = (parse_qs(url.query).get('filename') or [self.headers.get('X-MER-Filename', '')])[0]
+            job = ('raw', body, filename)
+
+        start = time.perf_counter()
+        executor = self.server.executor
+        try:
+            future = executor.submit(_daemon_analyze, *job)
+            verdict = future.result(timeout=CONFIG['serve_timeout'])
+        except FutureTimeoutError:
+            future.cancel()
+            self._send_json(504, {'error': f'分析超时（{CONFIG["serve_timeout"]} 秒）'})
+            return
+        except BrokenProcessPool:
+            self._restart_pool(executor)
+            self._send_json(503, {'error': '工作进程异常退出，进程池已重建，请重试'})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self._send_json(200, verdict, time.perf_counter() - start)
+
+
+def is_loopback_host(host: str) -> bool:
+    """监听地址是否只在本机可达（IP 或主机名解析出的全部地址都是回环地址）"""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except OSError:
+        return False
+    return bool(infos) and all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+
+
+class MerHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class MerUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_main(args) -> int:
+    """守护进程入口：常驻进程池，监听 localhost HTTP 或 Unix 套接字"""
+    C  = '\033[1;36m'
+    G  = '\033[1;32m'
+    RS = '\033[0m'
+
+    workers = args.workers or os.cpu_count() or 1
+    executor = start_daemon_pool(workers)
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        server = MerUnixServer(args.unix, MerRequestHandler)
+        address = f'unix:{args.unix}'
+        server.allow_paths = True
+    else:
+        server = MerHTTPServer((args.host, args.port), MerRequestHandler)
+        address = f'http://{args.host}:{server.server_address[1]}'
+        server.allow_paths = is_loopback_host(args.host)
+    server.executor = executor
+    server.pool_lock = threading.Lock()
+    server.workers = workers
+    server.quiet = not args.verbose
+    server.started = time.time()
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _stop)
+
+    print(f"{C}▶  mer 守护进程已启动: {address}（工作进程: {workers}）{RS}")
+    print("   POST /analyze 提交邮件，GET /health 查看状态，Ctrl+C 退出")
+    if not server.allow_paths:
+        print("   监听非本机地址：只接受原始邮件字节，拒绝按路径提交")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(wait=True, cancel_futures=True)
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+    print(f"\n{G}✔  守护进程已退出{RS}")
+    return 0
+
+
+# ========== SMTP 过滤代理 ==========
+
+SMTP_LINE_LIMIT = 1024 * 1024       # 单行（含 DATA 中的行）最大字节数
+SMTP_IDLE_TIMEOUT = 300             # 客户端空闲超时（秒），RFC 5321 建议至少 5 分钟
+SMTP_MAX_RECIPIENTS = 1000
+SMTP_MAIL_FROM = re.compile(r'FROM:\s*<([^>]*)>(.*)', re.IGNORECASE)
+SMTP_RCPT_TO = re.compile(r'TO:\s*<([^>]+)>', re.IGNORECASE)
+SMTP_SIZE_PARAM = re.compile(r'\bSIZE=(\d+)', re.IGNORECASE)
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+
+def verdict_label(verdict: Verdict) -> str:
+    """判定结果的简短标签：malicious / suspicious / clean"""
+    if verdict['is_malicious']:
+        return 'malicious'
+    return 'suspicious' if verdict['overall_level'] in ('medium', 'high', 'critical') else 'clean'
+
+
+def stamp_headers(raw: bytes, headers: Dict[str, str]) -> bytes:
+    """
+    在邮件头最前面加入 headers，并去掉原邮件中已有的 X-MER-* 头（防止发件人伪造扫描结果）
+
+    Args:
+        raw: 邮件原始字节
+        headers: 要加入的头字段（值须为 ASCII）
+    """
+    match = _HEADER_END.search(raw)
+    if match:
+        # 头部保留到空行之前那一行的行尾
+        split = match.start() + (2 if raw.startswith(b'\r\n', match.start()) else 1)
+    else:
+        split = len(raw)
+    kept = []
+    skipping = False
+    for line in raw[:split].splitlines(keepends=True):
+        if line[:1] in (b' ', b'\t'):
+            # 折叠行跟随上一行的去留
+            if not skipping:
+                kept.append(line)
+            continue
+        skipping = line[:6].lower() == b'x-mer-'
+        if not skipping:
+            kept.append(line)
+    stamp = ''.join(f'{name}: {value}\r\n' for name, value in headers.items()).encode('ascii')
+    return stamp + b''.join(kept) + raw[split:]
+
+
+class SmtpServer:
+    """
+    基于 asyncio 的最小 ESMTP 服务端（EHLO/HELO、MAIL、RCPT、DATA、RSET、NOOP、VRFY、QUIT）
+
+    每个连接一个协程，支持 PIPELINING、SIZE、8BITMIME；收完一封邮件后调用 deliver()，
+    其返回值即 DATA 的应答行。子类通过重写 deliver() 决定如何处理邮件。
+    """
+
+    def __init__(self, hostname: str = '', max_bytes: int = 0):
+        self.hostname = hostname or socket.gethostname()
+        self.max_bytes = max_bytes or CONFIG['serve_max_bytes']
+
+    async def deliver(self, mail_from: str, rcpts: List[str], data: bytes) -> str:
+        return '250 2.0.0 OK'
+
+    async def handle(self, reader, writer) -> None:
+        """asyncio.start_server 的连接回调：处理一个 SMTP 会话"""
+        # asyncio 导入较慢，只在 SMTP 模式下加载
+        import asyncio
+
+        async def reply(text: str) -> None:
+            writer.write(text.encode('utf-8') + b'\r\n')
+            await writer.drain()
+
+        async def readline() -> bytes:
+            return await asyncio.wait_for(reader.readline(), SMTP_IDLE_TIMEOUT)
+
+        mail_from, rcpts = None, []
+        try:
+            await reply(f'220 {self.hostname} ESMTP mer')
+            while True:
+                line = await readline()
+                if not line:
+                    break
+                verb, _, arg = line.decode('utf-8', 'replace').rstrip('\r\n').partition(' ')
+                verb = verb.upper()
+                if verb == 'EHLO':
+                    mail_from, rcpts = None, []
+                    await reply(f'250-{self.hostname}\r\n250-SIZE {self.max_bytes}\r\n'
+                                f'250-8BITMIME\r\n250 PIPELINING')
+                elif verb == 'HELO':
+                    mail_from, rcpts = None, []
+                    await reply(f'250 {self.hostname}')
+                elif verb == 'MAIL':
+                    match = SMTP_MAIL_FROM.match(arg)
+                    size = SMTP_SIZE_PARAM.search(arg) if match else None
+                    if mail_from is not None:
+                        await reply('503 5.5.1 Nested MAIL command')
+                    elif not match:
+                        await reply('501 5.5.4 Syntax: MAIL FROM:<address>')
+                    elif size and int(size.group(1)) > self.max_bytes:
+                        await reply('552 5.3.4 Message size exceeds fixed limit')
+                    else:
+                        mail_from = match.group(1)
+                        await reply('250 2.1.0 OK')
+                elif verb == 'RCPT':
+                    match = SMTP_RCPT_TO.match(arg)
+                    if mail_from is None:
+                        await reply('503 5.5.1 Need MAIL command')
+                    elif not match:
+                        await reply('501 5.5.4 Syntax: RCPT TO:<address>')
+                    elif len(rcpts) >= SMTP_MAX_RECIPIENTS:
+                        await reply('452 4.5.3 Too many recipients')
+                    else:
+                        rcpts.append(match.group(1))
+                        await reply('250 2.1.5 OK')
+                elif verb == 'DATA':
+                    if not rcpts:
+                        await reply('503 5.5.1 Need RCPT command')
+                        continue
+                    await reply('354 End data with <CR><LF>.<CR><LF>')
+                    chunks, size = [], 0
+                    while True:
+                        line = await readline()
+                        if not line:
+                            return
+                        if line in (b'.\r\n', b'.\n'):
+                            break
+                        if line.startswith(b'.'):
+                            line = line[1:]
+                        size += len(line)
+                        # 超过上限后继续读完 DATA，但不再保存
+                        if size <= self.max_bytes:
+                            chunks.append(line)
+                    if size > self.max_bytes:
+                        await reply('552 5.3.4 Message size exceeds fixed limit')
+                    else:
+                        await reply(await self.deliver(mail_from, rcpts, b''.join(chunks)))
+                    mail_from, rcpts = None, []
+                elif verb == 'RSET':
+                    mail_from, rcpts = None, []
+                    await reply('250 2.0.0 OK')
+                elif verb == 'NOOP':
+                    await reply('250 2.0.0 OK')
+                elif verb == 'VRFY':
+                    await reply('252 2.5.0 Cannot VRFY user')
+                elif verb == 'QUIT':
+                    await reply('221 2.0.0 Bye')
+                    break
+                else:
+                    await reply('502 5.5.2 Command not recognized')
+        except asyncio.TimeoutError:
+            with contextlib.suppress(ConnectionError):
+                await reply('421 4.4.2 Idle timeout, closing connection')
+        except ValueError:
+            # 行长度超过 SMTP_LINE_LIMIT
+            with contextlib.suppress(ConnectionError):
+                await reply('500 5.5.6 Line too long')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class SmtpFilter(SmtpServer):
+    """
+    SMTP 过滤代理：收到邮件后在进程池中分析，在时间预算内得出判定则加上
+    X-MER-Score / X-MER-Verdict 头转发给下一跳，判定为恶意且开启 reject 时以 550 拒收
+
+    转发在返回 DATA 应答之前完成（前置队列过滤），下一跳的拒收会原样反馈给发件方。
+    检测超时或出错时默认放行并标记 X-MER-Verdict: timeout / error，
+    fail_closed 时改为 451 临时拒收，由发件方稍后重试。
+    """
+
+    def __init__(self, executor, relay_host: str, relay_port: int, budget: float,
+                 reject: bool = False, fail_closed: bool = False, quiet: bool = True):
+        super().__init__()
+        self.executor = executor
+        self.relay_host = relay_host
+        self.relay_port = relay_port
+        self.budget = budget
+        self.reject = reject
+        self.fail_closed = fail_closed
+        self.quiet = quiet
+        self.stats = {'messages': 0, 'malicious': 0, 'rejected': 0, 'timeout': 0, 'error': 0}
+
+    async def scan(self, raw: bytes):
+        """在时间预算内分析邮件，返回 (判定或 None, 标签)"""
+        import asyncio
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, _daemon_analyze, 'raw', raw, 'message.eml')
+        try:
+            verdict = await asyncio.wait_for(future, self.budget)
+        except asyncio.TimeoutError:
+            return None, 'timeout'
+        except Exception as e:
+            print(f"邮件分析失败: {type(e).__name__}: {e}")
+            return None, 'error'
+        return verdict, verdict_label(verdict)
+
+    def relay(self, mail_from: str, rcpts: List[str], data: bytes) -> None:
+        """通过 SMTP 转发给下一跳（在线程池中执行）"""
+        import smtplib
+        with smtplib.SMTP(self.relay_host, self.relay_port, timeout=CONFIG['serve_timeout']) as client:
+            client.sendmail(mail_from, rcpts, data)
+
+    async def deliver(self, mail_from: str, rcpts: List[str], data: bytes) -> str:
+        import asyncio
+        import smtplib
+        start = time.perf_counter()
+        verdict, label = await self.scan(data)
+        self.stats['messages'] += 1
+        if label in self.stats:
+            self.stats[label] += 1
+
+        if label == 'malicious' and self.reject:
+            self.stats['rejected'] += 1
+            response = f"550 5.7.1 Message rejected as malicious (score {verdict['total_score']:.1f})"
+        elif verdict is None and self.fail_closed:
+            response = '451 4.7.1 Content scan unavailable, try again later'
+        else:
+            headers = {'X-MER-Verdict': label}
+            if verdict is not None:
+                score = f"{verdict['total_score']:.1f}"
+                if verdict.get('score_is_lower_bound'):
+                    score += '; lower-bound'
+                headers = {'X-MER-Score': score, **headers}
+            stamped = stamp_headers(data, headers)
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.relay, mail_from, rcpts, stamped)
+                response = '250 2.0.0 OK'
+            except smtplib.SMTPRecipientsRefused:
+                response = '550 5.1.1 All recipients refused by next hop'
+            except smtplib.SMTPResponseException as e:
+                response = f"{e.smtp_code} {e.smtp_error.decode('utf-8', 'replace')}"
+            except Exception as e:
+                response = f'451 4.4.1 Next hop unavailable: {type(e).__name__}'
+
+        if not self.quiet:
+            score = f"{verdict['total_score']:5.1f}" if verdict else '    -'
+            print(f"{label:<10} {score}  {(time.perf_counter() - start) * 1000:7.1f} ms  "
+                  f"{mail_from} -> {', '.join(rcpts)}  {response[:3]}")
+        return response
+
+
+def parse_relay(value: str):
+    """
+    解析 --relay：HOST:PORT、HOST（默认 25 端口）、[IPv6]:PORT；省略主机时为 127.0.0.1
+
+    Returns:
+        (主机, 端口)
+    """
+    host, port = value, '25'
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        if rest:
+            if not rest.startswith(':'):
+                raise argparse.ArgumentTypeError(f"无法解析的下一跳地址: {value}")
+            port = rest[1:]
+    elif value.count(':') == 1:
+        host, port = value.split(':')
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError(f"下一跳端口无效: {value}")
+    return host or '127.0.0.1', int(port)
+
+
+def smtp_main(args) -> int:
+    """SMTP 过滤代理入口"""
+    import asyncio
+    C  = '\033[1;36m'
+    G  = '\033[1;32m'
+    RS = '\033[0m'
+
+    relay_host, relay_port = args.relay
+    budget = args.budget or CONFIG['smtp_budget']
+    # WHOIS 查询必须落在检测预算之内，留出解析和其余检测器的时间
+    CONFIG['whois_deadline'] = min(CONFIG['whois_deadline'], budget * 0.8)
+
+    workers = args.workers or os.cpu_count() or 1
+    executor = start_daemon_pool(workers)
+    proxy = SmtpFilter(executor, relay_host, relay_port, budget,
+                       reject=args.reject, fail_closed=args.fail_closed, quiet=not args.verbose)
+
+    async def run():
+        server = await asyncio.start_server(proxy.handle, args.host, args.port, limit=SMTP_LINE_LIMIT)
+        port = server.sockets[0].getsockname()[1]
+        print(f"{C}▶  mer SMTP 过滤代理已启动: {args.host}:{port} -> {relay_host}:{relay_port}"
+              f"（工作进程: {workers}，检测预算: {budget:g} 秒）{RS}")
+        # SIGTERM 取消主协程，正常走完清理流程
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        async with server:
+            with contextlib.suppress(asyncio.CancelledError):
+                await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    stats = proxy.stats
+    print(f"\n{G}✔  SMTP 过滤代理已退出：共 {stats['messages']} 封，恶意 {stats['malicious']}，"
+          f"拒收 {stats['rejected']}，超时 {stats['timeout']}，出错 {stats['error']}{RS}")
+    return 0
+
+
+# ========== Maildir 增量监视 ==========
+
+# 修改时间距今不足该值（纳秒）的目录可能在同一时间戳内再次变化，下一轮重新列出
+DIR_SETTLE_NS = 2 * 10 ** 9
+
+
+class MaildirWatcher:
+    """
+    增量发现 Maildir 目录树中新到达的邮件
+
+    轮询目录的修改时间：只有修改时间变化的目录才会重新列出，每轮的开销是
+    每个目录一次 stat，与邮件数量无关。new/ 与 cur/ 中的文件以 (设备号, inode)
+    为键记录在检查点中，从 new/ 移到 cur/ 的改名不会导致重复分析。
+    检查点与目录状态保存在 SQLite 中，重启后无需重新扫描整棵目录树。
+    tmp/ 目录（投递中的文件）会被跳过。
+    """
+
+    def __init__(self, roots: List[str], checkpoint: str):
+        self.roots = [os.path.abspath(os.path.expanduser(root)) for root in roots]
+        self.files = SqliteCache(checkpoint, 'watch_files')
+        self.dirs = SqliteCache(checkpoint, 'watch_dirs')
+        # 每个根目录下已知目录 -> 已处理的修改时间（0 表示需要列出）
+        self.state = {root: self.dirs.get(root) or {root: 0} for root in self.roots}
+        self._dirty = set()
+
+    @staticmethod
+    def file_key(st: os.stat_result) -> str:
+        return f"{st.st_dev}:{st.st_ino}"
+
+    def is_processed(self, st: os.stat_result) -> bool:
+        seen = self.files.get(self.file_key(st))
+        return bool(seen) and seen['mtime_ns'] == st.st_mtime_ns and seen['size'] == st.st_size
+
+    def poll(self) -> List[tuple]:
+        """
+        列出修改时间变化的目录，返回其中尚未处理的邮件
+
+        Returns:
+            [(路径, os.stat_result)]，按路径排序；同一 inode 只出现一次
+        """
+        candidates = {}
+        for root in self.roots:
+            state = self.state[root]
+            pending = list(state)
+            while pending:
+                directory = pending.pop()
+                try:
+                    st = os.stat(directory)
+                except FileNotFoundError:
+                    state.pop(directory, None)
+                    self._dirty.add(root)
+                    continue
+                if st.st_mtime_ns == state.get(directory):
+                    continue
+                fresh = time.time_ns() - st.st_mtime_ns < DIR_SETTLE_NS
+                state[directory] = 0 if fresh else st.st_mtime_ns
+                self._dirty.add(root)
+                is_mailbox = os.path.basename(directory) in ('new', 'cur')
+                try:
+                    entries = list(os.scandir(directory))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != 'tmp' and entry.path not in state:
+                            state[entry.path] = 0
+                            pending.append(entry.path)
+                    elif is_mailbox and not entry.name.startswith('.') and entry.is_file(follow_symlinks=False):
+                        try:
+                            file_st = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        if not self.is_processed(file_st):
+                            candidates[self.file_key(file_st)] = (entry.path, file_st)
+        return sorted(candidates.values())
+
+    def mark(self, st: os.stat_result, result: Dict[str, Any]) -> None:
+        """把一封邮件的分析结果写入检查点"""
+        verdict = result.get('verdict') or {}
+        self.files.put(self.file_key(st), {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha256': verdict.get('content_sha256', ''),
+            'path': result['path'],
+            'status': result['status'],
+            'label': verdict_label(verdict) if verdict else 'error',
+            'score': verdict.get('total_score'),
+            'scanned_at': time.time(),
+        })
+
+    def commit(self) -> None:
+        """保存目录状态；须在本轮发现的邮件都写入检查点之后调用，中途退出时下次会重新列出这些目录"""
+        for root in self._dirty:
+            self.dirs.put(root, self.state[root])
+        self._dirty.clear()
+
+
+def watch_main(args) -> int:
+    """Maildir 监视模式入口"""
+    R  = '\033[1;31m'
+    G  = '\033[1;32m'
+    C  = '\033[1;36m'
+    RS = '\033[0m'
+
+    if args.triage:
+        CONFIG['triage'] = True
+    if args.header_triage:
+        CONFIG['header_triage'] = True
+    if args.complete:
+        CONFIG['early_exit'] = False
+    checkpoint = args.checkpoint or os.path.join(CONFIG['cache_dir'], 'watch.sqlite3')
+    watcher = MaildirWatcher(args.paths, checkpoint)
+    workers = args.workers or os.cpu_count() or 1
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=_batch_worker_init,
+                                       initargs=(True, dict(CONFIG)))
+    jsonl = open(args.jsonl, 'a', encoding='utf-8') if args.jsonl else None
+
+    def analyze(paths):
+        if executor:
+            return executor.map(_batch_worker, paths, [True] * len(paths))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [_batch_worker(path, True) for path in paths]
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _stop)
+
+    total = malicious = 0
+    print(f"{C}▶  监视 {', '.join(watcher.roots)}（检查点: {checkpoint}，工作进程: {workers}）{RS}")
+    try:
+        while True:
+            candidates = watcher.poll()
+            for (path, st), result in zip(candidates, analyze([path for path, _ in candidates])):
+                if result['status'] == 'error' and not os.path.exists(path):
+                    # 分析期间被移走（如 new/ -> cur/），会在新位置再次发现
+                    continue
+                watcher.mark(st, result)
+                total += 1
+                if result['status'] == 'ok' and result['verdict']['is_malicious']:
+                    malicious += 1
+                if jsonl:
+                    jsonl.write(verdict_to_json(result) + '\n')
+                    jsonl.flush()
+                print(format_batch_result(result))
+            watcher.commit()
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print(f"\n{R}⚠  已停止{RS}")
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if jsonl:
+            jsonl.close()
+    print(f"{G}✔  本次共分析 {total} 封（恶意 {malicious}）{RS}")
+    return 0
+
+
+# ========== mbox 归档流式读取 ==========
+
+MBOX_MAGIC = b'MERMBX01'
+MBOX_HEADER = struct.Struct('<8sQQ32s')   # 魔数、已索引的 mbox 字节数、邮件数、开头部分的 SHA-256
+MBOX_PROBE_BYTES = 64 * 1024              # 校验 mbox 是否被替换时哈希的开头字节数
+MBOX_CHUNK = 64                           # 每个进程池任务处理的邮件数
+# mboxrd 转义：正文中以 "From " 开头的行写入时前面加了 '>'，读取时去掉一层
+MBOX_FROM_ESCAPE = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+
+def mbox_message(mm: Any, start: int, end: int) -> bytes:
+    """取出 [start, end) 范围内的一封邮件：去掉信封行 "From ..." 并还原 >From 转义"""
+    body = mm.find(b'\n', start, end)
+    if body < 0:
+        return b''
+    return MBOX_FROM_ESCAPE.sub(rb'\1', mm[body + 1:end])
+
+
+class MboxArchive:
+    """
+    内存映射的 mbox 文件与邮件起始偏移索引
+
+    首次打开时顺序扫描一遍，记录每封邮件 "From " 信封行的偏移，保存为旁路索引文件
+    （默认 <mbox>.merx，目录不可写时放在缓存目录）。再次打开时：文件未变化直接复用索引；
+    只在末尾追加了邮件时从上次索引的位置继续扫描；开头被改写或文件变短时重新建立。
+    读取单封邮件只访问该邮件所在的页，不会把整个 mbox 读入内存。
+    """
+
+    def __init__(self, path: str, index_path: str = ''):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        # 空文件无法映射
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.index_path = index_path
+        self.offsets: List[int] = []
+        self.index_status = 'built'   # built / reused / extended
+        self._load_or_build(index_path)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def span(self, i: int) -> tuple:
+        """第 i 封邮件在文件中的 [起始, 结束) 偏移"""
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+        return self.offsets[i], end
+
+    def message(self, i: int) -> bytes:
+        """第 i 封邮件的原始字节（可直接交给 EML 解析）"""
+        return mbox_message(self._mm, *self.span(i))
+
+    def close(self) -> None:
+        if self.size:
+            self._mm.close()
+        self._file.close()
+
+    def _probe(self, size: int) -> bytes:
+        return hashlib.sha256(self._mm[:min(size, MBOX_PROBE_BYTES)]).digest()
+
+    def _scan(self, start: int) -> List[int]:
+        """从 start 开始顺序查找以 "From " 开头的行，返回其偏移"""
+        mm, offsets = self._mm, []
+        if start == 0 and mm[:5] == b'From ':
+            offsets.append(0)
+        pos = max(start - 1, 0)
+        while True:
+            pos = mm.find(b'\nFrom ', pos)
+            if pos < 0:
+                return offsets
+            offsets.append(pos + 1)
+            pos += 1
+
+    def _index_paths(self, index_path: str) -> List[str]:
+        if index_path:
+            return [index_path]
+        digest = hashlib.sha1(os.path.abspath(self.path).encode('utf-8')).hexdigest()[:16]
+        return [f'{self.path}.merx', os.path.join(CONFIG['cache_dir'], 'mbox', f'{digest}.merx')]
+
+    def _read_index(self, path: str):
+        """读取索引文件，返回 (已索引字节数, 偏移列表)；不存在或与当前文件不符时返回 None"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, indexed_size, count, probe = MBOX_HEADER.unpack_from(data, 0)
+        except (OSError, struct.error):
+            return None
+        if magic != MBOX_MAGIC or indexed_size > self.size or len(data) != MBOX_HEADER.size + count * 8:
+            return None
+        if probe != self._probe(indexed_size):
+            return None
+        offsets = list(struct.unpack_from(f'<{count}Q', data, MBOX_HEADER.size))
+        if offsets and self._mm[offsets[-1]:offsets[-1] + 5] != b'From ':
+            return None
+        return indexed_size, offsets
+
+    def _load_or_build(self, index_path: str) -> None:
+        candidates = self._index_paths(index_path)
+        for path in candidates:
+            loaded = self._read_index(path)
+            if loaded is None:
+                continue
+            indexed_size, self.offsets = loaded
+            self.index_path = path
+            if indexed_size == self.size:
+                self.index_status = 'reused'
+                return
+            # 只在末尾追加了内容：从跨越旧结尾的位置继续扫描
+            resume = max(indexed_size - 5, self.offsets[-1] + 1 if self.offsets else 0)
+            self.offsets += [o for o in self._scan(resume) if not self.offsets or o > self.offsets[-1]]
+            self.index_status = 'extended'
+            break
+        else:
+            self.offsets = self._scan(0)
+        self._save(candidates)
+
+    def _save(self, candidates: List[str]) -> None:
+        header = MBOX_HEADER.pack(MBOX_MAGIC, self.size, len(self.offsets), self._probe(self.size))
+        body = struct.pack(f'<{len(self.offsets)}Q', *self.offsets)
+        for path in ([self.index_path] if self.index_path in candidates else []) + candidates:
+            try:
+                _write_atomic(path, header, body)
+                self.index_path = path
+                return
+            except OSError:
+                continue
+
+
+_mbox_maps: Dict[str, Any] = {}
+
+
+def _mbox_worker(task: tuple) -> List[Dict[str, Any]]:
+    """
+    分析 mbox 中连续的一段邮件（在工作进程中运行）
+
+    Args:
+        task: (mbox 路径, 首封邮件序号, 各邮件起始偏移, 最后一封的结束偏移)
+    """
+    path, first, offsets, last_end = task
+    mm = _mbox_maps.get(path)
+    if mm is None:
+        with open(path, 'rb') as f:
+            mm = _mbox_maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    results = []
+    for n, start in enumerate(offsets):
+        end = offsets[n + 1] if n + 1 < len(offsets) else last_end
+        label = f'{path}#{first + n}'
+        begin = time.perf_counter()
+        try:
+            result = {'path': label, 'status': 'ok',
+                      'verdict': analyze_bytes(mbox_message(mm, start, end), 'message.eml')}
+        except Exception as e:
+            result = {'path': label, 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+        result['elapsed'] = time.perf_counter() - begin
+        results.append(result)
+    return results
+
+
+def mbox_tasks(archive: MboxArchive, start: int = 0, stop: int = None) -> List[tuple]:
+    """把序号范围 [start, stop) 切成进程池任务，任务只携带偏移，不携带邮件内容"""
+    stop = len(archive) if stop is None else min(stop, len(archive))
+    tasks = []
+    for first in range(start, stop, MBOX_CHUNK):
+        last = min(first + MBOX_CHUNK, stop)
+        tasks.append((archive.path, first, archive.offsets[first:last], archive.span(last - 1)[1]))
+    return tasks
+
+
+def mbox_main(args) -> int:
+    """mbox 模式入口，返回进程退出码"""
+    R  = '\033[1;31m'
+    G  = '\033[1;32m'
+    C  = '\033[1;36m'
+    RS = '\033[0m'
+
+    if args.triage:
+        CONFIG['triage'] = True
+    if args.header_triage:
+        CONFIG['header_triage'] = True
+    if args.complete:
+        CONFIG['early_exit'] = False
+    start, _, stop = (args.range or '').partition(':')
+    start = int(start or 0)
+    stop = int(stop) if stop else None
+
+    tasks = []
+    for path in args.paths:
+        began = time.perf_counter()
+        archive = MboxArchive(path, args.index if len(args.paths) == 1 else '')
+        status = {'built': '新建', 'reused': '复用', 'extended': '增量更新'}[archive.index_status]
+        print(f"{C}▶  {path}: {len(archive)} 封邮件，{status}索引 {archive.index_path}"
+              f"（{time.perf_counter() - began:.2f} 秒）{RS}")
+        tasks += mbox_tasks(archive, start, stop)
+        archive.close()
+
+    workers = args.workers or os.cpu_count() or 1
+    jsonl = open(args.jsonl, 'w', encoding='utf-8') if args.jsonl else None
+    total = errors = malicious = 0
+    began = time.perf_counter()
+    executor = None
+    try:
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=_batch_worker_init,
+                                           initargs=(not args.verbose, dict(CONFIG)))
+            chunks = executor.map(_mbox_worker, tasks)
+        elif args.verbose:
+            chunks = map(_mbox_worker, tasks)
+        else:
+            def quiet(task):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return _mbox_worker(task)
+            chunks = map(quiet, tasks)
+        for results in chunks:
+            for result in results:
+                total += 1
+                if jsonl:
+                    jsonl.write(verdict_to_json(result) + '\n')
+                print(format_batch_result(result))
+                if result['status'] == 'error':
+                    errors += 1
+                elif result['verdict']['is_malicious']:
+                    malicious += 1
+    except KeyboardInterrupt:
+        print(f"\n{R}⚠  已中断{RS}")
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if jsonl:
+            jsonl.close()
+
+    elapsed = time.perf_counter() - began
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"\n{G}✔  完成 {total} 封（恶意 {malicious}，失败 {errors}），耗时 {elapsed:.1f} 秒，{rate:.1f} 封/秒{RS}")
+    return 1 if errors else 0
+
+
+def interactive_main() -> None:
+    """交互模式：逐条输入邮件路径并输出报告"""
     B  = '\033[1;34m'
     W  = '\033[1;37m'
     G  = '\033[1;32m'
@@ -2256,6 +6051,8 @@ if __name__ == "__main__":
     RS = '\033[0m'
 
     print_banner()
+    # 交互模式面向分析人员：运行全部检测器，报告保留完整证据
+    CONFIG['early_exit'] = False
 
     session_total  = 0
     session_errors = 0
@@ -2300,3 +6097,107 @@ if __name__ == "__main__":
         print(f"\n{B}{'─'*62}{RS}")
         print(f"{G}✔  第 {session_total} 封分析完成。继续输入下一封，或输入 q 退出。{RS}")
         print(f"{B}{'─'*62}{RS}\n")
+
+
+def main(argv: List[str] = None) -> int:
+    """命令行入口：无参数时进入交互模式"""
+    parser = argparse.ArgumentParser(description='恶意邮件智能鉴定工具')
+    parser.add_argument('--timings', action='store_true', help='在报告的评分汇总表旁显示各阶段耗时')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p_batch = subparsers.add_parser('batch', help='批量分析目录 / 通配符中的 .eml / .msg 文件')
+    p_batch.add_argument('paths', nargs='+', help='目录、通配符（如 "dump/**/*.eml"）或文件路径')
+    p_batch.add_argument('-j', '--workers', type=int, default=0, help='工作进程数（默认: CPU 核数）')
+    p_batch.add_argument('-v', '--verbose', action='store_true', help='显示解析/检测过程中的输出')
+    p_batch.add_argument('--jsonl', metavar='FILE', help='将每封邮件的结构化判定逐行写入 JSON Lines 文件')
+    p_batch.add_argument('--triage', action='store_true', help='分诊模式：跳过附件内容预览，只做快速判定')
+    p_batch.add_argument('--header-triage', action='store_true',
+                         help='头部分诊：先只分析邮件头，评分落在分诊区间内才完整分析')
+    p_batch.add_argument('--complete', action='store_true',
+                         help='运行全部检测器，不因结论已确定而提前结束（保留完整证据）')
+
+    p_nrd = subparsers.add_parser('nrd-build', help='将新注册域名数据源导入为离线索引')
+    p_nrd.add_argument('output', help='输出索引文件路径（配合 MER_NRD_INDEX 使用）')
+    p_nrd.add_argument('sources', nargs='+', help='CSV（domain,日期）或域名列表 / 区域差异文件')
+    p_nrd.add_argument('--date', help='域名列表类数据源的注册日期 YYYY-MM-DD（默认取文件修改日期）')
+
+    p_brand = subparsers.add_parser('brand-build', help='将受保护品牌/合作方域名列表预计算为仿冒索引')
+    p_brand.add_argument('output', help='输出索引文件路径（配合 MER_BRAND_INDEX 使用）')
+    p_brand.add_argument('sources', nargs='+', help='每行一个域名的列表文件')
+
+    p_serve = subparsers.add_parser('serve', help='守护进程模式：常驻进程池，通过 HTTP / Unix 套接字接收邮件')
+    p_serve.add_argument('--host', default='127.0.0.1', help='监听地址（默认: 127.0.0.1）')
+    p_serve.add_argument('--port', type=int, default=8025, help='监听端口（默认: 8025）')
+    p_serve.add_argument('--unix', metavar='PATH', help='改为监听 Unix 套接字')
+    p_serve.add_argument('-j', '--workers', type=int, default=0, help='工作进程数（默认: CPU 核数）')
+    p_serve.add_argument('-v', '--verbose', action='store_true', help='打印每个请求的访问日志')
+
+    p_smtp = subparsers.add_parser('smtp', help='SMTP 过滤代理：收信时检测，加判定头后转发或拒收')
+    p_smtp.add_argument('--relay', required=True, type=parse_relay, metavar='HOST[:PORT]',
+                        help='下一跳 SMTP 服务器（如 127.0.0.1:10026；省略端口时为 25）')
+    p_smtp.add_argument('--host', default='127.0.0.1', help='监听地址（默认: 127.0.0.1）')
+    p_smtp.add_argument('--port', type=int, default=10025, help='监听端口（默认: 10025）')
+    p_smtp.add_argument('-j', '--workers', type=int, default=0, help='工作进程数（默认: CPU 核数）')
+    p_smtp.add_argument('--budget', type=float, default=0, help='单封邮件检测时间预算（秒，默认 MER_SMTP_BUDGET）')
+    p_smtp.add_argument('--reject', action='store_true', help='判定为恶意的邮件以 550 拒收（默认只加判定头）')
+    p_smtp.add_argument('--fail-closed', action='store_true', help='检测超时或出错时以 451 临时拒收（默认放行）')
+    p_smtp.add_argument('-v', '--verbose', action='store_true', help='打印每封邮件的判定与耗时')
+
+    p_watch = subparsers.add_parser('watch', help='监视 Maildir 目录树，增量分析新到达的邮件')
+    p_watch.add_argument('paths', nargs='+', help='Maildir 根目录（可包含 Maildir++ 子文件夹或多个邮箱）')
+    p_watch.add_argument('-j', '--workers', type=int, default=0, help='工作进程数（默认: CPU 核数）')
+    p_watch.add_argument('--interval', type=float, default=2.0, help='轮询间隔（秒，默认 2）')
+    p_watch.add_argument('--checkpoint', metavar='FILE', help='检查点数据库（默认: 缓存目录下的 watch.sqlite3）')
+    p_watch.add_argument('--jsonl', metavar='FILE', help='将每封邮件的结构化判定追加写入 JSON Lines 文件')
+    p_watch.add_argument('--triage', action='store_true', help='分诊模式：跳过附件内容预览，只做快速判定')
+    p_watch.add_argument('--header-triage', action='store_true',
+                         help='头部分诊：先只分析邮件头，评分落在分诊区间内才完整分析')
+    p_watch.add_argument('--complete', action='store_true',
+                         help='运行全部检测器，不因结论已确定而提前结束（保留完整证据）')
+    p_watch.add_argument('--once', action='store_true', help='只扫描一轮新邮件后退出（适合定时任务）')
+
+    p_mbox = subparsers.add_parser('mbox', help='流式分析 mbox 归档（内存映射 + 持久化偏移索引）')
+    p_mbox.add_argument('paths', nargs='+', help='mbox 文件')
+    p_mbox.add_argument('-j', '--workers', type=int, default=0, help='工作进程数（默认: CPU 核数）')
+    p_mbox.add_argument('-v', '--verbose', action='store_true', help='显示解析/检测过程中的输出')
+    p_mbox.add_argument('--range', metavar='START:END', help='只分析序号在 [START, END) 内的邮件（从 0 开始）')
+    p_mbox.add_argument('--index', metavar='FILE', help='偏移索引文件（仅单个 mbox 时有效，默认 <mbox>.merx）')
+    p_mbox.add_argument('--jsonl', metavar='FILE', help='将每封邮件的结构化判定逐行写入 JSON Lines 文件')
+    p_mbox.add_argument('--triage', action='store_true', help='分诊模式：跳过附件内容预览，只做快速判定')
+    p_mbox.add_argument('--header-triage', action='store_true',
+                        help='头部分诊：先只分析邮件头，评分落在分诊区间内才完整分析')
+    p_mbox.add_argument('--complete', action='store_true',
+                        help='运行全部检测器，不因结论已确定而提前结束（保留完整证据）')
+
+    args = parser.parse_args(argv)
+    if args.timings:
+        CONFIG['show_timings'] = True
+    if args.command == 'serve':
+        return serve_main(args)
+    if args.command == 'smtp':
+        return smtp_main(args)
+    if args.command == 'watch':
+        return watch_main(args)
+    if args.command == 'mbox':
+        return mbox_main(args)
+    if args.command == 'batch':
+        return batch_main(args)
+    if args.command == 'nrd-build':
+        if args.date and _parse_feed_date(args.date) is None:
+            p_nrd.error(f"无法解析的注册日期: {args.date}（应为 YYYY-MM-DD）")
+        start = time.perf_counter()
+        count = build_nrd_index(args.sources, args.output, args.date)
+        print(f"✔  已写入 {count} 个域名到 {args.output}（耗时 {time.perf_counter() - start:.1f} 秒）")
+        return 0
+    if args.command == 'brand-build':
+        start = time.perf_counter()
+        count = build_brand_index(args.sources, args.output)
+        print(f"✔  已写入 {count} 个受保护域名到 {args.output}（耗时 {time.perf_counter() - start:.1f} 秒）")
+        return 0
+
+    interactive_main()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())